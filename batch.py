@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''converts many images in one run
+
+ usage: batch.py [--platform sms|gg|sg] [--workers N] [-gs] [--resize W,H] [--dedupe] [--dither [floyd|bayer|noise] | --no-dither] [--optimize] [--dual-palette] [--stream] [--compress pscompr|zx7] [--sprites W,H] [--no-cache] [--stats FILE] path [path ..]
+
+ A path may be an image, a directory (all images inside are converted) or
+ a glob pattern. The images are distributed over a pool of worker
+ processes, every worker imports numpy and PIL only once. --stats appends
+ the timings and counters of every conversion to FILE as JSON lines.'''
+
+import os
+from os import path
+import sys
+import io
+import glob
+import importlib
+from contextlib import redirect_stdout
+from time import perf_counter
+
+from compress import CODECS
+from profiles import DITHER_MODES, sprite_conflicts
+
+PLATFORMS = {"sms": "gfx2sms", "gg": "gfx2gg", "sg": "gfx2sg"}
+
+IMAGE_EXTENSIONS = (".png", ".gif", ".bmp", ".tga", ".pcx")
+
+
+def collect_files(patterns):
+    '''expands directories and glob patterns to a sorted list of image files'''
+
+    files = []
+    for pattern in patterns:
+        if path.isdir(pattern):
+            for root, _, names in os.walk(pattern):
+                files.extend(path.join(root, name) for name in names if name.lower().endswith(IMAGE_EXTENSIONS))
+        elif path.exists(pattern):
+            files.append(pattern)
+        else:
+            files.extend(name for name in glob.glob(pattern, recursive=True) if path.isfile(name))
+    return sorted(dict.fromkeys(files))
+
+def convert_file(platform, file_name, options):
+    '''converts a single image and returns a result record'''
+
+    record = {"file": file_name, "platform": platform, "ok": True, "error": None}
+    start = perf_counter()
+    output = io.StringIO()
+    try:
+        module = importlib.import_module(PLATFORMS[platform])
+        with redirect_stdout(output):
+            outputs = module.convert(file_name, **options)
+        if outputs is None:
+            # the converters print why, the timestamped lines are progress
+            messages = [line for line in output.getvalue().splitlines() if line.strip() and not line.startswith("[")]
+            record["ok"] = False
+            record["error"] = messages[-1] if messages else "can't be converted"
+    except Exception as error:
+        record["ok"] = False
+        record["error"] = "%s: %s" % (type(error).__name__, error)
+    record["seconds"] = perf_counter() - start
+    record["log"] = output.getvalue()
+    return record
+
+def run(files, platform="sms", options=None, workers=None):
+    '''converts all files in a process pool, returns the records in input order'''
+
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    options = options or {}
+    start = perf_counter()
+    records = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(convert_file, platform, file_name, options): file_name for file_name in files}
+        for future in as_completed(futures):
+            record = future.result()
+            records[record["file"]] = record
+            status = "ok" if record["ok"] else "failed (%s)" % record["error"]
+            print("%s %.3fs %s" % (record["file"], record["seconds"], status))
+    elapsed = perf_counter() - start
+    failed = sum(1 for record in records.values() if not record["ok"])
+    print("%d images (%d failed) in %.3fs, %.1f images/s" % (len(files), failed, elapsed,
+          len(files) / elapsed if elapsed else 0.0))
+    return [records[file_name] for file_name in files]
+
+def main():
+    args = sys.argv[1:]
+    platform, workers = "sms", None
+    options = {"grayscale": False, "resize": None, "dedupe": False, "use_cache": True, "dithering": None,
+               "optimize": False, "stream": False, "compression": None, "quiet": False, "stats": None,
+               "sprites": None, "palettes": 1}
+    patterns = []
+    while args:
+        arg = args.pop(0)
+        if arg == "--platform" and args:
+            platform = args.pop(0).lower()
+        elif arg == "--workers" and args:
+            workers = int(args.pop(0))
+        elif arg == "-gs":
+            options["grayscale"] = True
+        elif arg == "--resize" and args:
+            options["resize"] = tuple(map(lambda x: int(x), args.pop(0).split(',')))
+        elif arg == "--dedupe":
+            options["dedupe"] = True
+        elif arg == "--no-cache":
+            options["use_cache"] = False
+        elif arg == "--sprites" and args:
+            options["sprites"] = tuple(map(int, args.pop(0).split(',')))
+        elif arg == "--stats" and args:
+            options["stats"] = path.abspath(args.pop(0))
+        elif arg == "--compress" and args:
+            options["compression"] = args.pop(0).lower()
+        elif arg == "--optimize":
+            options["optimize"] = True
+        elif arg == "--dual-palette":
+            options["palettes"] = 2
+        elif arg == "--stream":
+            options["stream"] = True
+        elif arg == "--dither" and args and args[0].lower() in DITHER_MODES:
+            options["dithering"] = args.pop(0).lower()
+        elif arg in ("--dither", "--no-dither"):
+            options["dithering"] = arg == "--dither"
+        else:
+            patterns.append(arg)
+
+    if platform not in PLATFORMS:
+        print("unknown platform %s" % platform)
+        return
+    if options["compression"] and options["compression"] not in CODECS:
+        print("unknown compression %s" % options["compression"])
+        return
+    if options["sprites"] and sprite_conflicts(options):
+        print("--sprites can't be combined with %s" % ", ".join(sprite_conflicts(options)))
+        return
+    files = collect_files(patterns)
+    if not files:
+        print("no images found")
+        return
+    if not all(record["ok"] for record in run(files, platform, options, workers)):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
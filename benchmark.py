@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''timings of the conversion and rom analysis stages
+
+ usage: benchmark.py [--quick] [--repeat N] [--save FILE] [--compare FILE] [--threshold PERCENT] [--reference] [--startup]
+
+ Every stage runs on synthetic images of several sizes and color counts,
+ on the bundled images and on generated roms from 32KB to 1MB. The best
+ of N runs is reported. --save stores the timings as JSON baseline,
+ --compare reports stages which got slower than the baseline by more
+ than the threshold and exits with 1 if there are any. --reference also
+ times the serial dithering loop, which is slow.
+
+ The startup stages run the command line tools in a fresh interpreter
+ with arguments which end in an error message and measure the time to
+ their first output. More than STARTUP_BUDGET above the bare interpreter
+ start is reported and exits with 1 as well, --startup runs only these.'''
+
+import os
+from os import path
+import sys
+import json
+import tempfile
+import subprocess
+from time import perf_counter
+
+import numpy as np
+from PIL import Image
+
+import compress
+import gfx2sms
+import gfxengine
+import dither
+import palette
+import quantize
+import sequence
+import sprites
+import tiles
+import tileset
+import smsheader
+
+IMAGE_SIZES = ((64, 64), (128, 128), (256, 192), (256, 240))
+COLOR_COUNTS = (16, 256, 4096)
+BUNDLED_IMAGES = ("cover.png", "font.png", "harry_06.png")
+ROM_SIZES = (32 * 1024, 128 * 1024, 512 * 1024, 1024 * 1024)
+# frames of 32x32 pixels, built from a few distinct sprites
+SPRITE_FRAMES = (16, 256)
+# screens of 32x24 tiles, a few of them change from frame to frame
+SEQUENCE_FRAMES = (16, 128)
+# map cells made of a few hundred tiles with noise, merged to fit VRAM
+TILESET_CELLS = (4096, 65536)
+# screens of tiles using 8 of 32 colors, split into two palettes
+PALETTE_TILES = (768, 4096)
+
+# differences below this are timer noise, not regressions
+MIN_DELTA = 0.001
+
+# command lines which fail early, the tools must answer them without loading numpy, PIL or the engine
+STARTUP_COMMANDS = (
+    ("gfx2sms", ["gfx2sms.py"]),
+    ("gfx2sms_missing", ["gfx2sms.py", "missing.png", "--dedupe"]),
+    ("gfx2gg", ["gfx2gg.py"]),
+    ("gfx2sg", ["gfx2sg.py"]),
+    ("smsheader", ["smsheader.py"]),
+    ("batch", ["batch.py", "missing*.png"]),
+    ("compress", ["compress.py"]),
+    ("watch", ["watch.py"]),
+    ("gfxserver_send", ["gfxserver.py", "--send"]),
+)
+# seconds a tool may take until its first output on top of the interpreter start
+STARTUP_BUDGET = 0.05
+
+
+def synthetic_image(width, height, colors, seed=0):
+    '''smooth gradients quantized to a random set of colors'''
+
+    rng = np.random.default_rng(seed)
+    palette = rng.integers(0, 256, (colors, 3), dtype=np.uint8)
+    ys, xs = np.mgrid[0:height, 0:width]
+    field = (np.sin(xs / 11.0) + np.cos(ys / 7.0) + rng.random((height, width)) * 0.5) / 2.5
+    indices = ((field - field.min()) / (np.ptp(field) or 1) * (colors - 1)).astype(np.int64)
+    return palette[indices]
+
+def synthetic_rom(size, seed=0):
+    rng = np.random.default_rng(seed)
+    data = rng.integers(0, 256, size, dtype=np.uint8)
+    data[smsheader.HEADER_POSITION:smsheader.HEADER_POSITION + 8] = np.frombuffer(b"TMR SEGA", dtype=np.uint8)
+    return data.tobytes()
+
+def best_of(repeat, function, *args):
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        function(*args)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def first_output(args):
+    '''seconds from starting a python process until it writes its first line'''
+
+    start = perf_counter()
+    process = subprocess.Popen([sys.executable] + args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                               cwd=path.dirname(path.abspath(__file__)))
+    process.stdout.readline()
+    elapsed = perf_counter() - start
+    process.communicate()
+    return elapsed
+
+def startup_stages(repeat):
+    '''times the command line tools from a cold start to their first output'''
+
+    # at least a few runs, single process starts vary a lot
+    repeat = max(repeat, 5)
+    results = {"startup/python": best_of(repeat, first_output, ["-c", "print()"])}
+    for name, args in STARTUP_COMMANDS:
+        results["startup/" + name] = best_of(repeat, first_output, args)
+    return results
+
+def over_budget(results, budget=STARTUP_BUDGET):
+    '''returns the startup stages which exceed the interpreter start by more than budget seconds'''
+
+    base = results["startup/python"]
+    return [(stage, seconds - base) for stage, seconds in sorted(results.items())
+            if stage.startswith("startup/") and seconds - base > budget]
+
+def image_stages(name, pixels, repeat, reference):
+    '''times the conversion stages of gfx2sms.convert on an rgb array'''
+
+    results = {}
+    unique, counts = np.unique(pixels.reshape(-1, 3), axis=0, return_counts=True)
+    colors = [tuple(color) for color in unique.tolist()]
+    lut = quantize.load_lut(gfx2sms.SMS_COLOR_PALETTE)
+    matched = quantize.nearest(colors, gfx2sms.SMS_COLOR_PALETTE)
+    used = list(dict.fromkeys(matched))[:2**gfx2sms.PAL_COLORS]
+    color_index = dict((color, idx) for idx, color in enumerate(used))
+
+    results["match_colors/" + name] = best_of(repeat, quantize.nearest, colors, gfx2sms.SMS_COLOR_PALETTE)
+    # the sms palette is matched per channel, the memo pays off for the others
+    memo = quantize.color_memo()
+    results["match_colors_sg/" + name] = best_of(repeat, quantize.nearest_indices, colors, gfxengine.SG_COLOR_PALETTE)
+    memo.nearest_indices(colors, gfxengine.SG_COLOR_PALETTE)
+    results["memo_colors_sg/" + name] = best_of(repeat, memo.nearest_indices, colors, gfxengine.SG_COLOR_PALETTE)
+    results["optimize_palette/" + name] = best_of(repeat, palette.optimize_palette, colors, counts,
+                                                  gfx2sms.SMS_COLOR_PALETTE)
+    results["lut_lookup/" + name] = best_of(repeat, quantize.lookup, pixels, lut)
+    results["dither/" + name] = best_of(repeat, dither.dither, pixels, gfx2sms.SMS_COLOR_PALETTE, used,
+                                        dither.SKIP_THRESHOLD, dither.LUMA_WEIGHTS, lut)
+    for mode in dither.ORDERED_MODES:
+        results["dither_%s/%s" % (mode, name)] = best_of(repeat, dither.dither, pixels, gfx2sms.SMS_COLOR_PALETTE,
+                                                         used, dither.SKIP_THRESHOLD, dither.LUMA_WEIGHTS, lut, mode)
+    if reference:
+        img = Image.fromarray(pixels)
+        results["dither_reference/" + name] = best_of(1, gfx2sms.dithering_reference, img, used)
+
+    dithered = dither.dither(pixels, gfx2sms.SMS_COLOR_PALETTE, used, lut=lut)
+    results["index_image/" + name] = best_of(repeat, tiles.index_image, dithered, color_index)
+    indexed = tiles.index_image(dithered, color_index)
+    results["encode_tiles/" + name] = best_of(repeat, tiles.encode_image, indexed, gfx2sms.PAL_COLORS)
+    data = tiles.encode_image(indexed, gfx2sms.PAL_COLORS)
+    results["decode_tiles/" + name] = best_of(repeat, tiles.decode_tiles, data, gfx2sms.PAL_COLORS)
+    results["dedupe_tiles/" + name] = best_of(repeat, tiles.dedupe_tiles, tiles.split_tiles(indexed), gfx2sms.PAL_COLORS)
+    return results
+
+def rom_stages(size, repeat):
+    '''times the smsheader checksum functions on a generated rom'''
+
+    results = {}
+    name = "%dKB" % (size // 1024)
+    with tempfile.NamedTemporaryFile(suffix=".sms", delete=False) as writer:
+        writer.write(synthetic_rom(size))
+    try:
+        def analyse():
+            with smsheader.Rom(writer.name) as rom:
+                smsheader.analyse_rom(rom)
+
+        def checksums():
+            with smsheader.Rom(writer.name) as rom:
+                smsheader.calc_checksum(rom, 0, rom.size)
+                smsheader.compute_checksum(rom, 0x1)
+                smsheader.calc_codies_checksum(rom, size // 0x4000)
+
+        def crc():
+            with smsheader.Rom(writer.name) as rom:
+                smsheader.crc_file(rom)
+
+        results["rom_checksums/" + name] = best_of(repeat, checksums)
+        results["rom_crc32/" + name] = best_of(repeat, crc)
+        results["rom_analyse/" + name] = best_of(repeat, analyse)
+    finally:
+        os.remove(writer.name)
+    return results
+
+def delta_sequence(frames):
+    return list(sequence.delta_frames(frames, sequence.TileSlots()))
+
+def split_tiles(cells, distances):
+    return palette.split_palettes(palette.tile_histogram(cells, len(distances)), distances)
+
+def run(repeat=3, quick=False, reference=False, startup=False):
+    results = startup_stages(repeat)
+    if startup:
+        return results
+    sizes = IMAGE_SIZES[:2] if quick else IMAGE_SIZES
+    counts = COLOR_COUNTS[:2] if quick else COLOR_COUNTS
+    for width, height in sizes:
+        for colors in counts:
+            pixels = synthetic_image(width, height, colors)
+            results.update(image_stages("%dx%d-%dc" % (width, height, colors), pixels, repeat, reference))
+
+    directory = path.dirname(path.abspath(__file__))
+    for file_name in BUNDLED_IMAGES:
+        with Image.open(path.join(directory, file_name)) as img:
+            pixels = np.asarray(img.convert("RGB"))
+        results.update(image_stages(file_name, pixels, repeat, reference))
+        img = Image.fromarray(pixels)
+        for platform in sorted(gfxengine.PROFILES):
+            results["convert_%s/%s" % (platform, file_name)] = best_of(repeat, gfxengine.convert_image, img, platform)
+        data = gfxengine.convert_image(img, "sms").tiles
+        for codec in sorted(compress.CODECS):
+            results["%s/%s" % (codec, file_name)] = best_of(repeat, compress.compress, data, codec)
+
+    for count in SPRITE_FRAMES[:1] if quick else SPRITE_FRAMES:
+        rng = np.random.default_rng(count)
+        parts = rng.integers(0, 16, (8, sprites.SPRITE_HEIGHT, sprites.SPRITE_WIDTH), dtype=np.uint8)
+        picks = rng.integers(0, len(parts), (count, 2, 4))
+        frames = parts[picks].swapaxes(2, 3).reshape(count, 32, 32)
+        results["build_sprites/%dframes" % count] = best_of(repeat, sprites.build_sprites, frames)
+
+    for count in SEQUENCE_FRAMES[:1] if quick else SEQUENCE_FRAMES:
+        rng = np.random.default_rng(count)
+        parts = rng.integers(0, 16, (64, tiles.TILE_HEIGHT, tiles.TILE_WIDTH), dtype=np.uint8)
+        picks = np.repeat(rng.integers(0, len(parts), (1, 32 * 24)), count, axis=0)
+        for frame in range(1, count):
+            picks[frame:, rng.integers(0, 32 * 24, 16)] = rng.integers(0, len(parts), 16)
+        frames = parts[picks]
+        results["delta_frames/%dframes" % count] = best_of(repeat, delta_sequence, frames)
+
+    for count in TILESET_CELLS[:1] if quick else TILESET_CELLS:
+        rng = np.random.default_rng(count)
+        parts = rng.integers(0, 16, (300, tiles.TILE_HEIGHT, tiles.TILE_WIDTH), dtype=np.uint8)
+        cells = parts[rng.integers(0, len(parts), count)]
+        noise = rng.random(cells.shape) < 0.02
+        cells[noise] = rng.integers(0, 16, noise.sum())
+        results["build_tileset/%dcells" % count] = best_of(repeat, tileset.build_tileset, [cells],
+                                                           gfx2sms.SMS_COLOR_PALETTE[:16])
+
+    distances = quantize.palette_distances(gfx2sms.SMS_COLOR_PALETTE[:32])
+    for count in PALETTE_TILES[:1] if quick else PALETTE_TILES:
+        rng = np.random.default_rng(count)
+        offsets = rng.integers(0, 3, (count, 1, 1)) * 8
+        cells = offsets + rng.integers(0, 8, (count, tiles.TILE_HEIGHT, tiles.TILE_WIDTH))
+        results["split_palettes/%dtiles" % count] = best_of(repeat, split_tiles, cells, distances)
+
+    for size in ROM_SIZES[:2] if quick else ROM_SIZES:
+        results.update(rom_stages(size, repeat))
+    return results
+
+def compare(results, baseline, threshold):
+    '''returns the stages which are slower than the baseline by more than threshold (a fraction)'''
+
+    regressions = []
+    for stage, seconds in sorted(results.items()):
+        if stage in baseline and seconds > baseline[stage] * (1 + threshold) and seconds - baseline[stage] > MIN_DELTA:
+            regressions.append((stage, baseline[stage], seconds))
+    return regressions
+
+def main():
+    args = sys.argv[1:]
+    repeat, quick, reference, save, baseline_file, threshold, startup = 3, False, False, None, None, 20.0, False
+    while args:
+        arg = args.pop(0)
+        if arg == "--repeat" and args:
+            repeat = int(args.pop(0))
+        elif arg == "--quick":
+            quick = True
+        elif arg == "--reference":
+            reference = True
+        elif arg == "--startup":
+            startup = True
+        elif arg == "--save" and args:
+            save = args.pop(0)
+        elif arg == "--compare" and args:
+            baseline_file = args.pop(0)
+        elif arg == "--threshold" and args:
+            threshold = float(args.pop(0))
+        else:
+            print("unknown argument %s" % arg)
+            return 2
+
+    results = run(repeat, quick, reference, startup)
+    for stage, seconds in sorted(results.items()):
+        print("%-40s %10.3fms" % (stage, seconds * 1000))
+    slow = over_budget(results)
+    for stage, seconds in slow:
+        print("over budget %-28s %10.3fms above the interpreter start (budget %.0fms)" % (stage, seconds * 1000,
+              STARTUP_BUDGET * 1000))
+
+    if save:
+        with open(save, "w") as writer:
+            json.dump(results, writer, indent=1, sort_keys=True)
+
+    if baseline_file:
+        with open(baseline_file) as reader:
+            baseline = json.load(reader)
+        regressions = compare(results, baseline, threshold / 100.0)
+        for stage, before, after in regressions:
+            print("regression %-29s %10.3fms -> %.3fms (%+.0f%%)" % (stage, before * 1000, after * 1000,
+                  (after / before - 1) * 100))
+        if regressions:
+            return 1
+        print("no regressions beyond %.0f%%" % threshold)
+    return 1 if slow else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
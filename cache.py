@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''content-addressed cache for converter output
+
+ An entry is keyed on the decoded pixels of the source image, the
+ converter options, the target platform and the converter version. On a
+ hit the stored output files are copied next to the requested output
+ names instead of converting the image again. The least recently used
+ entries are removed when the cache grows beyond MAX_CACHE_SIZE.
+
+ usage: cache.py [--clear]'''
+
+import os
+from os import path
+import sys
+import json
+import shutil
+import hashlib
+import threading
+
+from profiles import CACHE_DIR as BASE_DIR
+
+CACHE_DIR = path.join(BASE_DIR, "conversions")
+STATS_FILE = path.join(CACHE_DIR, "stats.json")
+
+MAX_CACHE_SIZE = int(os.environ.get("GFX2SEGA8_CACHE_SIZE", 64 * 1024 * 1024))
+
+
+def cache_key(img, platform, version, options):
+    '''hashes pixels, palette, platform, converter version and options of an opened image'''
+
+    digest = hashlib.sha256()
+    digest.update(("%s %s %s %s %s\n" % (platform, ".".join(map(str, version)), img.mode, img.size,
+                                         sorted(options.items()))).encode("utf-8"))
+    if img.mode == "P":
+        digest.update(bytes(img.getpalette() or []))
+    digest.update(img.tobytes())
+    return digest.hexdigest()
+
+def _entry_dir(key):
+    return path.join(CACHE_DIR, key[:2], key)
+
+def _temp_name(name):
+    # the conversions of other processes and of gfxserver threads run at the same time
+    return "%s.%d.%d.tmp" % (name, os.getpid(), threading.get_ident())
+
+def _update_stats(hit):
+    stats = read_stats()
+    stats["hits" if hit else "misses"] += 1
+    temp_name = _temp_name(STATS_FILE)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(temp_name, "w") as writer:
+            json.dump(stats, writer)
+        # readers never see a partly written file
+        os.replace(temp_name, STATS_FILE)
+    except OSError:
+        try:
+            os.remove(temp_name)
+        except OSError:
+            pass
+
+def read_stats():
+    try:
+        with open(STATS_FILE) as reader:
+            return json.load(reader)
+    except (OSError, ValueError):
+        return {"hits": 0, "misses": 0}
+
+def fetch(key, targets):
+    '''copies the cached files to targets (extension -> output file name),
+    returns False when the entry is missing or incomplete'''
+
+    entry = _entry_dir(key)
+    sources = {extension: path.join(entry, "data" + extension) for extension in targets}
+    if not all(path.isfile(source) for source in sources.values()):
+        _update_stats(False)
+        return False
+    try:
+        for extension, target in targets.items():
+            # the converters rewrite their output in place, a hard link would alter the cache entry
+            shutil.copyfile(sources[extension], target)
+        # the modification time of the entry is its last use
+        os.utime(entry)
+    except OSError:
+        # another process replaced or evicted the entry meanwhile
+        _update_stats(False)
+        return False
+    _update_stats(True)
+    return True
+
+def store(key, sources):
+    '''stores the output files (extension -> file name) under key'''
+
+    entry = _entry_dir(key)
+    temp_entry = _temp_name(entry)
+    try:
+        os.makedirs(temp_entry, exist_ok=True)
+        for extension, source in sources.items():
+            shutil.copyfile(source, path.join(temp_entry, "data" + extension))
+        if path.isdir(entry):
+            shutil.rmtree(entry, ignore_errors=True)
+        os.replace(temp_entry, entry)
+    except OSError:
+        shutil.rmtree(temp_entry, ignore_errors=True)
+        return
+    try:
+        evict()
+    except OSError:
+        pass
+
+def _entries():
+    '''returns (last use, size, directory) of every cache entry'''
+
+    entries = []
+    if not path.isdir(CACHE_DIR):
+        return entries
+    for prefix in os.listdir(CACHE_DIR):
+        prefix_dir = path.join(CACHE_DIR, prefix)
+        if not path.isdir(prefix_dir):
+            continue
+        try:
+            names = os.listdir(prefix_dir)
+        except OSError:
+            continue
+        for name in names:
+            entry = path.join(prefix_dir, name)
+            if name.endswith(".tmp") or not path.isdir(entry):
+                continue
+            # other processes store and evict entries at the same time, the vanished ones are skipped
+            try:
+                size = sum(path.getsize(path.join(entry, item)) for item in os.listdir(entry))
+                entries.append((path.getmtime(entry), size, entry))
+            except OSError:
+                continue
+    return entries
+
+def evict(max_size=None):
+    '''removes the least recently used entries until the cache fits into max_size bytes'''
+
+    max_size = MAX_CACHE_SIZE if max_size is None else max_size
+    entries = sorted(_entries())
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in entries:
+        if total <= max_size:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+
+def main():
+    if "--clear" in sys.argv[1:]:
+        evict(0)
+        if path.exists(STATS_FILE):
+            os.remove(STATS_FILE)
+    entries = _entries()
+    stats = read_stats()
+    lookups = stats["hits"] + stats["misses"]
+    print("entries: %d (%d bytes, limit %d)" % (len(entries), sum(size for _, size, _ in entries), MAX_CACHE_SIZE))
+    print("hits: %d misses: %d (hit rate %.1f%%)" % (stats["hits"], stats["misses"],
+          100.0 * stats["hits"] / lookups if lookups else 0.0))
+
+if __name__ == '__main__':
+    main()
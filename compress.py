@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''compression of planar tile data
+
+ usage: compress.py [--codec pscompr|zx7|all] [--bpp N] file [file ..]
+
+ pscompr  Phantasy Star RLE. The bitplanes are stored one after the other
+          (every 4th byte for 4bpp tiles), every plane is a list of
+          blocks ended by a 0 byte. A block byte with bit 7 set is
+          followed by (byte & 0x7f) raw bytes, otherwise by one byte
+          which is repeated byte times.
+ zx7      Einar Saukas' LZ77/Elias gamma format, compatible with the
+          standard Z80 decompressors. Matches are found with hash chains
+          and the cheapest sequence of literals and matches is chosen
+          backwards from the end of the data.
+
+ Every codec has a reference decompressor in Python, the command line
+ writes file.<codec>, checks the round trip and prints ratio and speed.'''
+
+import sys
+from os import path
+from time import perf_counter
+
+PSCOMPR_MAX_BLOCK = 0x7f
+
+ZX7_MAX_OFFSET = 2176
+ZX7_SHORT_OFFSET = 128
+ZX7_MAX_LENGTH = 65536
+# match candidates looked at per position
+ZX7_CHAIN_DEPTH = 64
+
+
+def pscompr_encode_plane(plane):
+    '''encodes the bytes of one bitplane, runs of 3 or more bytes are repeated'''
+
+    import numpy as np
+
+    plane = np.frombuffer(bytes(plane), dtype=np.uint8)
+    output = bytearray()
+    if len(plane):
+        starts = np.flatnonzero(np.concatenate(([True], plane[1:] != plane[:-1])))
+        lengths = np.diff(np.append(starts, len(plane)))
+    else:
+        starts = lengths = ()
+    raw = bytearray()
+
+    def flush_raw():
+        for offset in range(0, len(raw), PSCOMPR_MAX_BLOCK):
+            block = raw[offset:offset + PSCOMPR_MAX_BLOCK]
+            output.append(0x80 | len(block))
+            output.extend(block)
+        del raw[:]
+
+    for start, length in zip(starts, lengths):
+        value = int(plane[start])
+        if length < 3:
+            raw.extend([value] * int(length))
+            continue
+        flush_raw()
+        for offset in range(0, int(length), PSCOMPR_MAX_BLOCK):
+            output.extend((min(PSCOMPR_MAX_BLOCK, length - offset), value))
+    flush_raw()
+    output.append(0)
+    return bytes(output)
+
+def pscompr_encode(data, bpp=4):
+    data = bytes(data)
+    if len(data) % bpp:
+        raise ValueError("data isn't a multiple of %d bytes" % bpp)
+    return b"".join(pscompr_encode_plane(data[plane::bpp]) for plane in range(bpp))
+
+def pscompr_decode(data, bpp=4):
+    planes = []
+    position = 0
+    for _ in range(bpp):
+        plane = bytearray()
+        while True:
+            block = data[position]
+            position += 1
+            if block == 0:
+                break
+            if block & 0x80:
+                count = block & 0x7f
+                plane.extend(data[position:position + count])
+                position += count
+            else:
+                plane.extend(bytes([data[position]]) * block)
+                position += 1
+        planes.append(plane)
+    if len(set(map(len, planes))) > 1:
+        raise ValueError("bitplanes differ in size")
+    output = bytearray(len(planes[0]) * bpp)
+    for plane, values in enumerate(planes):
+        output[plane::bpp] = values
+    return bytes(output)
+
+def _gamma_bits(value):
+    return 2 * value.bit_length() - 1
+
+def _match_cost(offset, length):
+    return 1 + _gamma_bits(length - 1) + (8 if offset <= ZX7_SHORT_OFFSET else 12)
+
+def _match_length(data, first, second, limit):
+    '''length of the common prefix of data[first:] and data[second:], at most limit'''
+
+    # compare growing blocks, then narrow the first differing block down
+    low, step = 0, 16
+    while True:
+        high = min(low + step, limit)
+        if data[first + low:first + high] != data[second + low:second + high]:
+            break
+        if high == limit:
+            return limit
+        low, step = high, step * 2
+    while high - low > 1:
+        middle = (low + high) // 2
+        if data[first + low:first + middle] == data[second + low:second + middle]:
+            low = middle
+        else:
+            high = middle
+    return low
+
+def _find_matches(data, depth=ZX7_CHAIN_DEPTH):
+    '''returns for every position the longest match with a short and with
+    any offset as ((offset, length), (offset, length)), found by following
+    the chain of earlier positions with the same two bytes'''
+
+    head = {}
+    chain = [0] * len(data)
+    matches = [None] * len(data)
+    for position in range(len(data) - 1):
+        key = data[position:position + 2]
+        limit = min(ZX7_MAX_LENGTH, len(data) - position)
+        short = longest = (0, 0)
+        candidate = head.get(key, -1)
+        steps = 0
+        while candidate >= 0 and position - candidate <= ZX7_MAX_OFFSET and steps < depth:
+            offset = position - candidate
+            best = short[1] if offset <= ZX7_SHORT_OFFSET else longest[1]
+            # only a longer match is of interest, its last byte has to match
+            if data[candidate + best] != data[position + best]:
+                candidate = chain[candidate]
+                steps += 1
+                continue
+            length = _match_length(data, candidate, position, limit)
+            if length > longest[1]:
+                longest = (offset, length)
+            if offset <= ZX7_SHORT_OFFSET and length > short[1]:
+                short = (offset, length)
+            if longest[1] == limit:
+                break
+            candidate = chain[candidate]
+            steps += 1
+        chain[position] = head.get(key, -1)
+        head[key] = position
+        if longest[1] >= 2:
+            matches[position] = (short, longest)
+    return matches
+
+def _lengths(length):
+    '''lengths worth trying for a match: the longest of every gamma size and length itself'''
+
+    value = 2
+    while value < length:
+        yield value
+        value = value * 2
+    yield length
+
+def zx7_encode(data, depth=ZX7_CHAIN_DEPTH):
+    data = bytes(data)
+    if not data:
+        raise ValueError("nothing to compress")
+    size = len(data)
+    matches = _find_matches(data, depth)
+    # cost[i]: bits needed for data[i:], step[i]: (offset, length) or None for a literal
+    cost = [0] * (size + 1)
+    step = [None] * (size + 1)
+    for position in range(size - 1, 0, -1):
+        cost[position] = cost[position + 1] + 9
+        if matches[position] is None:
+            continue
+        for offset, length in matches[position]:
+            for candidate in _lengths(length) if length >= 2 else ():
+                bits = _match_cost(offset, candidate) + cost[position + candidate]
+                if bits < cost[position]:
+                    cost[position] = bits
+                    step[position] = (offset, candidate)
+
+    output = bytearray(data[:1])
+    state = {"mask": 0, "index": 0}
+
+    def write_bit(value):
+        if not state["mask"]:
+            state["mask"] = 0x80
+            state["index"] = len(output)
+            output.append(0)
+        if value:
+            output[state["index"]] |= state["mask"]
+        state["mask"] >>= 1
+
+    def write_gamma(value):
+        bits = value.bit_length()
+        for _ in range(bits - 1):
+            write_bit(0)
+        for shift in range(bits - 1, -1, -1):
+            write_bit(value >> shift & 1)
+
+    position = 1
+    while position < size:
+        if step[position] is None:
+            write_bit(0)
+            output.append(data[position])
+            position += 1
+            continue
+        offset, length = step[position]
+        write_bit(1)
+        write_gamma(length - 1)
+        offset -= 1
+        if offset < ZX7_SHORT_OFFSET:
+            output.append(offset)
+        else:
+            offset -= ZX7_SHORT_OFFSET
+            output.append((offset & 0x7f) | 0x80)
+            for shift in range(10, 6, -1):
+                write_bit(offset >> shift & 1)
+        position += length
+
+    # end marker
+    write_bit(1)
+    for _ in range(16):
+        write_bit(0)
+    write_bit(1)
+    return bytes(output)
+
+def zx7_decode(data):
+    output = bytearray(data[:1])
+    state = {"mask": 0, "flags": 0, "position": 1}
+
+    def read_byte():
+        value = data[state["position"]]
+        state["position"] += 1
+        return value
+
+    def read_bit():
+        if not state["mask"]:
+            state["mask"] = 0x80
+            state["flags"] = read_byte()
+        bit = 1 if state["flags"] & state["mask"] else 0
+        state["mask"] >>= 1
+        return bit
+
+    while True:
+        if not read_bit():
+            output.append(read_byte())
+            continue
+        zeros = 0
+        while not read_bit():
+            zeros += 1
+            if zeros == 16:
+                return bytes(output)
+        value = 1
+        for _ in range(zeros):
+            value = value << 1 | read_bit()
+        length = value + 1
+        offset = read_byte()
+        if offset & 0x80:
+            high = 0
+            for _ in range(4):
+                high = high << 1 | read_bit()
+            offset = (offset & 0x7f | high << 7) + ZX7_SHORT_OFFSET
+        start = len(output) - offset - 1
+        if start < 0:
+            raise ValueError("offset points before the data")
+        # byte by byte, matches may overlap with their own output
+        for idx in range(length):
+            output.append(output[start + idx])
+
+# name: (file extension, encoder(data, bpp), decoder(data, bpp))
+CODECS = {
+    "pscompr": (".pscompr", pscompr_encode, pscompr_decode),
+    "zx7": (".zx7", lambda data, bpp=4: zx7_encode(data), lambda data, bpp=4: zx7_decode(data)),
+}
+
+def compress(data, codec, bpp=4):
+    return CODECS[codec][1](data, bpp)
+
+def decompress(data, codec, bpp=4):
+    return CODECS[codec][2](data, bpp)
+
+def report(name, codec, size, packed, seconds):
+    '''ratio and encode throughput of a compression run'''
+
+    return "%s %s: %d -> %d bytes (%.1f%%), %.1f KB/s" % (name, codec, size, packed,
+            100.0 * packed / size if size else 0.0, size / 1024.0 / seconds if seconds else 0.0)
+
+def compress_file(file_name, codec, bpp=4, output_name=None, check=True):
+    '''writes the compressed file_name, returns the report line'''
+
+    with open(file_name, "rb") as reader:
+        data = reader.read()
+    start = perf_counter()
+    packed = compress(data, codec, bpp)
+    seconds = perf_counter() - start
+    if check and decompress(packed, codec, bpp) != data:
+        raise ValueError("%s round trip failed for %s" % (codec, file_name))
+    output_name = output_name or path.splitext(file_name)[0] + CODECS[codec][0]
+    with open(output_name, "wb") as writer:
+        writer.write(packed)
+    return report(path.basename(file_name), codec, len(data), len(packed), seconds)
+
+def main():
+    args = sys.argv[1:]
+    codecs, bpp, files = ["pscompr"], 4, []
+    while args:
+        arg = args.pop(0)
+        if arg == "--codec" and args:
+            codec = args.pop(0).lower()
+            codecs = sorted(CODECS) if codec == "all" else [codec]
+        elif arg == "--bpp" and args:
+            bpp = int(args.pop(0))
+        else:
+            files.append(arg)
+
+    if any(codec not in CODECS for codec in codecs):
+        print("unknown codec %s" % ", ".join(codecs))
+        return
+    if not files:
+        print("not enough arguments")
+        return
+    for file_name in files:
+        if not path.exists(file_name):
+            print("file %s doesn't exist" % file_name)
+            continue
+        for codec in codecs:
+            print(compress_file(file_name, codec, bpp))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''vectorized Floyd-Steinberg and ordered dithering
+
+ The classic algorithm walks the image pixel by pixel because every pixel
+ depends on the error pushed by its left, upper-left, upper and upper-right
+ neighbours. All pixels on the line x + 2 * y = t only depend on lines < t,
+ so a whole such line (wavefront) is quantized with one set of numpy
+ operations. Updates are applied in the same order as the serial loop and
+ truncated to integers after each step, the result is byte-identical.
+
+ The ordered modes (bayer, noise) add the value of a threshold matrix
+ tiled over the image to every pixel before taking the nearest color.
+ A pixel only depends on its own color and position, the whole image is
+ done at once and an unchanged part of an animation frame gives the same
+ tiles as in the frame before.'''
+
+import sys
+from os import path
+from functools import lru_cache
+from time import perf_counter
+
+import numpy as np
+
+from profiles import DITHER_MODES
+from quantize import nearest_indices, lookup, load_lut
+
+# Rec. 709 (sRGB) luma coef
+LUMA_WEIGHTS = (0.2126, 0.7152, 0.0722)
+
+# pixels closer than this weighted distance to their palette color are kept as they are
+SKIP_THRESHOLD = 0.0025
+
+# modes which only depend on the pixel position
+ORDERED_MODES = ("bayer", "noise")
+
+# gaussian width of the energy which void and cluster spreads around a dot
+NOISE_SIGMA = 1.5
+
+
+def weighted_dist(first, second, weights=LUMA_WEIGHTS):
+    '''vectorized version of gfx2sms.color_dist'''
+
+    pr, pg, pb = weights
+    max_dist = pr * 255**2 + pg * 255**2 + pb * 255**2
+    diff = (np.asarray(second, dtype=np.int64) - np.asarray(first, dtype=np.int64))**2
+    return (pr * diff[..., 0] + pg * diff[..., 1] + pb * diff[..., 2]) / max_dist
+
+def _spread(data, ys, xs, quant_error, weight):
+    '''adds the weighted error to the pixels which are inside the image'''
+
+    height, width, _ = data.shape
+    inside = (xs >= 0) & (xs < width) & (ys < height)
+    if not inside.any():
+        return
+    ys, xs = ys[inside], xs[inside]
+    # exact in float32: the error is an integer and the divisor a power of two
+    values = data[ys, xs] + quant_error[inside] * np.float32(weight / 16.0)
+    data[ys, xs] = np.floor(np.clip(values, 0, 255))
+
+def floyd_steinberg(data, palette, threshold=SKIP_THRESHOLD, weights=LUMA_WEIGHTS, rows=None, lut=None):
+    '''dithers the float32 buffer data (height, width, 3) in place against palette.
+
+    lut is an optional exact lookup table of palette (see quantize.load_lut).
+
+    Only the first rows lines are quantized, the remaining lines merely
+    collect the error which is carried over to the next call.'''
+
+    height, width, _ = data.shape
+    rows = height if rows is None else min(rows, height)
+    palette = np.asarray(palette, dtype=np.int64).reshape(-1, 3)
+    palette_f = palette.astype(np.float32)
+    for wave in range(width + 2 * (rows - 1)):
+        y_first = max(0, (wave - width + 2) // 2)
+        y_last = min(rows - 1, wave // 2)
+        if y_first > y_last:
+            continue
+        ys = np.arange(y_first, y_last + 1)
+        xs = wave - 2 * ys
+        old = data[ys, xs].astype(np.int64)
+        idx = nearest_indices(old, palette) if lut is None else lookup(old, lut)
+        changed = weighted_dist(old, palette[idx], weights) >= threshold
+        if not changed.any():
+            continue
+        ys, xs, idx = ys[changed], xs[changed], idx[changed]
+        quant_error = (old[changed] - palette[idx]).astype(np.float32)
+        data[ys, xs] = palette_f[idx]
+        # 3/16 must reach a pixel before the 7/16 of its left neighbour on the same wavefront
+        _spread(data, ys + 1, xs - 1, quant_error, 3.0)
+        _spread(data, ys, xs + 1, quant_error, 7.0)
+        _spread(data, ys + 1, xs, quant_error, 5.0)
+        _spread(data, ys + 1, xs + 1, quant_error, 1.0)
+    return data
+
+def dither_mode(dithering):
+    '''the mode of the dithering option: None, "floyd" for True or the named mode'''
+
+    if not dithering:
+        return None
+    if dithering is True:
+        return "floyd"
+    if dithering not in DITHER_MODES:
+        raise ValueError("unknown dither mode %s" % dithering)
+    return dithering
+
+def bayer_matrix(size=8):
+    '''the size x size Bayer matrix as thresholds in (0, 1)'''
+
+    matrix = np.zeros((1, 1), dtype=np.int64)
+    while len(matrix) < size:
+        matrix = np.block([[4 * matrix, 4 * matrix + 2], [4 * matrix + 3, 4 * matrix + 1]])
+    return (matrix + 0.5) / matrix.size
+
+def noise_matrix(size=32, sigma=NOISE_SIGMA):
+    '''a size x size blue noise matrix as thresholds in (0, 1): dots are
+    added one by one where the energy of the dots so far is lowest (the
+    void and cluster method without the initial pattern), the order of a
+    dot is its threshold. The image wraps around, so the matrix tiles.'''
+
+    distance = np.minimum(np.arange(size), size - np.arange(size))
+    kernel = np.exp(-(distance[:, None]**2 + distance[None, :]**2) / (2 * sigma**2))
+    energy = np.zeros((size, size))
+    ranks = np.zeros((size, size), dtype=np.int64)
+    for rank in range(size * size):
+        y, x = np.unravel_index(np.argmin(energy), energy.shape)
+        ranks[y, x] = rank
+        energy += np.roll(kernel, (y, x), axis=(0, 1))
+        energy[y, x] = np.inf
+    return (ranks + 0.5) / ranks.size
+
+@lru_cache(maxsize=None)
+def threshold_matrix(mode):
+    matrix = bayer_matrix() if mode == "bayer" else noise_matrix()
+    matrix.setflags(write=False)
+    return matrix
+
+def palette_spread(palette):
+    '''the largest gap between the levels of a channel in the palette,
+    the amount the ordered modes move a color at most'''
+
+    palette = np.asarray(palette, dtype=np.int64).reshape(-1, 3)
+    return max(np.diff(np.unique(palette[:, channel])).max(initial=0) for channel in range(3))
+
+def ordered(pixels, palette, mode="bayer", top=0, threshold=SKIP_THRESHOLD, weights=LUMA_WEIGHTS, lut=None):
+    '''dithers the rgb array (height, width, 3) against palette with the
+    threshold matrix of mode, tiled over the image. top is the row of the
+    image the array starts at. Returns the palette colors as uint8 array.'''
+
+    old = np.asarray(pixels, dtype=np.int64)
+    height, width, _ = old.shape
+    palette = np.asarray(palette, dtype=np.int64).reshape(-1, 3)
+    matrix = threshold_matrix(mode)
+    rows, columns = np.arange(top, top + height) % len(matrix), np.arange(width) % len(matrix)
+    offsets = np.rint((matrix[rows[:, None], columns[None, :]] - 0.5) * palette_spread(palette)).astype(np.int64)
+    moved = np.clip(old + offsets[..., None], 0, 255).reshape(-1, 3)
+    old = old.reshape(-1, 3)
+    nearest = nearest_indices(old, palette) if lut is None else lookup(old, lut)
+    idx = nearest_indices(moved, palette) if lut is None else lookup(moved, lut)
+    # colors already close to the palette stay flat
+    keep = weighted_dist(old, palette[nearest], weights) < threshold
+    idx = np.where(keep, nearest, idx)
+    return palette[idx].reshape(height, width, 3).astype(np.uint8)
+
+def remap(data, palette, memo=None):
+    '''replaces every color by its nearest palette color (see quantize.ColorMemo for memo)'''
+
+    pixels = np.asarray(data).reshape(-1, 3).astype(np.int64)
+    # unique over packed integers is much faster than over rows, the order is the same
+    packed, inverse = np.unique((pixels[:, 0] << 16) | (pixels[:, 1] << 8) | pixels[:, 2], return_inverse=True)
+    colors = np.stack([packed >> 16, (packed >> 8) & 0xff, packed & 0xff], axis=1)
+    palette = np.asarray(palette, dtype=np.int64).reshape(-1, 3)
+    mapped = palette[nearest_indices(colors, palette, memo=memo)]
+    return mapped[inverse.reshape(-1)].reshape(np.shape(data)).astype(np.uint8)
+
+def dither(pixels, system_palette, color_palette, threshold=SKIP_THRESHOLD, weights=LUMA_WEIGHTS, lut=None,
+           mode="floyd"):
+    '''dithers the rgb array against the system palette and afterwards
+    restricts the result to the colors of color_palette'''
+
+    if mode in ORDERED_MODES:
+        return remap(ordered(pixels, system_palette, mode, 0, threshold, weights, lut), color_palette)
+    data = np.asarray(pixels, dtype=np.float32).copy()
+    floyd_steinberg(data, system_palette, threshold, weights, lut=lut)
+    return remap(data, color_palette)
+
+def dither_bands(bands, system_palette, threshold=SKIP_THRESHOLD, weights=LUMA_WEIGHTS, lut=None,
+                 first_row=None, carries=None, mode="floyd"):
+    '''generator: dithers an iterable of (rows, width, 3) rgb bands from top to
+    bottom and yields every band as float32 array as soon as it is final.
+
+    Only the first row of the next band is needed to finish a band, so the
+    error carried from band to band is a single row and the result is the
+    same as dithering the whole image at once. The first row of every
+    following band, with the error it got from above, is appended to the
+    list carries. Passing one of them as first_row resumes dithering at
+    that band. The ordered modes carry nothing, a band is done at once.'''
+
+    if mode in ORDERED_MODES:
+        top = 0
+        for band in bands:
+            yield ordered(band, system_palette, mode, top, threshold, weights, lut)
+            top += len(band)
+        return
+    carry = None
+    for band in bands:
+        band = np.asarray(band, dtype=np.float32)
+        if carry is None:
+            carry = band.copy()
+            if first_row is not None:
+                carry[0] = first_row
+            continue
+        data = np.concatenate([carry, band[:1]])
+        floyd_steinberg(data, system_palette, threshold, weights, rows=len(carry), lut=lut)
+        yield data[:-1]
+        carry = np.concatenate([data[-1:], band[1:]])
+        if carries is not None:
+            carries.append(carry[0].copy())
+    if carry is not None:
+        yield floyd_steinberg(carry, system_palette, threshold, weights, lut=lut)
+
+def main():
+    if len(sys.argv) < 2:
+        print("not enough arguments")
+        return
+    if not path.exists(sys.argv[1]):
+        print("file %s doesn't exist" % (sys.argv[1]))
+        return
+
+    from PIL import Image
+    import gfx2sms
+
+    with Image.open(sys.argv[1]) as img:
+        img = img.convert("RGB")
+    palette = gfx2sms.SMS_COLOR_PALETTE
+    used = [tuple(map(int, color)) for color in remap(np.asarray(img), palette).reshape(-1, 3)]
+    used = list(dict.fromkeys(used))[:2**gfx2sms.PAL_COLORS]
+
+    start = perf_counter()
+    expected = np.asarray(gfx2sms.dithering_reference(img, used))
+    reference_time = perf_counter() - start
+    start = perf_counter()
+    result = dither(np.asarray(img), palette, used, lut=load_lut(palette))
+    vectorized_time = perf_counter() - start
+
+    print("reference: %.3fs" % reference_time)
+    print("vectorized: %.3fs" % vectorized_time)
+    print("speedup: %.1fx" % (reference_time / vectorized_time))
+    print("identical: %s" % np.array_equal(expected, result))
+
+if __name__ == '__main__':
+    main()
@@ -3,14 +3,12 @@
 
 import os
 from os import path
-import os.path
 import sys
-from datetime import datetime
-from pathlib import Path
-import struct
-import numpy as np
-from PIL import Image, ImageOps, ImageEnhance, ImageChops
-import cProfile
+# numpy, PIL and the engine are imported where they are needed, a wrong
+# argument is reported without loading them
+import profiles
+
+__version__ = profiles.__version__
 
 # 32 x 28 tiles filling a screen where a tile is 8x8
 # for the SMS the color depth is 4bits = 16 colors per tile
@@ -25,30 +23,16 @@ TILE_HEIGHT = 8
 PR, PG, PB = 0.2126, 0.7152, 0.0722
 MAX_DIST = PR * 255**2 + PG * 255**2 + PB * 255**2
 
-SMS_COLOR_PALETTE = [   (0x00,0x00,0x00),(0x54,0x00,0x00),(0xab,0x00,0x00),(0xff,0x00,0x00),
-                        (0x00,0x54,0x00),(0x54,0x54,0x00),(0xab,0x54,0x00),(0xff,0x54,0x00),
-                        (0x00,0xab,0x00),(0x54,0xab,0x00),(0xab,0xab,0x00),(0xff,0xab,0x00),
-                        (0x00,0xff,0x00),(0x54,0xff,0x00),(0xab,0xff,0x00),(0xff,0xff,0x00),
-                        (0x00,0x00,0x54),(0x54,0x00,0x54),(0xab,0x00,0x54),(0xff,0x00,0x54),
-                        (0x00,0x54,0x54),(0x54,0x54,0x54),(0xab,0x54,0x54),(0xff,0x54,0x54),
-                        (0x00,0xab,0x54),(0x54,0xab,0x54),(0xab,0xab,0x54),(0xff,0xab,0x54),
-                        (0x00,0xff,0x54),(0x54,0xff,0x54),(0xab,0xff,0x54),(0xff,0xff,0x54),
-                        (0x00,0x00,0xab),(0x54,0x00,0xab),(0xab,0x00,0xab),(0xff,0x00,0xab),
-                        (0x00,0x54,0xab),(0x54,0x54,0xab),(0xab,0x54,0xab),(0xff,0x54,0xab),
-                        (0x00,0xab,0xab),(0x54,0xab,0xab),(0xab,0xab,0xab),(0xff,0xab,0xab),
-                        (0x00,0xff,0xab),(0x54,0xff,0xab),(0xab,0xff,0xab),(0xff,0xff,0xab),
-                        (0x00,0x00,0xff),(0x54,0x00,0xff),(0xab,0x00,0xff),(0xff,0x00,0xff),
-                        (0x00,0x54,0xff),(0x54,0x54,0xff),(0xab,0x54,0xff),(0xff,0x54,0xff),
-                        (0x00,0xab,0xff),(0x54,0xab,0xff),(0xab,0xab,0xff),(0xff,0xab,0xff),
-                        (0x00,0xff,0xff),(0x54,0xff,0xff),(0xab,0xff,0xff),(0xff,0xff,0xff) ]
-
-now = datetime.now
+SMS_COLOR_PALETTE = profiles.SMS_COLOR_PALETTE
 
 def get_key(dic, search_value):
     for key, value in dic.items():
         if value == search_value:
             return key
 
+# the serial Floyd-Steinberg of the first version, dithering_reference and the
+# helpers up to it are only kept to check dither.py against
+
 def distribute_error(data, x, y, quant_error):
     error_table = {7.0: (1, 0), 3.0: (-1, 1), 5.0: (0, 1), 1.0: (1, 1)}
     #import pdb; pdb.set_trace()
@@ -65,6 +49,8 @@ def distribute_error(data, x, y, quant_error):
 #    return min( subjects, key = lambda subject: sum( (s - q) ** 2 for s, q in zip( subject, query ) ) )
 
 def closest(color, palette):
+    import numpy as np
+
     colors = np.array(palette)
     color = np.array(color)
     distances = np.sqrt(np.sum((colors-color)**2,axis=1))
@@ -92,11 +78,16 @@ def comp_new_pixel(data, x, y, quant_error, error_weight):
         #print(f"x: {x} y: {y} idx: {idx} val: {val} new_color: {new_color} quant_error: {quant_error} error_weight: {error_weight}")
         data[y][x][idx] = new_color
 
-def dithering(img, color_palette):
+def dithering_reference(img, color_palette):
+    '''serial Floyd-Steinberg dithering, kept as reference for dither.py'''
+    import numpy as np
+    from PIL import Image
+    from gfxengine import log
+
     data = np.asarray(img).copy()
     color_cache = {}
     width, height = img.size[0], img.size[1]
-    print(f"[{now().strftime('%Y-%m-%d %H:%M:%S')}] executing Floyd-Steinberg dithering for {width}*{height} image..", end="")
+    log(True, f"executing Floyd-Steinberg dithering for {width}*{height} image..", end="")
     for y in range(0, height):
         for x in range(0, width):
             old_pixel = tuple(data[y][x])
@@ -112,7 +103,7 @@ def dithering(img, color_palette):
             distribute_error(data, x, y, quant_error)
     print("done")
     
-    print(f"[{now().strftime('%Y-%m-%d %H:%M:%S')}] correcting used colors..", end="")
+    log(True, "correcting used colors..", end="")
     color_cache = {}
     for y in range(height):
         for x in range(width):
@@ -128,137 +119,39 @@ def dithering(img, color_palette):
     
     return Image.fromarray(data)
 
-def convert(output_name, grayscale, resize):
-    print(os.getcwd())
-    print(f"[{now().strftime('%Y-%m-%d %H:%M:%S')}] open {output_name}..")
-    with Image.open(output_name) as img:
-        if grayscale:
-            print(f"[{now().strftime('%Y-%m-%d %H:%M:%S')}] convert to grayscale..")
-            img = ImageOps.grayscale(img)
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(1.5*2)
-            #img = img.convert("1")
-            #img.show()
- 
-        #import pdb; pdb.set_trace()
-        # TODO: reduce tiles shrink image
-        
-        width, height = img.size
-        try:
-            color_cnt = len(img.getcolors(maxcolors=65536))
-        except:
-            print(f"[{now().strftime('%Y-%m-%d %H:%M:%S')}] pil cannot process file {output_name}..")
-            return
-            
-        if color_cnt > 2**PAL_COLORS:
-            print("too many colors")
-            ##return
-        
-        if width > MAX_X or height > MAX_Y:
-            print("invalid image dimensions")
-            ##return
-            
-        if resize:
-            print(f"[{now().strftime('%Y-%m-%d %H:%M:%S')}] resizing to {resize}..")
-            img = img.resize(resize)
-        
-        # convert single band color representation to RGB
-        if "".join(img.getbands()) != "RGB":
-            print(f"[{now().strftime('%Y-%m-%d %H:%M:%S')}] converting to RGB..")
-            img = img.convert("RGB")
-        
-        # mapping of used color palette color of platform
-        Color_Map = {}
-        # translate used rgb tuple to corresponding index of color palette
-        Color_Index = {}
-        
-        # using lambda expression to get darker color in front of the palette
-        print(f"[{now().strftime('%Y-%m-%d %H:%M:%S')}] creating color mapping..")
-        for idx, color in enumerate(sorted(img.getcolors(maxcolors=65536), key=lambda x: x[-1][0]**2 +x [-1][1]**2 + x[-1][2]**2)):
-            # color is a rgb pair of a pixel in the picture but needed a value similiar to platform palette
-            matched_color = closest(color[-1], SMS_COLOR_PALETTE)
-            index = len(list(dict.fromkeys(Color_Index.values())))
-           
-            #color already in use, reuse palette index
-            if matched_color in Color_Map.values():
-                index = Color_Index[get_key(Color_Map, matched_color)] 
-                print(f"[{now().strftime('%Y-%m-%d %H:%M:%S')}] mapped doubled color {color[-1]} found at index {index} will be ignored!")        
-            
-            # add mapping of used color to nearest color match
-            Color_Map[color[-1]] = matched_color
-            # set mapping used color to palette index
-            Color_Index[color[-1]] = index
-        
-        curr_palette = list(dict.fromkeys(Color_Map.values()))
-        max_color = len(curr_palette)
-         
-        Color_Index_SMS = {}
-        for color in Color_Index:
-            Color_Index_SMS[Color_Map[color]] = Color_Index[color]
-        
-        Color_Index = Color_Index_SMS        
-        
-        print(f"[{now().strftime('%Y-%m-%d %H:%M:%S')}] start dithering..")
-        img = dithering(img, curr_palette)
-        print(f"[{now().strftime('%Y-%m-%d %H:%M:%S')}] colors(#{len(curr_palette)}): {curr_palette}")
-        #img.show()
-         
-        #import pdb; pdb.set_trace()
-        filename = path.splitext(output_name)[0]
-        
-        # write color palette
-        print(f"[{now().strftime('%Y-%m-%d %H:%M:%S')}] writing color palette..")
-        used_colors = {}
-        with open(os.path.join(os.getcwd(), os.path.split(filename + ".pal")[-1]), "wb") as writer:
-            # look up for the index of the used colors relating to the machine color palette
-            for color in Color_Map:
-                val = SMS_COLOR_PALETTE.index(Color_Map[color])
-                if val in used_colors:
-                    continue
-                print(f"[{now().strftime('%Y-%m-%d %H:%M:%S')}]\tusing color {val:0{2}} {hex(val)}")
-                writer.write(struct.pack('B', val))
-                used_colors[val] = 1
-            
-            # fill the rest with zeros
-            while writer.tell() < 2**PAL_COLORS:
-                writer.write(struct.pack('B', 0))
-        
-        # write planar tiles data format
-        print(f"[{now().strftime('%Y-%m-%d %H:%M:%S')}] creating tile data..", end="")
-        with open(os.path.join(os.getcwd(), os.path.split(filename + ".bin")[-1]), "wb") as writer:
-            for tile_y in range(height // TILE_HEIGHT):
-                for tile_x in range(width // TILE_WIDTH):
-                    #region contain 8x8 pixel data
-                    region = img.crop((tile_x * TILE_WIDTH, tile_y * TILE_HEIGHT, (tile_x + 1) * TILE_WIDTH, (tile_y + 1) * TILE_HEIGHT))
-                    # no idea why I have to mirror the tile
-                    region = ImageOps.mirror(region)
-                    #convert rgb data to color index which references to color in the palette
-                    color_data = [item for item in region.getdata()]
-                    
-                    #take 8 pixels
-                    for pos in range(0, len(color_data), TILE_WIDTH):
-                        # color index coded as value between 0 and 15 for SMS
-                        for shifter in range(PAL_COLORS):
-                            val = 0
-                            #iterate through 8 pixel and check lowest bit is set 
-                            for column in range(TILE_WIDTH):
-                                val += ((Color_Index[color_data[pos + column]] >> shifter) & 0b1) << column
-                            #    import pdb; pdb.set_trace()
-                            writer.write(struct.pack('B', val))
-        print("done")                          
+def convert(output_name, grayscale=False, resize=None, dedupe=False, use_cache=True, dithering=None, optimize=False,
+            stream=False, compression=None, quiet=False, stats=None, sprites=None, palettes=1):
+    import gfxengine
+
+    if not quiet:
+        print(os.getcwd())
+    output_base = os.path.join(os.getcwd(), path.splitext(path.basename(output_name))[0])
+    if sprites:
+        import sprites as sheet
+
+        return sheet.convert_file(output_name, "sms", output_base, sprites, use_cache, verbose=True,
+                                  dithering=dithering, grayscale=grayscale, optimize=optimize, quiet=quiet,
+                                  stats=stats)
+    return gfxengine.convert_file(output_name, "sms", output_base, use_cache, verbose=True, dithering=dithering,
+                                  grayscale=grayscale, resize=resize, dedupe=dedupe,
+                                  optimize=optimize, stream=stream, compression=compression, quiet=quiet, stats=stats,
+                                  palettes=palettes)
+
 def process(args):
     if os.path.exists(args[1]):
-        grayscale = len(args) > 2 and args[2] == '-gs' 
-        resize = None
-        if len(args) > 3 and args[2] == '--resize': 
-            resize = tuple(map(lambda x: int(x), args[3].split(',')))
-        convert(args[1], grayscale, resize)
+        options = profiles.parse_options(args[2:])
+        if options is not None:
+            return convert(args[1], **options)
             
 def main():
     if len(sys.argv) > 1:
         if path.exists(sys.argv[1]):
-            process(sys.argv)
-            #cProfile.run("process(sys.argv)", sort="tottime")
+            if '--profile' in sys.argv[2:]:
+                import cProfile
+
+                cProfile.runctx("process(sys.argv)", globals(), locals(), sort="tottime")
+            elif process(sys.argv) is None:
+                sys.exit(1)
         else:
             print("file %s doesn't exist" % (sys.argv[1]))
     else:
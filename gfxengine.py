@@ -0,0 +1,555 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''conversion engine shared by gfx2sms, gfx2gg and gfx2sg
+
+ All targets go through the same pipeline: open, validate, map the
+ colors to the platform palette, optionally dither, write the palette
+ and the planar tiles. What differs between the platforms is described
+ by a Profile:
+
+  sms  4bpp tiles, 16 of 64 colors, one byte per palette entry
+  gg   4bpp tiles, 16 of 4096 colors, 12 bit palette entries (----BBBBGGGGRRRR)
+  sg   1bpp patterns with a foreground/background color byte for every
+       tile row (TMS9918 graphics II), 15 fixed colors
+
+ convert_image works on an opened image and returns the output as bytes,
+ convert_file also takes care of reading, caching and writing the files.'''
+
+import os
+from os import path
+import hashlib
+from collections import namedtuple
+from datetime import datetime
+from struct import pack
+
+import numpy as np
+from PIL import Image, ImageOps, ImageEnhance
+
+import cache
+import compress
+import dither
+from metrics import Metrics
+from palette import optimize_palette, tile_histogram, split_palettes
+from profiles import (__version__, PR, PG, PB, SMS_COLOR_PALETTE, GG_COLOR_PALETTE, SG_COLOR_PALETTE,
+                      sms_color, gg_color, sg_color, Profile, PROFILES, parse_options)
+import quantize
+import tiles
+
+# tile rows decoded and dithered at a time when streaming
+STREAM_ROWS = 32
+
+# tile rows per band which convert_incremental reuses when unchanged
+INCREMENTAL_ROWS = 4
+
+# palette, tiles, name table and color table as bytes (the latter two may be None)
+Result = namedtuple("Result", "palette tiles name_table color_table colors tile_count")
+
+now = datetime.now
+
+
+def log(verbose, message, end="\n"):
+    if verbose:
+        print(f"[{now().strftime('%Y-%m-%d %H:%M:%S')}] {message}", end=end)
+
+def get_profile(profile):
+    return PROFILES[profile] if isinstance(profile, str) else profile
+
+def prepare(img, profile, grayscale=False, resize=None, optimize=False, verbose=False):
+    '''validates the image and converts it to rgb, returns None if it can't be converted.
+    With optimize any number of colors is accepted, they are reduced later.'''
+
+    if grayscale:
+        log(verbose, "convert to grayscale..")
+        img = ImageOps.grayscale(img)
+        enhancer = ImageEnhance.Contrast(img)
+        img = enhancer.enhance(1.5*2)
+
+    width, height = img.size
+    colors = img.getcolors(maxcolors=65536)
+    if colors is None:
+        log(verbose, "pil cannot process image..")
+        return
+
+    if not optimize and profile.max_colors is not None and len(colors) > profile.max_colors:
+        print("too many colors")
+        if profile.strict:
+            return
+
+    if width > profile.max_x or height > profile.max_y:
+        print("invalid image dimensions")
+        if profile.strict:
+            return
+
+    if resize:
+        log(verbose, f"resizing to {resize}..")
+        img = img.resize(resize)
+
+    # convert single band color representation to RGB
+    if "".join(img.getbands()) != "RGB":
+        log(verbose, "converting to RGB..")
+        img = img.convert("RGB")
+    return img
+
+def memo_lookup(metrics, function, *args):
+    '''calls function with the color memo of the process, counts its hits and misses'''
+
+    memo = quantize.color_memo()
+    # other threads (gfxserver jobs) use the same memo
+    hits, misses = memo.thread_counts()
+    result = function(*args, memo=memo)
+    after_hits, after_misses = memo.thread_counts()
+    metrics.count("memo_hits", after_hits - hits)
+    metrics.count("memo_misses", after_misses - misses)
+    return result
+
+def build_palette(img, profile, optimize=False, metrics=None):
+    '''maps the colors of the rgb image to the hardware palette, returns
+    the image colors, the hardware color of each and the used hardware colors.
+    With optimize the colors are mapped to the best profile.colors hardware
+    colors instead of their nearest one (see palette.optimize_palette).'''
+
+    metrics = metrics or Metrics()
+    items = img.getcolors(maxcolors=65536)
+    if profile.sort_colors:
+        # darker colors in front of the palette
+        items.sort(key=lambda item: item[-1][0]**2 + item[-1][1]**2 + item[-1][2]**2)
+    colors = [color for _, color in items]
+    system_palette = profile.palette
+    if optimize:
+        system_palette = optimize_palette(colors, [count for count, _ in items], profile.palette, profile.colors)
+    matched = memo_lookup(metrics, quantize.nearest, colors, system_palette)
+    # first come first served, colors matching the same hardware color share the entry
+    used = list(dict.fromkeys(matched))
+    return colors, matched, used
+
+def encode_palette(used, profile):
+    data = b"".join(profile.encode_color(profile.palette, color) for color in used)
+    if len(data) < profile.palette_size:
+        data += pack('B', profile.palette_fill) * (profile.palette_size - len(data))
+    return data
+
+def decode_palette(data, profile):
+    '''hardware colors of the entries of a palette file, the reverse of encode_palette'''
+
+    profile = get_profile(profile)
+    size = profile.palette_size // 16
+    values = np.frombuffer(bytes(data)[:len(data) // size * size], dtype=np.uint8 if size == 1 else "<u2")
+    # gg words are the index into the palette, red changing fastest
+    return [profile.palette[value % len(profile.palette)] for value in values.tolist()]
+
+def encode_color_table(bg, fg, used, profile):
+    '''color byte of every tile row: foreground in the high, background in the low nibble'''
+
+    codes = np.array([ord(profile.encode_color(profile.palette, color)) for color in used], dtype=np.uint8)
+    return ((codes[fg] << 4) | codes[bg]).astype(np.uint8).tobytes()
+
+def iter_tile_rows(img, profile, colors, matched, used, dithering, band_rows=None, metrics=None):
+    '''generator: yields the palette indices of the image as (8, width) arrays,
+    one tile row after another. The image is read and dithered in bands of
+    band_rows tile rows (all at once if None), incomplete tile rows at the
+    bottom are skipped.'''
+
+    metrics = metrics or Metrics()
+    width, height = img.size
+    height -= height % tiles.TILE_HEIGHT
+    if not height:
+        return
+    band_height = height if band_rows is None else band_rows * tiles.TILE_HEIGHT
+    bands = metrics.timed("decode", (np.asarray(img.crop((0, top, width, min(top + band_height, height))))
+                                     for top in range(0, height, band_height)))
+    color_index = dict((color, idx) for idx, color in enumerate(used))
+    if dithering:
+        lut = quantize.load_lut(profile.palette)
+        bands = metrics.timed("dither", (memo_lookup(metrics, dither.remap, band, used) for band in
+                                         dither.dither_bands(bands, profile.palette, weights=(PR, PG, PB), lut=lut,
+                                                             mode=dither.dither_mode(dithering))))
+    else:
+        color_index = dict((color, color_index[match]) for color, match in zip(colors, matched))
+    for band in bands:
+        metrics.count("pixels", band.shape[0] * band.shape[1])
+        if dithering:
+            metrics.count("pixels_dithered", band.shape[0] * band.shape[1])
+        with metrics.stage("index"):
+            indexed = tiles.index_image(band, color_index)
+        for top in range(0, len(indexed), tiles.TILE_HEIGHT):
+            yield indexed[top:top + tiles.TILE_HEIGHT]
+
+def check_tile_count(unique):
+    '''raises ValueError if the name table can't address unique tiles, their
+    numbers would run into the flip and palette bits'''
+
+    if unique > tiles.TILE_INDEX_MASK + 1:
+        raise ValueError("too many tiles for the name table (%d, at most %d)" % (unique, tiles.TILE_INDEX_MASK + 1))
+
+def encode_tile_rows(tile_rows, profile, used, dedupe=False, metrics=None):
+    '''generator: encodes every tile row as it comes, yields the pattern bytes,
+    the name table bytes (None without dedupe) and the color table bytes
+    (None unless the profile has one) and the number of tiles in the row.
+    With dedupe only tiles which weren't seen before are part of the patterns,
+    more than the name table can address raise ValueError (see check_tile_count).'''
+
+    metrics = metrics or Metrics()
+    known = {} if dedupe and profile.name_table else None
+    distances = quantize.palette_distances(used) if profile.color_table else None
+    for indexed in tile_rows:
+        with metrics.stage("encode"):
+            tile_data = tiles.split_tiles(indexed)
+            count = len(tile_data)
+            name_table = color_table = None
+            if profile.color_table:
+                patterns, bg, fg = tiles.encode_row_colors(tile_data, distances)
+                color_table = encode_color_table(bg, fg, used, profile)
+            else:
+                if known is not None:
+                    tile_data, name_table = tiles.dedupe_tiles(tile_data, profile.bpp, known)
+                    check_tile_count(len(known))
+                    name_table = tiles.encode_name_table(name_table)
+                patterns = tiles.encode_tiles(tile_data, profile.bpp)
+        metrics.count("tiles", count)
+        metrics.count("unique_tiles", len(patterns) // (profile.bpp * tiles.TILE_HEIGHT))
+        yield patterns, name_table, color_table, count
+
+def encode_split_rows(tile_rows, profile, used, palettes=2, metrics=None, verbose=False):
+    '''encodes the tile rows with palettes palettes of profile.colors colors
+    each (see palette.split_palettes), returns the palette bytes of all
+    palettes and a generator like encode_tile_rows with dedupe. The name
+    table entries select the palette of their tile. All rows are read
+    before the first one is encoded.'''
+
+    metrics = metrics or Metrics()
+    rows = [tiles.split_tiles(indexed) for indexed in tile_rows]
+    with metrics.stage("palettes"):
+        cells = np.concatenate(rows) if rows else np.zeros((0, tiles.TILE_HEIGHT, tiles.TILE_WIDTH), dtype=np.int64)
+        distances = quantize.palette_distances(used)
+        choice, groups, misfits = split_palettes(tile_histogram(cells, len(used)), distances, profile.colors,
+                                                 palettes)
+        # a palette maps the colors it lacks to its closest one
+        lookup = np.zeros((palettes, len(used)), dtype=np.uint8)
+        for group, members in enumerate(groups):
+            if members:
+                lookup[group] = distances[:, members].argmin(axis=1)
+    metrics.count("misfit_tiles", misfits)
+    if misfits:
+        print("%d tiles don't fit into %d palettes" % (misfits, palettes))
+    log(verbose, f"palettes: {[[used[color] for color in members] for members in groups]}")
+    palette = b"".join(encode_palette([used[color] for color in members], profile) for members in groups)
+
+    def parts():
+        known, offset = {}, 0
+        for row in rows:
+            with metrics.stage("encode"):
+                selected = choice[offset:offset + len(row)]
+                tile_data, name_table = tiles.dedupe_tiles(lookup[selected[:, None, None], row], profile.bpp, known)
+                check_tile_count(len(known))
+                name_table[selected == 1] |= tiles.PALETTE_SELECT
+                patterns = tiles.encode_tiles(tile_data, profile.bpp)
+            offset += len(row)
+            metrics.count("tiles", len(row))
+            metrics.count("unique_tiles", len(tile_data))
+            yield patterns, tiles.encode_name_table(name_table), None, len(row)
+    return palette, parts()
+
+def convert_tiles(img, profile="sms", dithering=None, grayscale=False, resize=None, dedupe=False,
+                  optimize=False, stream=False, verbose=False, metrics=None, palettes=1):
+    '''starts converting an opened image, returns the palette bytes, the used
+    colors and a generator of encoded tile rows (see encode_tile_rows) or
+    None if the image can't be converted. With stream only STREAM_ROWS tile
+    rows are decoded and dithered at a time, the image has to stay open
+    until the generator is exhausted. With two palettes every tile uses one
+    of them (see encode_split_rows), this needs a name table and implies
+    dedupe.'''
+
+    profile = get_profile(profile)
+    metrics = metrics or Metrics()
+    if palettes > 1:
+        if not profile.name_table or palettes > 2:
+            print("%d palettes aren't supported for %s" % (palettes, profile.name))
+            return
+        # the image may have the colors of all palettes
+        split_profile = profile
+        profile = profile._replace(colors=profile.colors * palettes, max_colors=profile.max_colors * palettes)
+    with metrics.stage("prepare"):
+        img = prepare(img, profile, grayscale, resize, optimize, verbose)
+    if img is None:
+        return
+
+    log(verbose, "optimizing color palette.." if optimize else "creating color mapping..")
+    with metrics.stage("palette"):
+        colors, matched, used = build_palette(img, profile, optimize, metrics)
+    metrics.count("source_colors", len(colors))
+    metrics.count("palette_colors", len(used))
+    log(verbose, f"colors(#{len(used)}): {used}")
+
+    dithering = profile.dither if dithering is None else dithering
+    if dithering:
+        log(verbose, f"using {dither.dither_mode(dithering)} dithering..")
+    tile_rows = iter_tile_rows(img, profile, colors, matched, used, dithering, STREAM_ROWS if stream else None,
+                               metrics)
+    if palettes > 1:
+        palette, parts = encode_split_rows(tile_rows, split_profile, used, palettes, metrics, verbose)
+        return palette, used, parts
+    return encode_palette(used, profile), used, encode_tile_rows(tile_rows, profile, used, dedupe, metrics)
+
+def log_tiles(verbose, unique, total, dedupe):
+    if dedupe:
+        log(verbose, f"{unique} unique tiles out of {total}")
+        if unique > tiles.VRAM_TILES:
+            print("%d tiles don't fit into VRAM next to the name table (%d)" % (unique, tiles.VRAM_TILES))
+
+def collect_result(palette, used, parts, profile, dedupe=False, verbose=False):
+    '''joins the encoded tile rows of encode_tile_rows to a Result, None if
+    there are too many tiles for the name table'''
+
+    log(verbose, "creating tile data..", end="")
+    patterns, name_table, color_table, total = [], [], [], 0
+    try:
+        for row_patterns, row_names, row_colors, count in parts:
+            patterns.append(row_patterns)
+            name_table.append(row_names or b"")
+            color_table.append(row_colors or b"")
+            total += count
+    except ValueError as error:
+        print(error)
+        return
+    if verbose:
+        print("done")
+    dedupe = dedupe and profile.name_table
+    unique = sum(len(row) for row in patterns) // (profile.bpp * tiles.TILE_HEIGHT)
+    log_tiles(verbose, unique, total, dedupe)
+
+    return Result(palette, b"".join(patterns), b"".join(name_table) if dedupe else None,
+                  b"".join(color_table) if profile.color_table else None, used, unique)
+
+def convert_image(img, profile="sms", dithering=None, grayscale=False, resize=None, dedupe=False, optimize=False,
+                  verbose=False, metrics=None, palettes=1):
+    '''converts an opened image, returns a Result or None if the image can't be converted'''
+
+    profile = get_profile(profile)
+    dedupe = dedupe or palettes > 1
+    converted = convert_tiles(img, profile, dithering, grayscale, resize, dedupe, optimize, verbose=verbose,
+                              metrics=metrics, palettes=palettes)
+    if converted is None:
+        return
+    palette, used, parts = converted
+    return collect_result(palette, used, parts, profile, dedupe, verbose)
+
+def convert_incremental(img, profile="sms", state=None, dithering=None, grayscale=False, resize=None,
+                        dedupe=False, optimize=False, verbose=False, metrics=None):
+    '''converts an opened image like convert_image, but reuses the bands of
+    INCREMENTAL_ROWS tile rows which are unchanged since the conversion
+    that returned state. With Floyd-Steinberg a changed band invalidates
+    the dithering of all bands below, they are dithered again starting
+    with the error row kept from the last run. Returns the Result (None if the image can't be
+    converted), the state for the next call and the number of reused bands.'''
+
+    profile = get_profile(profile)
+    metrics = metrics or Metrics()
+    with metrics.stage("prepare"):
+        img = prepare(img, profile, grayscale, resize, optimize, verbose)
+    if img is None:
+        return None, None, 0
+    with metrics.stage("palette"):
+        colors, matched, used = build_palette(img, profile, optimize, metrics)
+    metrics.count("source_colors", len(colors))
+    metrics.count("palette_colors", len(used))
+    indexed, state, reused = index_bands(img, profile, colors, matched, used, dithering, state, metrics)
+
+    tile_rows = (band[top:top + tiles.TILE_HEIGHT] for band in indexed for top in range(0, len(band), tiles.TILE_HEIGHT))
+    result = collect_result(encode_palette(used, profile), used,
+                            encode_tile_rows(tile_rows, profile, used, dedupe, metrics), profile, dedupe, verbose)
+    return result, state, reused
+
+def index_bands(img, profile, colors, matched, used, dithering=None, state=None, metrics=None):
+    '''the palette indices of an rgb image in bands of INCREMENTAL_ROWS tile
+    rows, bands unchanged since the call that returned state are reused
+    (see convert_incremental). Returns the bands, the new state and the
+    number of reused bands.'''
+
+    profile = get_profile(profile)
+    metrics = metrics or Metrics()
+    mode = dither.dither_mode(profile.dither if dithering is None else dithering)
+    with metrics.stage("decode"):
+        pixels = np.asarray(img)
+        height = len(pixels) - len(pixels) % tiles.TILE_HEIGHT
+        band_height = INCREMENTAL_ROWS * tiles.TILE_HEIGHT
+        bands = [pixels[top:min(top + band_height, height)] for top in range(0, height, band_height)]
+        hashes = [hashlib.sha1(band.tobytes()).digest() for band in bands]
+    key = (profile.name, mode, tuple(used), pixels.shape[1])
+    if state is None or state["key"] != key:
+        state = {"hashes": [], "indexed": [], "carries": []}
+    unchanged = [idx < len(state["hashes"]) and state["hashes"][idx] == band_hash
+                 for idx, band_hash in enumerate(hashes)]
+
+    color_index = dict((color, idx) for idx, color in enumerate(used))
+    if mode in dither.ORDERED_MODES:
+        # a pixel only depends on its position, every changed band is dithered on its own
+        lut = quantize.load_lut(profile.palette)
+        indexed = []
+        for idx, (band, same) in enumerate(zip(bands, unchanged)):
+            if same:
+                indexed.append(state["indexed"][idx])
+                continue
+            with metrics.stage("dither"):
+                band = dither.ordered(band, profile.palette, mode, idx * band_height, weights=(PR, PG, PB), lut=lut)
+            metrics.count("pixels_dithered", band.shape[0] * band.shape[1])
+            with metrics.stage("index"):
+                indexed.append(tiles.index_image(memo_lookup(metrics, dither.remap, band, used), color_index))
+        reused, carries = sum(unchanged), []
+    elif mode:
+        # the error flows downwards, only the leading unchanged bands stay valid
+        reused = (unchanged + [False]).index(False)
+        indexed, carries = state["indexed"][:reused], state["carries"][:reused + 1]
+        if reused < len(bands):
+            lut = quantize.load_lut(profile.palette)
+            first_row = carries[reused] if reused else None
+            carries = carries[:reused] + [first_row]
+            for band in metrics.timed("dither", dither.dither_bands(bands[reused:], profile.palette,
+                                      weights=(PR, PG, PB), lut=lut, first_row=first_row, carries=carries)):
+                metrics.count("pixels_dithered", band.shape[0] * band.shape[1])
+                with metrics.stage("index"):
+                    indexed.append(tiles.index_image(memo_lookup(metrics, dither.remap, band, used), color_index))
+    else:
+        color_index = dict((color, color_index[match]) for color, match in zip(colors, matched))
+        with metrics.stage("index"):
+            indexed = [state["indexed"][idx] if same else tiles.index_image(band, color_index)
+                       for idx, (band, same) in enumerate(zip(bands, unchanged))]
+        reused, carries = sum(unchanged), []
+    metrics.count("pixels", height * pixels.shape[1])
+    metrics.count("reused_bands", reused)
+    return indexed, {"key": key, "hashes": hashes, "indexed": indexed, "carries": carries}, reused
+
+def write_result(result, outputs, metrics=None):
+    '''writes a Result to the files of output_names'''
+
+    metrics = metrics or Metrics()
+    parts = {".pal": result.palette, ".bin": result.tiles, ".nam": result.name_table, ".col": result.color_table}
+    with metrics.stage("write"):
+        for extension, file_name in outputs.items():
+            if parts.get(extension) is not None:
+                with open(file_name, "wb") as writer:
+                    writer.write(parts[extension])
+                metrics.count("bytes_written", len(parts[extension]))
+
+def output_names(output_base, profile, dedupe=False, compression=None):
+    '''file names of the files convert_file writes'''
+
+    outputs = {".pal": output_base + ".pal", ".bin": output_base + ".bin"}
+    if dedupe and profile.name_table:
+        outputs[".nam"] = output_base + ".nam"
+    if profile.color_table:
+        outputs[".col"] = output_base + ".col"
+    if compression:
+        extension = compress.CODECS[compression][0]
+        outputs[extension] = output_base + extension
+    return outputs
+
+def write_tiles(palette, tile_rows, outputs, metrics=None):
+    '''writes the palette and the tile rows as they are encoded, returns the
+    number of written and of all tiles'''
+
+    metrics = metrics or Metrics()
+    with metrics.stage("write"):
+        with open(outputs[".pal"], "wb") as writer:
+            writer.write(palette)
+        metrics.count("bytes_written", len(palette))
+        writers = dict((extension, open(outputs[extension], "wb")) for extension in (".bin", ".nam", ".col")
+                       if extension in outputs)
+        unique = total = 0
+        try:
+            for patterns, name_table, color_table, count in tile_rows:
+                writers[".bin"].write(patterns)
+                if ".nam" in writers:
+                    writers[".nam"].write(name_table)
+                if ".col" in writers:
+                    writers[".col"].write(color_table)
+                metrics.count("bytes_written", len(patterns) + len(name_table or b"") + len(color_table or b""))
+                total += count
+                unique += len(patterns)
+        finally:
+            for writer in writers.values():
+                writer.close()
+    return unique, total
+
+def remove_outputs(outputs):
+    '''removes the files of a conversion which failed halfway'''
+
+    for file_name in outputs.values():
+        if path.exists(file_name):
+            os.remove(file_name)
+
+def convert_file(file_name, profile="sms", output_base=None, use_cache=True, verbose=False,
+                 dithering=None, grayscale=False, resize=None, dedupe=False, optimize=False, stream=False,
+                 compression=None, quiet=False, metrics=None, stats=None, palettes=1):
+    '''converts file_name and writes <output_base>.pal/.bin (and .nam/.col),
+    returns the written file names or None if the image can't be converted.
+    The tile data is written while it is encoded, with stream the image is
+    also decoded and dithered in bands to keep memory bounded for very
+    tall images. compression names a codec of compress.CODECS, the
+    compressed tiles are written next to the .bin. quiet leaves out all
+    messages but errors. Timings and counters are collected in metrics,
+    their summary goes to the hooks and the stats file (see Metrics.finish).'''
+
+    profile = get_profile(profile)
+    if output_base is None:
+        output_base = path.splitext(file_name)[0]
+    dedupe = dedupe or palettes > 1
+    outputs = output_names(output_base, profile, dedupe, compression)
+    options = {"dithering": dithering, "grayscale": grayscale, "resize": resize, "dedupe": dedupe,
+               "optimize": optimize, "palettes": palettes}
+    metrics = metrics or Metrics(file_name, profile.name)
+    verbose = verbose and not quiet
+
+    try:
+        log(verbose, f"open {file_name}..")
+        with Image.open(file_name) as img:
+            key = None
+            if use_cache:
+                with metrics.stage("cache"):
+                    # streaming doesn't change the result, it isn't part of the key
+                    key = cache.cache_key(img, profile.name, __version__, dict(options, compression=compression))
+                    hit = cache.fetch(key, outputs)
+                metrics.count("cache_hits" if hit else "cache_misses")
+                if hit:
+                    log(verbose, "unchanged, using cached result..")
+                    return outputs
+
+            converted = convert_tiles(img, profile, stream=stream, verbose=verbose, metrics=metrics, **options)
+            if converted is None:
+                metrics.count("failed")
+                return
+            palette, used, tile_rows = converted
+            log(verbose, "writing palette and tile data..", end="")
+            try:
+                size, total = write_tiles(palette, tile_rows, outputs, metrics)
+            except ValueError as error:
+                print(error)
+                remove_outputs(outputs)
+                metrics.count("failed")
+                return
+            if verbose:
+                print("done")
+        log_tiles(verbose, size // (profile.bpp * tiles.TILE_HEIGHT), total, dedupe and profile.name_table)
+
+        if compression:
+            extension = compress.CODECS[compression][0]
+            try:
+                with metrics.stage("compress"):
+                    line = compress.compress_file(outputs[".bin"], compression, profile.bpp, outputs[extension],
+                                                  check=False)
+            except ValueError as error:
+                # e.g. zx7 can't encode the empty tile data of an image lower than a tile row
+                print("%s compression failed: %s" % (compression, error))
+                remove_outputs(outputs)
+                metrics.count("failed")
+                return
+            metrics.count("bytes_written", path.getsize(outputs[extension]))
+            if not quiet:
+                print(line)
+
+        if key:
+            with metrics.stage("cache"):
+                cache.store(key, outputs)
+        return outputs
+    finally:
+        metrics.finish(stats)
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''conversion daemon
+
+ usage: gfxserver.py [--socket PATH | --port N] [--workers N] [--output-dir DIR]
+        gfxserver.py --send [--socket PATH | --port N] [--platform sms|gg|sg] image [converter flags]
+        gfxserver.py --stop [--socket PATH | --port N]
+
+ Keeps the interpreter, numpy, PIL and the palette lookup tables loaded
+ and converts images on request. Clients connect to a Unix socket (the
+ default) or to a TCP port on localhost and send one JSON object per
+ line, every request is answered by one JSON line with the same "id":
+
+  {"id": 1, "platform": "sms", "path": "level.png", "options": {"dedupe": true}}
+  {"id": 2, "platform": "gg", "image": "<base64 image file>"}
+  {"id": 3, "path": "level.png", "output": "gfx/level"}    (writes the files)
+  {"command": "ping" | "stats" | "stop"}
+
+ The daemon writes the files of "output" requests itself. With
+ --output-dir the outputs have to lie inside DIR (relative ones are
+ taken from there). Without it they are only accepted on the Unix
+ socket, which only its owner may connect to; on a TCP port any local
+ user can connect.
+
+ The answer holds "ok" and either "error" or the base64 encoded
+ "palette", "tiles", "name_table" and "color_table" (or "outputs" when
+ files were written) and "metrics", the stage timings and counters. With
+ the "compression" option "compressed" holds the compressed tiles.
+ Requests of all connections are converted concurrently by a pool of
+ threads sharing the loaded tables.'''
+
+import os
+from os import path
+import sys
+import io
+import json
+import base64
+import socket
+from time import perf_counter
+
+from profiles import CACHE_DIR
+
+SOCKET_FILE = path.join(CACHE_DIR, "gfxserver.sock")
+
+# options a request may pass to the engine
+OPTIONS = ("dithering", "grayscale", "resize", "dedupe", "optimize", "compression", "palettes")
+
+# requests may carry whole images
+MAX_LINE = 64 * 1024 * 1024
+
+
+def encode_bytes(data):
+    return None if data is None else base64.b64encode(data).decode("ascii")
+
+def resolve_output(output, output_dir=None):
+    '''the output base of a request, raises ValueError if it isn't inside output_dir'''
+
+    if output_dir is None:
+        return output
+    root = path.realpath(output_dir)
+    base = path.realpath(path.join(root, output))
+    if path.commonpath([root, base]) != root:
+        raise ValueError("output %s is outside of %s" % (output, output_dir))
+    return base
+
+def run_job(job, output_dir=None, allow_output=True):
+    '''converts the image of a request, returns the answer without id.
+    Files are written only if allow_output, inside output_dir if given.'''
+
+    import compress
+    import gfxengine
+    from metrics import Metrics
+    from PIL import Image
+
+    options = dict(job.get("options") or {})
+    unknown = sorted(set(options) - set(OPTIONS))
+    if unknown:
+        raise ValueError("unknown options %s" % ", ".join(unknown))
+    if options.get("resize"):
+        options["resize"] = tuple(options["resize"])
+    platform = job.get("platform", "sms")
+    if platform not in gfxengine.PROFILES:
+        raise ValueError("unknown platform %s" % platform)
+    if options.get("compression") and options["compression"] not in compress.CODECS:
+        raise ValueError("unknown compression %s" % options["compression"])
+    metrics = Metrics(job.get("path"), platform)
+
+    if job.get("output"):
+        if not allow_output:
+            raise ValueError("output is only accepted on the Unix socket or with --output-dir")
+        if "path" not in job:
+            raise ValueError("output needs a path")
+        output = resolve_output(job["output"], output_dir)
+        os.makedirs(path.dirname(path.abspath(output)), exist_ok=True)
+        outputs = gfxengine.convert_file(job["path"], platform, output, job.get("use_cache", True),
+                                         quiet=True, metrics=metrics, **options)
+        if outputs is None:
+            raise ValueError("image can't be converted")
+        return {"outputs": outputs, "metrics": metrics.summary()}
+
+    compression = options.pop("compression", None)
+    source = io.BytesIO(base64.b64decode(job["image"])) if "image" in job else job["path"]
+    with Image.open(source) as img:
+        result = gfxengine.convert_image(img, platform, metrics=metrics, **options)
+    compressed = None
+    if result is not None and compression:
+        with metrics.stage("compress"):
+            compressed = compress.compress(result.tiles, compression, gfxengine.get_profile(platform).bpp)
+    summary = metrics.finish()
+    if result is None:
+        raise ValueError("image can't be converted")
+    return {"palette": encode_bytes(result.palette), "tiles": encode_bytes(result.tiles),
+            "name_table": encode_bytes(result.name_table), "color_table": encode_bytes(result.color_table),
+            "compressed": encode_bytes(compressed), "colors": [list(color) for color in result.colors],
+            "tile_count": result.tile_count, "metrics": summary}
+
+def warm_up():
+    '''loads the lookup tables of all platforms'''
+
+    import gfxengine
+    import quantize
+
+    for profile in gfxengine.PROFILES.values():
+        quantize.load_lut(profile.palette)
+
+
+# asyncio and the thread pool are imported by the server only, a client
+# starts faster without them
+class Server(object):
+    def __init__(self, workers=None, output_dir=None):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.output_dir = output_dir
+        self.allow_output = True
+        self.stats = {"jobs": 0, "failed": 0, "seconds": 0.0, "connections": 0}
+        self.stopped = None
+
+    async def answer(self, request):
+        import asyncio
+
+        command = request.get("command")
+        if command == "ping":
+            return {"ok": True}
+        if command == "stats":
+            return dict(self.stats, ok=True)
+        if command == "stop":
+            self.stopped.set()
+            return {"ok": True}
+        if command is not None:
+            return {"ok": False, "error": "unknown command %s" % command}
+
+        start = perf_counter()
+        try:
+            answer = await asyncio.get_running_loop().run_in_executor(self.executor, run_job, request,
+                                                                      self.output_dir, self.allow_output)
+            answer["ok"] = True
+        except Exception as error:
+            answer = {"ok": False, "error": "%s: %s" % (type(error).__name__, error)}
+            self.stats["failed"] += 1
+        answer["seconds"] = perf_counter() - start
+        self.stats["jobs"] += 1
+        self.stats["seconds"] += answer["seconds"]
+        return answer
+
+    async def handle(self, reader, writer):
+        '''answers the requests of one connection, several can be pending at once'''
+
+        import asyncio
+
+        self.stats["connections"] += 1
+        lock = asyncio.Lock()
+        pending = set()
+
+        async def respond(request):
+            answer = await self.answer(request)
+            if "id" in request:
+                answer["id"] = request["id"]
+            async with lock:
+                writer.write(json.dumps(answer).encode("utf-8") + b"\n")
+                await writer.drain()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError as error:
+                    request = {"command": "invalid request: %s" % error}
+                task = asyncio.ensure_future(respond(request))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, socket_file=None, port=None):
+        import asyncio
+
+        self.stopped = asyncio.Event()
+        # any local user can connect to a TCP port
+        self.allow_output = self.output_dir is not None or not port
+        await asyncio.get_running_loop().run_in_executor(self.executor, warm_up)
+        if port:
+            server = await asyncio.start_server(self.handle, "127.0.0.1", port, limit=MAX_LINE)
+            print("listening on 127.0.0.1:%d" % port)
+        else:
+            if path.exists(socket_file):
+                os.remove(socket_file)
+            os.makedirs(path.dirname(socket_file) or ".", exist_ok=True)
+            server = await asyncio.start_unix_server(self.handle, socket_file, limit=MAX_LINE)
+            os.chmod(socket_file, 0o600)
+            print("listening on %s" % socket_file)
+        async with server:
+            await self.stopped.wait()
+        if not port and path.exists(socket_file):
+            os.remove(socket_file)
+        self.executor.shutdown()
+
+def serve(socket_file=SOCKET_FILE, port=None, workers=None, output_dir=None):
+    import asyncio
+
+    asyncio.run(Server(workers, output_dir).serve(socket_file, port))
+
+def request(job, socket_file=SOCKET_FILE, port=None):
+    '''sends a single request to a running server and returns its answer'''
+
+    if port:
+        connection = socket.create_connection(("127.0.0.1", port))
+    else:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(socket_file)
+    with connection, connection.makefile("rwb") as stream:
+        stream.write(json.dumps(job).encode("utf-8") + b"\n")
+        stream.flush()
+        return json.loads(stream.readline())
+
+def main():
+    args = sys.argv[1:]
+    socket_file, port, workers, mode, platform, output_dir = SOCKET_FILE, None, None, "serve", "sms", None
+    rest = []
+    while args:
+        arg = args.pop(0)
+        if arg == "--socket" and args:
+            socket_file = args.pop(0)
+        elif arg == "--port" and args:
+            port = int(args.pop(0))
+        elif arg == "--workers" and args:
+            workers = int(args.pop(0))
+        elif arg == "--platform" and args:
+            platform = args.pop(0).lower()
+        elif arg == "--output-dir" and args:
+            output_dir = args.pop(0)
+        elif arg in ("--send", "--stop"):
+            mode = arg[2:]
+        else:
+            rest.append(arg)
+
+    if mode == "serve":
+        serve(socket_file, port, workers, output_dir)
+        return
+    if mode == "stop":
+        print(request({"command": "stop"}, socket_file, port))
+        return
+    if not rest:
+        print("not enough arguments")
+        return
+
+    import profiles
+
+    options = profiles.parse_options(rest[1:])
+    if options is None:
+        return
+    job = {"id": 1, "platform": platform, "path": path.abspath(rest[0]),
+           "options": dict((key, options[key]) for key in OPTIONS)}
+    answer = request(job, socket_file, port)
+    if not answer["ok"]:
+        print("failed: %s" % answer["error"])
+        return
+    print("%s: %d colors, %d tiles, %d tile bytes in %.3fs" % (rest[0], len(answer["colors"]), answer["tile_count"],
+          len(base64.b64decode(answer["tiles"])), answer["seconds"]))
+    if answer["compressed"]:
+        print("%d bytes %s compressed" % (len(base64.b64decode(answer["compressed"])), options["compression"]))
+
+if __name__ == '__main__':
+    main()
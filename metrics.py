@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''stage timings and counters of a conversion
+
+ A Metrics object collects the seconds spent in every stage of the
+ pipeline and counters like dithered pixels or written bytes. Stages may
+ be nested (or be generators pulling from other stages), a stage only
+ counts the time which isn't spent in a nested one, so the stages add
+ up to the total.
+
+ finish() returns the summary as dict, writes it as JSON and passes it
+ to the hooks: callables registered with add_hook and the function named
+ by GFX2SEGA8_HOOK ("module:function"), e.g. to feed a metrics collector.'''
+
+import os
+import sys
+import json
+import importlib
+from contextlib import contextmanager
+from time import perf_counter
+
+HOOK_VARIABLE = "GFX2SEGA8_HOOK"
+
+# callables getting the summary of every finished conversion
+HOOKS = []
+
+
+def add_hook(function):
+    if function not in HOOKS:
+        HOOKS.append(function)
+
+def load_hook(name):
+    '''returns the function of a "module:function" name'''
+
+    module, _, function = name.partition(":")
+    if not function:
+        raise ValueError("hook %s isn't of the form module:function" % name)
+    return getattr(importlib.import_module(module), function)
+
+
+class Metrics(object):
+    def __init__(self, name=None, platform=None):
+        self.name = name
+        self.platform = platform
+        self.stages = {}
+        self.counters = {}
+        # seconds spent in nested stages of the running ones
+        self.nested = []
+        self.start = perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = perf_counter()
+        self.nested.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed - self.nested.pop()
+            if self.nested:
+                self.nested[-1] += elapsed
+
+    def timed(self, name, iterable):
+        '''generator: yields the items of iterable, the time producing them counts for stage name'''
+
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        seconds = perf_counter() - self.start
+        summary = {"name": self.name, "platform": self.platform, "seconds": seconds,
+                   "stages": dict(sorted(self.stages.items())), "counters": dict(sorted(self.counters.items()))}
+        if seconds and "pixels" in self.counters:
+            summary["pixels_per_second"] = self.counters["pixels"] / seconds
+        return summary
+
+    def finish(self, stats_file=None):
+        '''returns the summary after passing it to the hooks and writing
+        it to stats_file (appended as one JSON line, "-" is stdout). Errors
+        of the hooks and the stats file are reported on stderr, collecting
+        metrics never fails a conversion.'''
+
+        summary = self.summary()
+        hooks = list(HOOKS)
+        if os.environ.get(HOOK_VARIABLE):
+            try:
+                hooks.append(load_hook(os.environ[HOOK_VARIABLE]))
+            except Exception as error:
+                report_error("hook %s" % os.environ[HOOK_VARIABLE], error)
+        for hook in hooks:
+            try:
+                hook(summary)
+            except Exception as error:
+                report_error("hook %s" % getattr(hook, "__name__", hook), error)
+        try:
+            if stats_file == "-":
+                print(json.dumps(summary))
+            elif stats_file:
+                with open(stats_file, "a") as writer:
+                    writer.write(json.dumps(summary) + "\n")
+        except (OSError, TypeError, ValueError) as error:
+            report_error("stats file %s" % stats_file, error)
+        return summary
+
+def report_error(source, error):
+    sys.stderr.write("%s failed (%s: %s)\n" % (source, type(error).__name__, error))
+
+def report(summary):
+    '''the summary as readable lines'''
+
+    lines = ["%s: %.3fs" % (summary["name"], summary["seconds"])]
+    for stage, seconds in summary["stages"].items():
+        lines.append("  %-16s %9.3fms" % (stage, seconds * 1000))
+    for counter, value in summary["counters"].items():
+        lines.append("  %-16s %9d" % (counter, value))
+    return lines
+
+def main():
+    '''prints the summaries of a file written with --stats'''
+
+    if len(sys.argv) < 2:
+        print("not enough arguments")
+        return
+    with open(sys.argv[1]) as reader:
+        for line in reader:
+            if line.strip():
+                print("\n".join(report(json.loads(line))))
+
+if __name__ == '__main__':
+    main()
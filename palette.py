@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''palette optimizer for images with more colors than the hardware palette
+
+ Snapping every color to the nearest hardware color and keeping the first
+ 16 loses whatever comes later. Instead the colors of the image, weighted
+ by their pixel count, are clustered: median cut gives the start, k-means
+ improves it. After every step the cluster centers are moved to the
+ nearest hardware color, for the squared distance metrics that is the
+ best hardware color for the cluster, so the result is always inside the
+ gamut of the platform.
+
+ usage: palette.py image [sms|gg|sg] [size]'''
+
+import sys
+from os import path
+
+import numpy as np
+
+from quantize import nearest, nearest_indices, color_distances
+
+# stop when an iteration improves the weighted error by less than this fraction
+TOLERANCE = 0.001
+MAX_ITERATIONS = 16
+
+
+def median_cut(colors, counts, size):
+    '''splits the weighted colors into up to size boxes, returns their weighted means'''
+
+    colors = np.asarray(colors, dtype=np.float64).reshape(-1, 3)
+    counts = np.asarray(counts, dtype=np.float64)
+    boxes = [np.arange(len(colors))]
+    while len(boxes) < size:
+        spreads = []
+        for box in boxes:
+            mean = np.average(colors[box], axis=0, weights=counts[box])
+            spreads.append((counts[box] * ((colors[box] - mean)**2).sum(axis=1)).sum() if len(box) > 1 else -1)
+        largest = int(np.argmax(spreads))
+        if spreads[largest] <= 0:
+            break
+        box = boxes.pop(largest)
+        channel = np.ptp(colors[box], axis=0).argmax()
+        box = box[np.argsort(colors[box, channel], kind="stable")]
+        # cut at the weighted median, both halves keep at least one color
+        weights = np.cumsum(counts[box])
+        cut = min(max(int(np.searchsorted(weights, weights[-1] / 2)) + 1, 1), len(box) - 1)
+        boxes.extend((box[:cut], box[cut:]))
+    return np.array([np.average(colors[box], axis=0, weights=counts[box]) for box in boxes])
+
+def _fill(indices, size, colors, counts, snapped, palette, metric):
+    '''removes duplicate hardware colors and refills the free entries with
+    the hardware colors of the worst represented image colors'''
+
+    indices = list(dict.fromkeys(int(idx) for idx in indices))
+    if len(indices) < size:
+        error = color_distances(colors, palette[indices], metric).min(axis=1) * counts
+        for idx in np.argsort(-error, kind="stable"):
+            if snapped[idx] not in indices:
+                indices.append(int(snapped[idx]))
+                if len(indices) == size:
+                    break
+    return np.array(indices)
+
+def optimize_palette(colors, counts, system_palette, size=16, metric="euclidean", max_iterations=MAX_ITERATIONS):
+    '''returns the (up to) size hardware colors which represent the colors
+    weighted by counts best, as list of rgb tuples of system_palette'''
+
+    colors = np.asarray(colors, dtype=np.int64).reshape(-1, 3)
+    counts = np.asarray(counts, dtype=np.float64)
+    palette = np.asarray(system_palette, dtype=np.int64).reshape(-1, 3)
+    snapped = nearest_indices(colors, palette, metric)
+    unique = list(dict.fromkeys(snapped.tolist()))
+    if len(unique) <= size:
+        return [system_palette[idx] for idx in unique]
+
+    indices = _fill(nearest_indices(median_cut(colors, counts, size), palette, metric), size,
+                    colors, counts, snapped, palette, metric)
+    best, best_error = indices, np.inf
+    for _ in range(max_iterations):
+        distances = color_distances(colors, palette[indices], metric)
+        assigned = distances.argmin(axis=1)
+        error = (distances[np.arange(len(colors)), assigned] * counts).sum()
+        if error < best_error:
+            improvement = (best_error - error) / best_error if np.isfinite(best_error) else 1.0
+            best, best_error = indices, error
+            if improvement < TOLERANCE:
+                break
+        else:
+            break
+        weights = np.bincount(assigned, weights=counts, minlength=len(indices))
+        sums = np.zeros((len(indices), 3))
+        np.add.at(sums, assigned, colors * counts[:, None])
+        centers = sums[weights > 0] / weights[weights > 0, None]
+        indices = _fill(nearest_indices(np.rint(centers), palette, metric), size,
+                        colors, counts, snapped, palette, metric)
+        if set(indices.tolist()) == set(best.tolist()):
+            break
+    return [system_palette[idx] for idx in best]
+
+def tile_histogram(tiles, count):
+    '''the (tiles, count) matrix of how many pixels of every (tiles, 8, 8)
+    tile have each of count palette indices'''
+
+    tiles = np.asarray(tiles, dtype=np.int64).reshape(len(tiles), -1)
+    keys = np.arange(len(tiles))[:, None] * count + tiles
+    return np.bincount(keys.ravel(), minlength=len(tiles) * count).reshape(len(tiles), count)
+
+def split_palettes(histogram, distances, size=16, groups=2):
+    '''assigns every tile (a row of its color histogram) to one of groups
+    palettes of up to size colors. The distinct color sets of the tiles are
+    placed greedily, the largest first, into the palette which already has
+    them or grows the least. Tiles whose colors fit nowhere get the palette
+    where their missing colors have the closest replacements (distances
+    between the colors), free entries of that palette take the most used
+    of them. Returns the palette of every tile, the colors of every palette
+    and the number of tiles which don't fit.'''
+
+    histogram = np.asarray(histogram)
+    used = np.ascontiguousarray(histogram > 0)
+    if not len(used):
+        return np.zeros(0, dtype=np.int64), [[] for _ in range(groups)], 0
+    _, first, inverse = np.unique(used.view(np.dtype((np.void, used.shape[1]))).ravel(),
+                                  return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    pixels = np.bincount(inverse, weights=histogram.sum(axis=1))
+    sets = [frozenset(np.flatnonzero(used[idx]).tolist()) for idx in first]
+    order = sorted(range(len(sets)), key=lambda idx: (-len(sets[idx]), -pixels[idx], idx))
+
+    palettes = [set() for _ in range(groups)]
+    choice = np.full(len(sets), -1)
+    for idx in order:
+        fits = [(len(palette | sets[idx]) - len(palette), -len(palette), group)
+                for group, palette in enumerate(palettes) if len(palette | sets[idx]) <= size]
+        if fits:
+            choice[idx] = min(fits)[2]
+            palettes[choice[idx]] |= sets[idx]
+
+    missing = np.flatnonzero(choice < 0)
+    for idx in missing:
+        counts = histogram[first[idx]]
+        errors = [(counts * distances[:, sorted(palette)].min(axis=1)).sum() if palette else np.inf
+                  for palette in palettes]
+        choice[idx] = int(np.argmin(errors))
+        # free entries take the most used of the missing colors
+        extra = [color for color in np.argsort(-counts, kind="stable").tolist()
+                 if counts[color] and color not in palettes[choice[idx]]]
+        palettes[choice[idx]] |= set(extra[:size - len(palettes[choice[idx]])])
+    return choice[inverse], [sorted(palette) for palette in palettes], int(np.isin(inverse, missing).sum())
+
+def palette_error(colors, counts, palette, metric="euclidean"):
+    '''mean distance of the pixels to their nearest palette color'''
+
+    counts = np.asarray(counts, dtype=np.float64)
+    return (color_distances(colors, palette, metric).min(axis=1) * counts).sum() / counts.sum()
+
+def main():
+    if len(sys.argv) < 2:
+        print("not enough arguments")
+        return
+    if not path.exists(sys.argv[1]):
+        print("file %s doesn't exist" % (sys.argv[1]))
+        return
+
+    from PIL import Image
+    import gfxengine
+
+    profile = gfxengine.get_profile(sys.argv[2] if len(sys.argv) > 2 else "sms")
+    size = int(sys.argv[3]) if len(sys.argv) > 3 else profile.colors
+    with Image.open(sys.argv[1]) as img:
+        counts, colors = zip(*img.convert("RGB").getcolors(maxcolors=1 << 24))
+    first_come = list(dict.fromkeys(nearest(colors, profile.palette)))[:size]
+    optimized = optimize_palette(colors, counts, profile.palette, size)
+    print("colors: %d" % len(colors))
+    print("first come error: %.1f" % palette_error(colors, counts, first_come))
+    print("optimized error: %.1f" % palette_error(colors, counts, optimized))
+    print("palette: %s" % optimized)
+
+if __name__ == '__main__':
+    main()
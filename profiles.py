@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''platforms and command line options of the converters
+
+ Only needs the standard library, the command line tools import it to
+ check their arguments before numpy, PIL and the engine are loaded.'''
+
+import os
+from collections import namedtuple
+from struct import pack
+
+__version__ = 0, 3, 0
+
+CACHE_DIR = os.environ.get("GFX2SEGA8_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "gfx2sega8"))
+
+# Rec. 709 (sRGB) luma coef
+PR, PG, PB = 0.2126, 0.7152, 0.0722
+
+SMS_COLOR_PALETTE = [   (0x00,0x00,0x00),(0x54,0x00,0x00),(0xab,0x00,0x00),(0xff,0x00,0x00),
+                        (0x00,0x54,0x00),(0x54,0x54,0x00),(0xab,0x54,0x00),(0xff,0x54,0x00),
+                        (0x00,0xab,0x00),(0x54,0xab,0x00),(0xab,0xab,0x00),(0xff,0xab,0x00),
+                        (0x00,0xff,0x00),(0x54,0xff,0x00),(0xab,0xff,0x00),(0xff,0xff,0x00),
+                        (0x00,0x00,0x54),(0x54,0x00,0x54),(0xab,0x00,0x54),(0xff,0x00,0x54),
+                        (0x00,0x54,0x54),(0x54,0x54,0x54),(0xab,0x54,0x54),(0xff,0x54,0x54),
+                        (0x00,0xab,0x54),(0x54,0xab,0x54),(0xab,0xab,0x54),(0xff,0xab,0x54),
+                        (0x00,0xff,0x54),(0x54,0xff,0x54),(0xab,0xff,0x54),(0xff,0xff,0x54),
+                        (0x00,0x00,0xab),(0x54,0x00,0xab),(0xab,0x00,0xab),(0xff,0x00,0xab),
+                        (0x00,0x54,0xab),(0x54,0x54,0xab),(0xab,0x54,0xab),(0xff,0x54,0xab),
+                        (0x00,0xab,0xab),(0x54,0xab,0xab),(0xab,0xab,0xab),(0xff,0xab,0xab),
+                        (0x00,0xff,0xab),(0x54,0xff,0xab),(0xab,0xff,0xab),(0xff,0xff,0xab),
+                        (0x00,0x00,0xff),(0x54,0x00,0xff),(0xab,0x00,0xff),(0xff,0x00,0xff),
+                        (0x00,0x54,0xff),(0x54,0x54,0xff),(0xab,0x54,0xff),(0xff,0x54,0xff),
+                        (0x00,0xab,0xff),(0x54,0xab,0xff),(0xab,0xab,0xff),(0xff,0xab,0xff),
+                        (0x00,0xff,0xff),(0x54,0xff,0xff),(0xab,0xff,0xff),(0xff,0xff,0xff) ]
+
+# 4 bits per channel, red changing fastest
+GG_COLOR_PALETTE = [(red * 0x11, green * 0x11, blue * 0x11)
+                    for blue in range(16) for green in range(16) for red in range(16)]
+
+# first color is used for transparent
+SG_COLOR_PALETTE = [    (0x00,0x00,0x00),(0x00,0x00,0x00),(0x21,0xC8,0x42),(0x5E,0xDC,0x78),
+                        (0x54,0x55,0xED),(0x7D,0x76,0xFC),(0xD4,0x52,0x4D),(0x42,0xEB,0xF5),
+                        (0xFC,0x55,0x54),(0xFF,0x79,0x78),(0xD4,0xC1,0x54),(0xE6,0xCE,0x80),
+                        (0x21,0xB0,0x3B),(0xC9,0x5B,0xBA),(0xCC,0xCC,0xCC),(0xFF,0xFF,0xFF)]
+
+
+def sms_color(palette, color):
+    return pack('B', palette.index(color))
+
+def gg_color(palette, color):
+    red, green, blue = color
+    return pack('<H', (blue >> 4) << 8 | (green >> 4) << 4 | red >> 4)
+
+def sg_color(palette, color):
+    #skip transparence color
+    return pack('B', palette.index(color) or 1)
+
+# name          platform name, used for the cache key
+# bpp           bitplanes per tile row
+# max_x, max_y  screen size in pixels
+# palette       rgb tuples of the hardware colors
+# encode_color  palette entry of a hardware color as bytes
+# palette_size  the palette file is filled up to this many bytes ..
+# palette_fill  .. with this byte
+# colors        palette entries available to the image
+# max_colors    colors of the source image which still fit (None: no limit)
+# sort_colors   put darker colors in front of the palette
+# dither        dithering by default (Floyd-Steinberg)
+# strict        stop on too many colors or an invalid size instead of warning
+# name_table    supports tile deduplication with a name table
+# color_table   1bpp patterns with a color byte for every row
+Profile = namedtuple("Profile", "name bpp max_x max_y palette encode_color palette_size palette_fill "
+                                "colors max_colors sort_colors dither strict name_table color_table")
+
+PROFILES = {
+    "sms": Profile("sms", 4, 256, 240, SMS_COLOR_PALETTE, sms_color, 16, 0, 16, 16, True, True, False, True, False),
+    "gg": Profile("gg", 4, 256, 224, GG_COLOR_PALETTE, gg_color, 32, 0, 16, 16, False, False, True, True, False),
+    "sg": Profile("sg", 1, 256, 192, SG_COLOR_PALETTE, sg_color, 16, 10, 15, None, False, False, True, False, True),
+}
+
+# values of --dither, floyd is error diffusion (Floyd-Steinberg), bayer and noise
+# are ordered with a Bayer or a blue noise threshold matrix
+DITHER_MODES = ("floyd", "bayer", "noise")
+
+def sprite_conflicts(options):
+    '''the flags of options which sprite sheets don't support'''
+
+    flags = (("resize", "--resize"), ("dedupe", "--dedupe"), ("stream", "--stream"), ("compression", "--compress"))
+    conflicts = [flag for key, flag in flags if options[key]]
+    if options["palettes"] > 1:
+        conflicts.append("--dual-palette")
+    return conflicts
+
+def parse_options(args):
+    '''command line flags shared by the converters, None if one of them has
+    an invalid value'''
+
+    options = {"grayscale": '-gs' in args, "dedupe": '--dedupe' in args,
+               "use_cache": '--no-cache' not in args, "stream": '--stream' in args,
+               "optimize": '--optimize' in args, "quiet": '--quiet' in args,
+               "dithering": None, "resize": None, "compression": None, "stats": None,
+               "sprites": None, "palettes": 2 if '--dual-palette' in args else 1}
+    if '--dither' in args:
+        options["dithering"] = True
+        if '--dither' in args[:-1] and args[args.index('--dither') + 1].lower() in DITHER_MODES:
+            options["dithering"] = args[args.index('--dither') + 1].lower()
+    if '--no-dither' in args:
+        options["dithering"] = False
+    if '--compress' in args[:-1]:
+        import compress
+
+        options["compression"] = args[args.index('--compress') + 1].lower()
+        if options["compression"] not in compress.CODECS:
+            print("unknown compression %s" % options["compression"])
+            return
+    if '--stats' in args[:-1]:
+        options["stats"] = args[args.index('--stats') + 1]
+    if '--sprites' in args[:-1]:
+        options["sprites"] = tuple(map(int, args[args.index('--sprites') + 1].split(',')))
+    if '--resize' in args[:-1]:
+        options["resize"] = tuple(map(lambda x: int(x), args[args.index('--resize') + 1].split(',')))
+    if options["sprites"] and sprite_conflicts(options):
+        print("--sprites can't be combined with %s" % ", ".join(sprite_conflicts(options)))
+        return
+    return options
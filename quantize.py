@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''nearest palette color lookup tables
+
+ Instead of searching the palette for every color a lookup table holding
+ the nearest palette index for every rgb value is built once per palette
+ and metric and stored in the cache directory. Later runs map the table
+ into memory, quantizing a whole image is a single fancy-indexing
+ operation. With 8 bits per channel (the default) the table has 256^3
+ entries and is exact, fewer bits give a smaller approximate table.
+
+ Building a whole table only pays off for the fixed platform palettes.
+ The colors matched against other palettes (optimized or the used colors
+ of an image) are remembered by a ColorMemo: one table per palette,
+ indexed by the packed 24 bit rgb value and filled as colors come. The
+ tables are sparse files in the cache directory, mapped into memory by
+ every process, so worker processes and later runs share the resolved
+ colors.'''
+
+import os
+import sys
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from profiles import CACHE_DIR
+
+# Rec. 709 (sRGB) luma coef
+REC709 = (0.2126, 0.7152, 0.0722)
+
+METRICS = {"euclidean": None, "rec709": REC709}
+
+MEMO_DIR = os.path.join(CACHE_DIR, "memo")
+# memo tables a process keeps mapped and tables kept in MEMO_DIR
+MEMO_PALETTES = 8
+MEMO_FILES = 64
+
+# tables which are already loaded by this process
+_luts = {}
+
+# memo of the conversions in this process, see color_memo
+_memo = None
+
+
+def _distances(colors, palette, weights):
+    '''squared (and optionally weighted) distance of every color to every palette entry'''
+
+    diff = (colors[:, None, :] - palette[None, :, :])**2
+    if weights is None:
+        return diff.sum(axis=2)
+    pr, pg, pb = weights
+    return pr * diff[..., 0] + pg * diff[..., 1] + pb * diff[..., 2]
+
+def grid_levels(palette):
+    '''returns the levels of every channel if the palette holds all their
+    combinations with red changing fastest (like the SMS and GG palettes)'''
+
+    palette = np.asarray(palette, dtype=np.int64).reshape(-1, 3)
+    levels = [np.unique(palette[:, channel]) for channel in range(3)]
+    if len(palette) != len(levels[0]) * len(levels[1]) * len(levels[2]):
+        return None
+    blue, green, red = np.meshgrid(levels[2], levels[1], levels[0], indexing="ij")
+    grid = np.stack([red.ravel(), green.ravel(), blue.ravel()], axis=1)
+    return levels if np.array_equal(grid, palette) else None
+
+def _grid_indices(channels, levels):
+    '''nearest grid entry: every channel is rounded on its own, on ties the
+    lower level and thereby the lower palette index wins'''
+
+    red, green, blue = [(np.abs(channel[..., None] - level)).argmin(axis=-1)
+                        for channel, level in zip(channels, levels)]
+    return red + len(levels[0]) * (green + len(levels[1]) * blue)
+
+def nearest_indices(colors, palette, metric="euclidean", memo=None):
+    '''returns the index of the nearest palette entry for every color,
+    the first entry wins on ties like in gfx2sms.closest. With a ColorMemo
+    only colors which weren't matched against palette before are searched.'''
+
+    if memo is not None:
+        return memo.nearest_indices(colors, palette, metric)
+    colors = np.asarray(colors, dtype=np.int64).reshape(-1, 3)
+    palette = np.asarray(palette, dtype=np.int64).reshape(-1, 3)
+    levels = grid_levels(palette)
+    if levels is not None:
+        # the metrics are sums over the channels, their minimum is the one of every channel
+        return _grid_indices((colors[:, 0], colors[:, 1], colors[:, 2]), levels)
+    return _distances(colors, palette, METRICS[metric]).argmin(axis=1)
+
+def color_distances(colors, palette, metric="euclidean"):
+    '''returns the (colors, palette) matrix of distances'''
+
+    colors = np.asarray(colors, dtype=np.float64).reshape(-1, 3)
+    palette = np.asarray(palette, dtype=np.float64).reshape(-1, 3)
+    return _distances(colors, palette, METRICS[metric])
+
+def palette_distances(palette, metric="euclidean"):
+    '''returns the (n, n) matrix of distances between the palette entries'''
+
+    palette = np.asarray(palette, dtype=np.int64).reshape(-1, 3)
+    return _distances(palette, palette, METRICS[metric])
+
+def nearest(colors, palette, metric="euclidean", memo=None):
+    '''returns the nearest palette color for every color as list of tuples'''
+
+    indices = nearest_indices(colors, palette, metric, memo)
+    return [tuple(palette[idx]) for idx in indices]
+
+def palette_key(palette, metric="euclidean", bits=8):
+    '''identifies a lookup table by its palette, metric and resolution'''
+
+    digest = hashlib.sha1(np.asarray(palette, dtype=np.uint8).tobytes()).hexdigest()[:16]
+    return "lut-%s-%s-%d" % (digest, metric, bits)
+
+def build_lut(palette, metric="euclidean", bits=8):
+    '''computes the (2^bits, 2^bits, 2^bits) table of nearest palette indices'''
+
+    palette = np.asarray(palette, dtype=np.int64).reshape(-1, 3)
+    if len(palette) > 65536:
+        raise ValueError("palette has more than 65536 colors")
+    weights = METRICS[metric] or (1, 1, 1)
+    size = 1 << bits
+    shift = 8 - bits
+    # quantize the center of every cell
+    levels = (np.arange(size, dtype=np.int64) << shift) + ((1 << shift) >> 1)
+    lut_type = np.uint8 if len(palette) <= 256 else np.uint16
+    grid = grid_levels(palette)
+    if grid is not None:
+        return _grid_indices(np.ix_(levels, levels, levels), grid).astype(lut_type)
+    # the metric is a sum over the channels, so the per channel distances
+    # are computed once and only added up for every red slice
+    dtype = np.int32 if METRICS[metric] is None else np.float64
+    channel = [(weight * (levels[:, None] - palette[None, :, idx])**2).astype(dtype)
+               for idx, weight in enumerate(weights)]
+    lut = np.empty((size, size, size), dtype=lut_type)
+    for red in range(size):
+        red_green = channel[0][red][None, :] + channel[1]
+        lut[red] = (red_green[:, None, :] + channel[2][None, :, :]).argmin(axis=2)
+    return lut
+
+def load_lut(palette, metric="euclidean", bits=8, cache_dir=None):
+    '''returns the lookup table for palette, built on first use and
+    memory-mapped from the cache directory afterwards'''
+
+    key = palette_key(palette, metric, bits)
+    if key in _luts:
+        return _luts[key]
+
+    cache_dir = cache_dir or CACHE_DIR
+    file_name = os.path.join(cache_dir, key + ".npy")
+    try:
+        lut = np.load(file_name, mmap_mode="r")
+    except (OSError, ValueError):
+        lut = build_lut(palette, metric, bits)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # write to a temporary file first, concurrent builds must not see half a table
+            temp_name = "%s.%d.tmp" % (file_name, os.getpid())
+            with open(temp_name, "wb") as writer:
+                np.save(writer, lut)
+            os.replace(temp_name, file_name)
+        except OSError:
+            pass
+    _luts[key] = lut
+    return lut
+
+
+
+class ColorMemo(object):
+    '''nearest palette indices of rgb colors, remembered per palette.
+
+    Every palette gets a table of 2^24 entries holding index + 1 of the
+    nearest palette entry, 0 for colors not looked up yet. The tables are
+    sparse files in cache_dir (in memory if it isn't writable), only the
+    pages of colors which occur take up memory. At most max_palettes
+    tables are kept mapped, the least recently used one is dropped first.
+    hits and misses count the looked up colors of all threads,
+    thread_counts those of the calling thread.'''
+
+    def __init__(self, cache_dir=None, max_palettes=MEMO_PALETTES, max_files=MEMO_FILES):
+        self.cache_dir = cache_dir or MEMO_DIR
+        self.max_palettes = max_palettes
+        self.max_files = max_files
+        self.tables = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+        self.local = threading.local()
+
+    def table(self, palette, metric="euclidean"):
+        key = palette_key(palette, metric).replace("lut-", "memo-", 1)
+        with self.lock:
+            if key in self.tables:
+                self.tables.move_to_end(key)
+                return self.tables[key]
+            # index + 1 has to fit, 0 marks unknown colors
+            dtype = np.uint8 if len(palette) < 255 else np.uint16
+            try:
+                table = self._map(key, dtype)
+            except (OSError, ValueError):
+                table = np.zeros(1 << 24, dtype=dtype)
+            self.tables[key] = table
+            while len(self.tables) > self.max_palettes:
+                self.tables.popitem(last=False)
+            return table
+
+    def _map(self, key, dtype):
+        file_name = os.path.join(self.cache_dir, key + ".bin")
+        size = (1 << 24) * np.dtype(dtype).itemsize
+        if not os.path.exists(file_name):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self.evict(self.max_files - 1)
+        # growing the file only adds holes, concurrent processes may do it at the same time
+        with open(file_name, "ab") as writer:
+            if writer.tell() < size:
+                writer.truncate(size)
+        # the modification time of a table is its last use
+        os.utime(file_name)
+        return np.memmap(file_name, dtype=dtype, mode="r+", shape=(1 << 24,))
+
+    def evict(self, max_files=None):
+        '''removes the least recently used tables until at most max_files are left'''
+
+        max_files = self.max_files if max_files is None else max_files
+        try:
+            names = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir)
+                     if name.startswith("memo-")]
+        except OSError:
+            return
+        names.sort(key=lambda name: os.stat(name).st_mtime)
+        for name in names[:max(0, len(names) - max_files)]:
+            try:
+                os.remove(name)
+            except OSError:
+                pass
+
+    def nearest_indices(self, colors, palette, metric="euclidean"):
+        colors = np.asarray(colors, dtype=np.int64).reshape(-1, 3)
+        if grid_levels(palette) is not None:
+            # rounding every channel is as fast as the lookup
+            return nearest_indices(colors, palette, metric)
+        table = self.table(palette, metric)
+        packed = colors[:, 0] << 16 | colors[:, 1] << 8 | colors[:, 2]
+        indices = table[packed].astype(np.int64) - 1
+        missing = indices < 0
+        found = int(missing.sum())
+        with self.lock:
+            self.hits += len(indices) - found
+            self.misses += found
+        hits, misses = self.thread_counts()
+        self.local.hits, self.local.misses = hits + len(indices) - found, misses + found
+        if found:
+            new_colors, inverse = np.unique(packed[missing], return_inverse=True)
+            new_indices = nearest_indices(np.stack([new_colors >> 16, new_colors >> 8 & 0xff, new_colors & 0xff],
+                                                   axis=1), palette, metric)
+            table[new_colors] = new_indices + 1
+            indices[missing] = new_indices[inverse.reshape(-1)]
+        return indices
+
+    def thread_counts(self):
+        '''hits and misses of the lookups of the calling thread'''
+
+        return getattr(self.local, "hits", 0), getattr(self.local, "misses", 0)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+def color_memo():
+    '''the ColorMemo shared by the conversions of this process'''
+
+    global _memo
+    if _memo is None:
+        _memo = ColorMemo()
+    return _memo
+
+def lookup(pixels, lut):
+    '''maps an (..., 3) rgb array to palette indices'''
+
+    pixels = np.asarray(pixels)
+    shift = 8 - (len(lut) - 1).bit_length()
+    if shift:
+        pixels = pixels >> shift
+    return lut[pixels[..., 0], pixels[..., 1], pixels[..., 2]]
+
+def map_image(pixels, palette, metric="euclidean", bits=8):
+    '''replaces every pixel of the rgb array by its nearest palette color'''
+
+    indices = lookup(pixels, load_lut(palette, metric, bits))
+    return np.asarray(palette, dtype=np.uint8).reshape(-1, 3)[indices]
+
+def main():
+    '''prebuilds the tables for the platform palettes'''
+
+    from profiles import PROFILES
+
+    bits = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    for name, profile in sorted(PROFILES.items()):
+        for metric in METRICS:
+            load_lut(profile.palette, metric, bits)
+            print("%s: %s" % (name, palette_key(profile.palette, metric, bits)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''header report for whole rom collections
+
+ usage: romscan.py [--format jsonl|csv] [--output FILE] [--workers N] [--index FILE] dir [dir ..]
+
+ Walks the directories, analyses every rom with smsheader in a pool of
+ worker processes and writes one record per rom as JSON Lines or CSV.
+ Records are remembered in an index keyed by path, modification time
+ and size, roms which didn't change since the last scan are not read again.'''
+
+import os
+from os import path
+import sys
+import csv
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import smsheader
+from profiles import CACHE_DIR
+
+ROM_EXTENSIONS = (".sms", ".gg", ".sg", ".sc")
+
+INDEX_FILE = path.join(CACHE_DIR, "romscan.json")
+
+
+def collect_roms(directories):
+    roms = []
+    for directory in directories:
+        if path.isfile(directory):
+            roms.append(path.abspath(directory))
+            continue
+        for root, _, names in os.walk(directory):
+            roms.extend(path.abspath(path.join(root, name)) for name in names
+                        if name.lower().endswith(ROM_EXTENSIONS))
+    return sorted(set(roms))
+
+def analyse_file(file_name):
+    '''worker: returns the record of one rom, errors are part of the record'''
+
+    try:
+        with smsheader.Rom(file_name) as rom:
+            return smsheader.analyse_rom(rom)
+    except (OSError, ValueError) as error:
+        return {"file": file_name, "error": "%s: %s" % (type(error).__name__, error)}
+
+def load_index(file_name):
+    try:
+        with open(file_name) as reader:
+            return json.load(reader)
+    except (OSError, ValueError):
+        return {}
+
+def save_index(file_name, index):
+    directory = path.dirname(file_name)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_name = "%s.%d.tmp" % (file_name, os.getpid())
+    with open(temp_name, "w") as writer:
+        json.dump(index, writer)
+    os.replace(temp_name, file_name)
+
+def scan(directories, workers=None, index_file=INDEX_FILE):
+    '''returns the records of all roms below directories, unchanged roms
+    are taken from the index'''
+
+    index = load_index(index_file) if index_file else {}
+    records, pending = {}, []
+    for file_name in collect_roms(directories):
+        info = os.stat(file_name)
+        entry = index.get(file_name)
+        if entry and entry["mtime"] == info.st_mtime and entry["size"] == info.st_size:
+            records[file_name] = entry["record"]
+        else:
+            pending.append(file_name)
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for file_name, record in zip(pending, executor.map(analyse_file, pending, chunksize=8)):
+                records[file_name] = record
+                if "error" not in record:
+                    index[file_name] = {"mtime": record["mtime"], "size": record["size"], "record": record}
+
+    if index_file:
+        # forget roms which don't exist anymore
+        index = dict((file_name, entry) for file_name, entry in index.items() if path.exists(file_name))
+        save_index(index_file, index)
+    return [records[file_name] for file_name in sorted(records)], len(pending)
+
+def write_jsonl(records, writer):
+    for record in records:
+        writer.write(json.dumps(record, sort_keys=True) + "\n")
+
+def write_csv(records, writer):
+    fields = sorted(set(key for record in records for key in record))
+    # the identifying columns first
+    fields.sort(key=lambda field: field != "file")
+    csv_writer = csv.DictWriter(writer, fieldnames=fields)
+    csv_writer.writeheader()
+    csv_writer.writerows(records)
+
+def main():
+    args = sys.argv[1:]
+    output_format, output, workers, index_file = "jsonl", None, None, INDEX_FILE
+    directories = []
+    while args:
+        arg = args.pop(0)
+        if arg == "--format" and args:
+            output_format = args.pop(0).lower()
+        elif arg == "--output" and args:
+            output = args.pop(0)
+        elif arg == "--workers" and args:
+            workers = int(args.pop(0))
+        elif arg == "--index" and args:
+            index_file = args.pop(0)
+        elif arg == "--no-index":
+            index_file = None
+        else:
+            directories.append(arg)
+
+    if output_format not in ("jsonl", "csv"):
+        print("unknown format %s" % output_format)
+        return
+    if not directories:
+        print("not enough arguments")
+        return
+
+    records, analysed = scan(directories, workers, index_file)
+    write = write_csv if output_format == "csv" else write_jsonl
+    if output:
+        with open(output, "w", newline="") as writer:
+            write(records, writer)
+    else:
+        write(records, sys.stdout)
+    print("%d roms, %d analysed, %d from index" % (len(records), analysed, len(records) - analysed), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''frame sequences (cutscenes) as a stream of changed tiles
+
+ usage: sequence.py [--platform sms|gg] [--budget BYTES] [--slots N] [converter flags] folder|animation [output_base]
+
+ The frames are the images of a folder in name order or the frames of an
+ animated image (gif). All frames share one palette and are converted
+ like screens, bands of tile rows which didn't change since the last
+ frame aren't converted again (see gfxengine.index_bands). Platforms
+ which dither by default get the ordered bayer mode: with Floyd-Steinberg
+ the error of a small change spreads over all tiles below it and every
+ frame gets as large as the first.
+
+ The first frame is stored in full, every later one only with the tiles
+ and name table entries which differ from the frame before. Tiles are
+ kept in VRAM slots, a tile which is already loaded (also flipped) is
+ used again and slots no entry refers to anymore are overwritten.
+
+ output.pal  the palette
+ output.seq  a little endian word with the number of frames, then for
+             every frame: words with the number of tile runs and name
+             runs, every tile run is the first slot (word), the number
+             of tiles (byte) and the planar tiles, every name run the
+             first cell (word), the number of entries (byte) and the
+             entries (words)
+
+ For every frame the bytes written to the VDP (the address setup of a
+ run included) are compared with what fits into the vertical blank.'''
+
+import sys
+from os import path
+from struct import pack, unpack_from
+
+import numpy as np
+from PIL import Image, ImageSequence
+
+import batch
+import gfxengine
+from metrics import Metrics
+import profiles
+import tiles
+
+# 70 lines of vertical blank (NTSC) at 228 cycles, an unrolled outi takes 16 cycles
+VBLANK_BUDGET = 70 * 228 // 16
+
+# runs hold at most a byte worth of tiles or entries
+MAX_RUN = 255
+
+# the vdp address written before every run
+ADDRESS_BYTES = 2
+
+
+def load_frames(source):
+    '''the frames of an animated image or the images of a folder as rgb images'''
+
+    if path.isdir(source):
+        frames = []
+        for file_name in batch.collect_files([source]):
+            with Image.open(file_name) as img:
+                frames.append(img.convert("RGB"))
+        return frames
+    with Image.open(source) as img:
+        return [frame.convert("RGB") for frame in ImageSequence.Iterator(img)]
+
+
+class TileSlots(object):
+    '''the tiles in VRAM: the pattern of every slot and how many
+    name table entries refer to it'''
+
+    def __init__(self, count=tiles.VRAM_TILES):
+        # the name table addresses no more slots
+        count = max(1, min(count, tiles.TILE_INDEX_MASK + 1))
+        self.keys = [None] * count
+        self.refs = np.zeros(count, dtype=np.int32)
+        self.known = {}
+        self.loaded = 0
+
+    def release(self, entries):
+        np.subtract.at(self.refs, np.asarray(entries) & tiles.TILE_INDEX_MASK, 1)
+
+    def place(self, tile):
+        '''returns the name table entry showing tile and the slot
+        it has to be uploaded to (None if it is loaded already)'''
+
+        for flags, variant in ((0, tile), (tiles.FLIP_H, tile[:, ::-1]), (tiles.FLIP_V, tile[::-1, :]),
+                               (tiles.FLIP_H | tiles.FLIP_V, tile[::-1, ::-1])):
+            slot = self.known.get(variant.tobytes())
+            if slot is not None:
+                self.refs[slot] += 1
+                return slot | flags, None
+        # slots never used first, the unused ones keep their tile in case it comes back
+        if self.loaded < len(self.keys):
+            slot = self.loaded
+            self.loaded += 1
+        else:
+            free = np.flatnonzero(self.refs == 0)
+            if not len(free):
+                raise ValueError("more than %d different tiles on screen" % len(self.keys))
+            slot = int(free[0])
+            del self.known[self.keys[slot]]
+        self.keys[slot] = tile.tobytes()
+        self.known[self.keys[slot]] = slot
+        self.refs[slot] = 1
+        return slot, slot
+
+def find_runs(positions):
+    '''splits sorted positions into (first, count) runs of consecutive ones'''
+
+    positions = np.asarray(positions, dtype=np.int64)
+    if not len(positions):
+        return []
+    starts = np.flatnonzero(np.diff(positions) != 1) + 1
+    runs = []
+    for part in np.split(positions, starts):
+        for first in range(0, len(part), MAX_RUN):
+            runs.append((int(part[first]), len(part[first:first + MAX_RUN])))
+    return runs
+
+def delta_frames(frames, slots):
+    '''compares the (cells, 8, 8) tile arrays of the frames with the frame
+    before, yields the uploads (slot -> tile) and the changed name table
+    entries (cell -> entry) of every frame, the first frame in full'''
+
+    previous = name_table = None
+    for cells in frames:
+        cells = cells.astype(np.uint8)
+        if previous is None or previous.shape != cells.shape:
+            changed = np.arange(len(cells))
+            old_table, name_table = None, np.zeros(len(cells), dtype=np.uint16)
+        else:
+            changed = np.flatnonzero((cells != previous).reshape(len(cells), -1).any(axis=1))
+            old_table = name_table.copy()
+            # all changed entries let go of their tile before any new one is placed
+            slots.release(name_table[changed])
+        uploads = {}
+        for cell in changed:
+            name_table[cell], slot = slots.place(cells[cell])
+            if slot is not None:
+                uploads[slot] = cells[cell]
+        if old_table is not None:
+            # a tile uploaded to the slot it replaced needs no new entry
+            changed = changed[name_table[changed] != old_table[changed]]
+        previous = cells
+        yield uploads, dict((int(cell), int(name_table[cell])) for cell in changed)
+
+def encode_frame(uploads, names, bpp):
+    '''one frame of the .seq stream and the bytes it writes to the vdp'''
+
+    tile_runs, name_runs = find_runs(sorted(uploads)), find_runs(sorted(names))
+    data = pack("<HH", len(tile_runs), len(name_runs))
+    for first, count in tile_runs:
+        data += pack("<HB", first, count)
+        data += tiles.encode_tiles([uploads[slot] for slot in range(first, first + count)], bpp)
+    for first, count in name_runs:
+        data += pack("<HB", first, count)
+        data += tiles.encode_name_table([names[cell] for cell in range(first, first + count)])
+    vdp_bytes = (ADDRESS_BYTES * (len(tile_runs) + len(name_runs)) +
+                 len(uploads) * tiles.TILE_HEIGHT * bpp + 2 * len(names))
+    return data, vdp_bytes
+
+def decode_sequence(data, bpp, cells, slots=tiles.VRAM_TILES):
+    '''reference decoder: yields the VRAM tiles and the name table after every frame'''
+
+    tile_bytes = tiles.TILE_HEIGHT * bpp
+    vram = np.zeros((slots, tiles.TILE_HEIGHT, tiles.TILE_WIDTH), dtype=np.uint8)
+    name_table = np.zeros(cells, dtype=np.uint16)
+    frames, = unpack_from("<H", data)
+    offset = 2
+    for _ in range(frames):
+        tile_runs, name_runs = unpack_from("<HH", data, offset)
+        offset += 4
+        for _ in range(tile_runs):
+            first, count = unpack_from("<HB", data, offset)
+            offset += 3
+            vram[first:first + count] = tiles.decode_tiles(data[offset:offset + count * tile_bytes], bpp)
+            offset += count * tile_bytes
+        for _ in range(name_runs):
+            first, count = unpack_from("<HB", data, offset)
+            offset += 3
+            name_table[first:first + count] = np.frombuffer(data[offset:offset + 2 * count], dtype="<u2")
+            offset += 2 * count
+        yield vram.copy(), name_table.copy()
+
+def convert_sequence(frames, profile="sms", dithering=None, grayscale=False, optimize=False, budget=VBLANK_BUDGET,
+                     slot_count=tiles.VRAM_TILES, verbose=False, metrics=None):
+    '''converts the rgb frames, returns the palette, the .seq stream and the
+    vdp bytes of every frame, or None if they can't be converted'''
+
+    profile = gfxengine.get_profile(profile)
+    metrics = metrics or Metrics()
+    # error diffusion carries every change down to the bottom of the screen
+    if dithering is None:
+        dithering = "bayer" if profile.dither else False
+    if not profile.name_table:
+        print("sequences aren't supported for %s" % profile.name)
+        return
+    if not frames:
+        print("no frames")
+        return
+    width, height = frames[0].size
+    if any(frame.size != (width, height) for frame in frames):
+        print("frames differ in size")
+        return
+    if width > profile.max_x or height > profile.max_y:
+        print("invalid image dimensions")
+        return
+
+    # the frames stacked on each other give the palette of the whole sequence
+    with metrics.stage("prepare"):
+        strip = Image.new("RGB", (width, height * len(frames)))
+        for number, frame in enumerate(frames):
+            strip.paste(frame, (0, number * height))
+        strip = gfxengine.prepare(strip, profile._replace(max_y=height * len(frames)), grayscale, None, optimize,
+                                  verbose)
+    if strip is None:
+        return
+    with metrics.stage("palette"):
+        colors, matched, used = gfxengine.build_palette(strip, profile, optimize, metrics)
+    metrics.count("source_colors", len(colors))
+    metrics.count("palette_colors", len(used))
+    gfxengine.log(verbose, f"colors(#{len(used)}): {used}")
+
+    def frame_tiles():
+        state = None
+        for number in range(len(frames)):
+            frame = strip.crop((0, number * height, width, (number + 1) * height))
+            bands, state, _ = gfxengine.index_bands(frame, profile, colors, matched, used, dithering, state, metrics)
+            yield tiles.split_tiles(np.concatenate(bands))
+
+    slots = TileSlots(slot_count)
+    stream, sizes = [pack("<H", len(frames))], []
+    for uploads, names in metrics.timed("delta", delta_frames(frame_tiles(), slots)):
+        with metrics.stage("encode"):
+            data, vdp_bytes = encode_frame(uploads, names, profile.bpp)
+        stream.append(data)
+        sizes.append(vdp_bytes)
+        metrics.count("tile_uploads", len(uploads))
+        metrics.count("name_updates", len(names))
+        metrics.count("over_budget", vdp_bytes > budget)
+    metrics.count("frames", len(frames))
+    return gfxengine.encode_palette(used, profile), b"".join(stream), sizes
+
+def convert_file(source, profile="sms", output_base=None, verbose=False, dithering=None, grayscale=False,
+                 optimize=False, budget=VBLANK_BUDGET, slot_count=tiles.VRAM_TILES, quiet=False, metrics=None,
+                 stats=None):
+    '''converts a folder or an animated image and writes <output_base>.pal/.seq,
+    returns the written file names or None if it can't be converted'''
+
+    profile = gfxengine.get_profile(profile)
+    if output_base is None:
+        output_base = path.normpath(source) if path.isdir(source) else path.splitext(source)[0]
+    outputs = {".pal": output_base + ".pal", ".seq": output_base + ".seq"}
+    metrics = metrics or Metrics(source, profile.name)
+    verbose = verbose and not quiet
+
+    try:
+        gfxengine.log(verbose, f"open {source}..")
+        with metrics.stage("decode"):
+            frames = load_frames(source)
+        try:
+            sequence = convert_sequence(frames, profile, dithering, grayscale, optimize, budget, slot_count,
+                                        verbose, metrics)
+        except ValueError as error:
+            print(error)
+            sequence = None
+        if sequence is None:
+            metrics.count("failed")
+            return
+        palette, stream, sizes = sequence
+        if not quiet:
+            for number, size in enumerate(sizes):
+                print("frame %4d %6d bytes%s" % (number, size, " over budget" if size > budget else ""))
+            print("%d frames, %d stream bytes, %d of %d frames within %d bytes" % (len(sizes), len(stream),
+                  sum(size <= budget for size in sizes), len(sizes), budget))
+        with metrics.stage("write"):
+            for extension, data in ((".pal", palette), (".seq", stream)):
+                with open(outputs[extension], "wb") as writer:
+                    writer.write(data)
+                metrics.count("bytes_written", len(data))
+        return outputs
+    finally:
+        metrics.finish(stats)
+
+def main():
+    args = sys.argv[1:]
+    platform, budget, slot_count, flags, names = "sms", VBLANK_BUDGET, tiles.VRAM_TILES, [], []
+    while args:
+        arg = args.pop(0)
+        if arg == "--platform" and args:
+            platform = args.pop(0).lower()
+        elif arg == "--budget" and args:
+            budget = int(args.pop(0))
+        elif arg == "--slots" and args:
+            slot_count = int(args.pop(0))
+        elif arg == "--stats" and args:
+            flags.extend((arg, args.pop(0)))
+        elif arg == "--dither" and args and args[0].lower() in profiles.DITHER_MODES:
+            flags.extend((arg, args.pop(0)))
+        elif arg.startswith("-"):
+            flags.append(arg)
+        else:
+            names.append(arg)
+
+    if platform not in profiles.PROFILES:
+        print("unknown platform %s" % platform)
+        return
+    if not names:
+        print("not enough arguments")
+        return
+    if not path.exists(names[0]):
+        print("file %s doesn't exist" % names[0])
+        return
+    options = profiles.parse_options(flags)
+    if options is None:
+        return
+    outputs = convert_file(names[0], platform, names[1] if len(names) > 1 else None, dithering=options["dithering"],
+                           grayscale=options["grayscale"], optimize=options["optimize"], budget=budget,
+                           slot_count=slot_count, quiet=options["quiet"], stats=options["stats"])
+    if outputs and not options["quiet"]:
+        print(" ".join(sorted(outputs.values())))
+
+if __name__ == '__main__':
+    main()
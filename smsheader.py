@@ -1,25 +1,18 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from __future__ import print_function, division
 from sys import argv
 from binascii import crc32
-from functools import partial
-from os import stat
+from mmap import mmap, ACCESS_READ
+from os import fstat
 from os.path import splitext, exists, split
-from struct import pack, unpack
+from struct import pack, unpack, unpack_from
 from time import strftime, gmtime
 from datetime import datetime
-from platform import python_version_tuple as version
- 
+
 __version__ = 0, 1, 1 
 __author__ = "darktrym"
 
-version = int(version()[0])
-
-if version < 3:
-    input = raw_input
-
 #port of maxims sms/gg header rom reader
 
 '''SMS/GG rom header reader
@@ -60,66 +53,96 @@ VENDORS = { 0x02: "Sega", 0x03: "Sega",
             0xF4: 'Technos Japan Corp. [only one]'}
 
 
-def calc_checksum(file_name, range_start, range_end, start_value=0):
-    '''This function calculates the SMS internal checksum. The parameters should be obvious.'''
+class Rom(object):
+    '''A rom file which is opened and mapped into memory once, all header
+    fields, strings and checksum ranges are read from that mapping.'''
 
-    with open(file_name, "rb") as f:
-        f.seek(range_start)
-        total_read = range_start
-        result = start_value
-        BUFFER_SIZE = 32 * 1024
-        # repeatedly read 32K chunks and checksum them, stopping at end point
-        for buffer in iter(partial(f.read, BUFFER_SIZE), b""):
-            for count, _ in enumerate(buffer):
-                if total_read + count - 1 == range_end:
-                    break
-                result = (result + byte(buffer[count])) % 2**16
-            
-            total_read += len(buffer)
-            if total_read >= range_end:
-                break
-        return result % 2**16
-
-def file_size(file_name):
-    return stat(file_name).st_size
-
-def file_created(file_name):
-    return stat(file_name).st_mtime
-
-def calc_codies_checksum(file_name, num_pages):
-    with open(file_name, "rb") as f:
-        f.seek(0)
-        result = 0
-        WORD_SIZE = 2
-        total_read = 0
-        BUFFER_SIZE = 8 * 1024 * WORD_SIZE
-        for buffer in iter(partial(f.read, BUFFER_SIZE), b""):
-            words = len(buffer) // WORD_SIZE
-            if words > 0: 
-                for count in range(words):
-                    if not (0x3ff8 <= total_read + count <= 0x3fff):
-                        result = (result + unpack("<H", buffer[count * 2:(count + 1) * 2])[0]) % 2**16
-                    if total_read + count == num_pages * 0x2000:
-                        break
-                
-            total_read += words
-            if words == 0 or words == num_pages * 0x2000:
-                break
-        return result
+    def __init__(self, file_name):
+        self.file_name = file_name
+        with open(file_name, "rb") as f:
+            info = fstat(f.fileno())
+            self.size, self.mtime = info.st_size, info.st_mtime
+            # an empty file can't be mapped
+            self.data = mmap(f.fileno(), 0, access=ACCESS_READ) if self.size else b""
+        self._prefix_sums = None
 
-def byte(a):
-    '''helper for hybrid python 2 & 3 support'''
-    
-    return a if version == 3 else ord(a)
+    def prefix_sums(self):
+        '''cumulative byte sums, the sum of the bytes [start, stop) is
+        prefix_sums()[stop] - prefix_sums()[start]'''
 
-def crc_file(file_name):
-    BUFFER_SIZE = 8 * 1024
-    
-    with open(file_name, "rb") as f:
-        crcbin = 0
-        for buffer in iter(partial(f.read, BUFFER_SIZE), b""):
-            crcbin = crc32(buffer, crcbin)
-        return "%08X" % (crcbin & 0xffffffff)
+        if self._prefix_sums is None:
+            # numpy is only needed for the checksums, loading it delays every start
+            import numpy as np
+
+            prefix_sums = np.zeros(self.size + 1, dtype=np.uint64)
+            np.cumsum(np.frombuffer(self.data, dtype=np.uint8), dtype=np.uint64, out=prefix_sums[1:])
+            self._prefix_sums = prefix_sums
+        return self._prefix_sums
+
+    def chunks(self, start, chunk_size):
+        '''yields zero-copy views of chunk_size bytes beginning at start'''
+
+        view = memoryview(self.data)
+        try:
+            for pos in range(start, self.size, chunk_size):
+                yield view[pos:pos + chunk_size]
+        finally:
+            view.release()
+
+    def unpack(self, fmt, offset):
+        return unpack_from(fmt, self.data, offset)
+
+    def close(self):
+        if self.size:
+            self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def calc_checksum(rom, range_start, range_end, start_value=0):
+    '''This function calculates the SMS internal checksum. The parameters should be obvious.'''
+
+    # range_end is included, except if the range is a multiple of 32K: the
+    # original Delphi-style loop read 32K chunks and stopped right there
+    BUFFER_SIZE = 32 * 1024
+    if range_end > range_start and (range_end - range_start) % BUFFER_SIZE == 0:
+        range_stop = range_end
+    else:
+        range_stop = range_end + 1
+    range_start, range_stop = min(range_start, rom.size), min(range_stop, rom.size)
+    if range_stop <= range_start:
+        return start_value % 2**16
+    prefix_sums = rom.prefix_sums()
+    return (start_value + int(prefix_sums[range_stop] - prefix_sums[range_start])) % 2**16
+
+def calc_codies_checksum(rom, num_pages):
+    '''sum of the little endian words of the rom without the sega header'''
+
+    import numpy as np
+
+    WORD_SIZE = 2
+    BUFFER_WORDS = 8 * 1024
+    words = np.frombuffer(rom.data, dtype="<u2", count=rom.size // WORD_SIZE)
+    index = np.arange(len(words))
+    last = num_pages * 0x2000
+    included = (index < 0x3ff8) | (index > 0x3fff)
+    # the original loop read 8K words at once and stopped after the word at
+    # num_pages * 0x2000, but only skipped the rest of that buffer and went on
+    # with the next one. Just one page is summed when that is a whole buffer.
+    if last == BUFFER_WORDS:
+        included &= index < BUFFER_WORDS
+    else:
+        included &= (index <= last) | (index >= (last // BUFFER_WORDS + 1) * BUFFER_WORDS)
+    return int(words[included].sum(dtype=np.uint64)) % 2**16
+
+def crc_file(rom):
+    crcbin = 0
+    for buffer in rom.chunks(0, rom.size or 1):
+        crcbin = crc32(buffer, crcbin)
+    return "%08X" % (crcbin & 0xffffffff)
 
 def main():
     if argv[1:] and exists(argv[1]):
@@ -141,87 +164,156 @@ def bcd_fix(inp):
     
     return (inp >> 4) * 10 + (inp & 0xf) ##+ 1
 
-def read_string(file_name, offset):
+def read_string(rom, offset):
     ''' Reads a null-terminated string from the specified offset'''
     
-    result = []
-    if offset != 0xffff:
-        if offset > file_size(file_name):
-            return '*** Warning! Offset beyond EOF ***'
-          
-        with open(file_name, "rb") as f:
-            f.seek(offset);
-            for c in iter(partial(f.read, 1), ''):
-                result.append(c[0])
-                if c == "\0":
-                    break
-    return "".join(result)
-
-def display_file_info(file_name):
+    if offset == 0xffff:
+        return ""
+    if offset > rom.size:
+        return '*** Warning! Offset beyond EOF ***'
+    end = rom.data.find(b"\0", offset)
+    if end < 0:
+        end = rom.size
+    return rom.data[offset:end].decode("latin1")
+
+def display_file_info(rom):
     tabbed_print("File info")
-    tabbed_print('Filename = %s' % split(file_name)[-1], 1)
-    size = file_size(file_name)
+    tabbed_print('Filename = %s' % split(rom.file_name)[-1], 1)
+    size = rom.size
     tabbed_print('Size = %d bytes (%dKB, %dMbits)' % (size, 
         size // 0x400, size // 0x20000))
-    tabbed_print('CRC32 = %s' % crc_file(file_name))
-    tabbed_print('Fullsum = %04X' % calc_checksum(file_name, 0, file_size(file_name)))
-    age = file_created(file_name)
-    tabbed_print('Date and time = %s' % strftime("%Y-%m-%d %H:%M:%S", gmtime(age)))
+    tabbed_print('CRC32 = %s' % crc_file(rom))
+    tabbed_print('Fullsum = %04X' % calc_checksum(rom, 0, rom.size))
+    tabbed_print('Date and time = %s' % strftime("%Y-%m-%d %H:%M:%S", gmtime(rom.mtime)))
 
 def load_file(file_name, force_patching, auto=False):
-    display_file_info(file_name)
-    display_sdsc_header(file_name)
-    if not (display_sega_header(file_name, HEADER_POSITION, False, force_patching, auto) or
-        display_sega_header(file_name, 0x3ff0, False, force_patching, auto) or
-        display_sega_header(file_name, 0x1ff0, False, force_patching, auto)):
-        display_sega_header(file_name, HEADER_POSITION, True, force_patching, auto)
-    display_codemasters_header(file_name)
-
-def display_sdsc_header(file_name):
-    if file_size(file_name) < HEADER_POSITION:
+    reset_tabs()
+    with Rom(file_name) as rom:
+        display_file_info(rom)
+        display_sdsc_header(rom)
+        if not (display_sega_header(rom, HEADER_POSITION, False, force_patching, auto) or
+            display_sega_header(rom, 0x3ff0, False, force_patching, auto) or
+            display_sega_header(rom, 0x1ff0, False, force_patching, auto)):
+            display_sega_header(rom, HEADER_POSITION, True, force_patching, auto)
+        display_codemasters_header(rom)
+
+def find_sega_header(rom):
+    '''returns offset, raw data and fields of the first Sega header found'''
+
+    for offset in (HEADER_POSITION, 0x3ff0, 0x1ff0):
+        data, header = get_sega_header(rom, offset)
+        if header is not None and header["TMRSEGAChars"] == SEGA_TM.encode("ascii"):
+            return offset, data, header
+    return None, None, None
+
+def analyse_rom(rom):
+    '''collects everything load_file displays as a flat record'''
+
+    record = {"file": rom.file_name, "size": rom.size, "mtime": rom.mtime,
+              "crc32": crc_file(rom), "fullsum": "%04X" % calc_checksum(rom, 0, rom.size)}
+
+    offset, data, header = find_sega_header(rom)
+    record["sega_header_offset"] = offset
+    if header is not None:
+        checksum_calc, num_pages, codies_sega_checksum = sega_checksums(rom, header)
+        if codies_sega_checksum == header["checksum"]:
+            status = "OK (Codemasters mapper)"
+            checksum_calc = codies_sega_checksum
+        else:
+            status = "OK" if checksum_calc == header["checksum"] else "bad"
+        record.update({
+            "sega_checksum": "%04X" % header["checksum"],
+            "sega_checksum_calculated": "%04X" % checksum_calc,
+            "sega_checksum_status": status,
+            "sega_rom_size": "0x%02X" % (header["region_and_cart_size"] & 0xf),
+            "sega_rom_pages": num_pages,
+            "sega_region": "0x%02X" % (header["region_and_cart_size"] >> 4),
+            "sega_region_name": REGIONS.get(header["region_and_cart_size"] >> 4, "Unknown"),
+            "sega_product_number": "%d%04X" % (header["version"] >> 4, header["part_number"]),
+            "sega_version": header["version"] & 0xf,
+            "sega_reserved": "%04X" % header["unknown_value"]})
+
+    header = get_sdsc_header(rom)
+    if header is not None:
+        record.update({
+            "sdsc_title": header["title"],
+            "sdsc_author": header["author"],
+            "sdsc_program_version": header["program_version"],
+            "sdsc_release_date": header["release_date"].strftime("%Y-%m-%d") if header["release_date"] else None,
+            "sdsc_release_notes": header["release_notes"]})
+
+    header = get_codemasters_header(rom)
+    timestamp = codemasters_timestamp(header)
+    if timestamp is not None:
+        calculated = calc_codies_checksum(rom, header["num_pages"])
+        record.update({
+            "codemasters_date": timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+            "codemasters_checksum": "%04X" % header["checksum"],
+            "codemasters_checksum_calculated": "%04X" % calculated,
+            "codemasters_checksum_status": "OK" if header["checksum"] == calculated else "bad",
+            "codemasters_pages": header["num_pages"]})
+    return record
+
+def get_sdsc_header(rom):
+    '''returns the SDSC header including the referenced strings or None'''
+
+    if rom.size < HEADER_POSITION:
         return
         
     header = {}    
-    HEADER_SIZE = 4 + 4 + 4 * 2
-    with open(file_name, "rb") as f:
-        f.seek(0x7fe0)
-        data = f.read(HEADER_SIZE)
     (header["SDSCChars"], header["MajorVersion"], header["MinorVersion"], header["day"], 
         header["month"], header["year"], header["AuthorOffset"], header["TitleOffset"], 
-        header["ReleaseNotesOffset"]) = unpack("4s4B4H", data)
-  
-    if header["SDSCChars"] == 'SDSC':
-        if header["TitleOffset"] != 0xffff:
-            title = read_string(file_name, header["TitleOffset"])
-        release_notes = ""
-        if header["ReleaseNotesOffset"] != 0xffff:
-            release_notes = read_string(file_name, header["ReleaseNotesOffset"])
-        author = ""
-        if header["AuthorOffset"] not in (0xffff, 0x0000): 
-            author = read_string(file_name, header["AuthorOffset"])
-
-        tabbed_print('SDSC header')
-        if header["TitleOffset"] != 0xffff:
-            tabbed_print('Title = %s' % title)
-
-        if header['AuthorOffset'] not in (0xffff, 0x0000):
-            tabbed_print('Author = %s' % author)
-
-        tabbed_print('Program version = %d.%.2d' % (bcd_fix(header["MajorVersion"]), bcd_fix(header["MinorVersion"])))
-        timestamp = datetime(bcd_fix(header["year"] >> 8) * 100 + bcd_fix(header["year"] & 0xff), 
-                    bcd_fix(header["month"]), bcd_fix(header["day"]))
-        tabbed_print('Release date = %s' % timestamp.strftime("%Y-%m-%d"))
-
-        if header["ReleaseNotesOffset"] != 0xffff:
-            tabbed_print('Release notes (see below)')  
-            tabbed_print(release_notes)
-
-def tabbed_print(string, indent=0, memory=[0]):
+        header["ReleaseNotesOffset"]) = rom.unpack("4s4B4H", 0x7fe0)
+    if header["SDSCChars"] != b'SDSC':
+        return
+
+    header["title"] = read_string(rom, header["TitleOffset"])
+    header["release_notes"] = read_string(rom, header["ReleaseNotesOffset"])
+    header["author"] = ""
+    if header["AuthorOffset"] not in (0xffff, 0x0000): 
+        header["author"] = read_string(rom, header["AuthorOffset"])
+    header["program_version"] = '%d.%.2d' % (bcd_fix(header["MajorVersion"]), bcd_fix(header["MinorVersion"]))
+    try:
+        header["release_date"] = datetime(bcd_fix(header["year"] >> 8) * 100 + bcd_fix(header["year"] & 0xff), 
+            bcd_fix(header["month"]), bcd_fix(header["day"]))
+    except ValueError:
+        header["release_date"] = None
+    return header
+
+def display_sdsc_header(rom):
+    header = get_sdsc_header(rom)
+    if header is None:
+        return
+
+    tabbed_print('SDSC header')
+    if header["TitleOffset"] != 0xffff:
+        tabbed_print('Title = %s' % header["title"])
+
+    if header['AuthorOffset'] not in (0xffff, 0x0000):
+        tabbed_print('Author = %s' % header["author"])
+
+    tabbed_print('Program version = %s' % header["program_version"])
+    if header["release_date"] is not None:
+        tabbed_print('Release date = %s' % header["release_date"].strftime("%Y-%m-%d"))
+
+    if header["ReleaseNotesOffset"] != 0xffff:
+        tabbed_print('Release notes (see below)')  
+        tabbed_print(header["release_notes"])
+
+# current indentation of tabbed_print
+_tab_level = 0
+
+def tabbed_print(string, indent=0):
     '''helper function which print out strings with leading tabs'''
-    memory[0] += indent
-    print(memory[0]*"\t", string, sep="")
+    global _tab_level
+    _tab_level += indent
+    print(_tab_level*"\t", string, sep="")
 
-def compute_checksum(file_name, card_size):
+def reset_tabs():
+    global _tab_level
+    _tab_level = 0
+
+def compute_checksum(rom, card_size):
     '''computes checksum from given file name and card size type'''
     QUARTERMBIT, HALFMBIT, MBIT, TWOMBIT, FOURMBIT, EIGHTMBIT = 0xc, 0xe, 0xf, 0x0, 0x1, 0x2
     
@@ -229,50 +321,63 @@ def compute_checksum(file_name, card_size):
     checksum_calc = -1
     if card_size == 0xa: 
         #8kb unused
-        checksum_calc = calc_checksum(file_name, 0, 0x1FEF)
+        checksum_calc = calc_checksum(rom, 0, 0x1FEF)
     elif card_size == 0xb: 
         #16kb unused
-        checksum_calc = calc_checksum(file_name, 0, 0x3FEF)
+        checksum_calc = calc_checksum(rom, 0, 0x3FEF)
     elif card_size == QUARTERMBIT: 
-        checksum_calc = calc_checksum(file_name, 0, HEADER_POSITION - 1) 
+        checksum_calc = calc_checksum(rom, 0, HEADER_POSITION - 1) 
     elif card_size == 0xd: 
         #48kb unused and broken because header is part of checksum rom range
-        checksum_calc = calc_checksum(file_name, 0, 0xbfef) 
+        checksum_calc = calc_checksum(rom, 0, 0xbfef) 
     elif card_size == HALFMBIT: 
-        checksum_calc = calc_checksum(file_name, 0x8000, 0xffff, calc_checksum(file_name, 0, HEADER_POSITION - 1)) 
+        checksum_calc = calc_checksum(rom, 0x8000, 0xffff, calc_checksum(rom, 0, HEADER_POSITION - 1)) 
     elif card_size == MBIT: 
-        checksum_calc = calc_checksum(file_name, 0x8000, 0x1ffff, calc_checksum(file_name, 0, HEADER_POSITION - 1)) 
+        checksum_calc = calc_checksum(rom, 0x8000, 0x1ffff, calc_checksum(rom, 0, HEADER_POSITION - 1)) 
     elif card_size == TWOMBIT: 
-        checksum_calc = calc_checksum(file_name, 0x8000, 0x3ffff, calc_checksum(file_name, 0, HEADER_POSITION - 1))
+        checksum_calc = calc_checksum(rom, 0x8000, 0x3ffff, calc_checksum(rom, 0, HEADER_POSITION - 1))
     elif card_size == FOURMBIT: 
-        checksum_calc = calc_checksum(file_name, 0x8000, 0x7ffff, calc_checksum(file_name, 0, HEADER_POSITION - 1))
+        checksum_calc = calc_checksum(rom, 0x8000, 0x7ffff, calc_checksum(rom, 0, HEADER_POSITION - 1))
     elif card_size == EIGHTMBIT: 
-        checksum_calc = calc_checksum(file_name, 0x8000, 0xfffff, calc_checksum(file_name, 0, HEADER_POSITION - 1))
+        checksum_calc = calc_checksum(rom, 0x8000, 0xfffff, calc_checksum(rom, 0, HEADER_POSITION - 1))
       
     return checksum_calc, num_pages.get(card_size, -1)
 
-def get_sega_header(file_name, offset):
-    if file_size(file_name) < offset + 16:
-        return
+def get_sega_header(rom, offset):
+    HEADER_SIZE = 8 + 3 * 2  + 2
+    if rom.size < offset + HEADER_SIZE:
+        return None, None
         
     header = {}
-    HEADER_SIZE = 8 + 3 * 2  + 2
-    data = ""
-    with open(file_name, "rb") as f:
-        f.seek(offset)
-        data = f.read(HEADER_SIZE)
+    data = rom.data[offset:offset + HEADER_SIZE]
     (header["TMRSEGAChars"], header["unknown_value"], header["checksum"], header["part_number"],
         header["version"], header["region_and_cart_size"]) = unpack("<8s3H2B", data)
     return data, header
 
-def display_sega_header(file_name, offset, force, force_patching, auto):
+def sega_checksums(rom, header):
+    '''returns the calculated checksum, the number of pages and the checksum
+    for the Codemasters mapper (-1 if not needed) of a Sega header'''
+
+    checksum_calc, num_pages = compute_checksum(rom, header["region_and_cart_size"] & 0xF)
+    
+    # try Codemasters paging checksum if that failed
+    if checksum_calc != header["checksum"] and num_pages > 1: # it'd pass anyway if NumPages was 0,1,2
+        codies_sega_checksum = calc_checksum(rom, 0x4000, 0x7FEF, 
+            calc_checksum(rom, 0, 0x3FFF, 0) * (num_pages - 1))
+    else:
+        codies_sega_checksum = -1
+    return checksum_calc, num_pages, codies_sega_checksum
+
+def display_sega_header(rom, offset, force, force_patching, auto):
     MASTER_SYSTEM_REGIONS = (0x3, 0x4)
-    data, header = get_sega_header(file_name, offset)
-    if header["TMRSEGAChars"] == SEGA_TM or force:
+    data, header = get_sega_header(rom, offset)
+    if header is None:
+        return False
+    if header["TMRSEGAChars"] == SEGA_TM.encode("ascii") or force:
         tabbed_print('Sega header', -1) 
 
-        tabbed_print('Full header (ASCII) = %s' % "".join(["%c" % byte(x) if 32 <= byte(x) <= 255 else "." for x in data]), 1)
-        tabbed_print('Full header (hex) = %s' % "".join(" %02X" % byte(i) for i in data))
+        tabbed_print('Full header (ASCII) = %s' % "".join(["%c" % x if 32 <= x <= 255 else "." for x in data]), 1)
+        tabbed_print('Full header (hex) = %s' % "".join(" %02X" % i for i in data))
         tabbed_print('Checksum') 
         
         patch_suggestion = False
@@ -281,14 +386,7 @@ def display_sega_header(file_name, offset, force, force_patching, auto):
             patch_suggestion = True
             
         tabbed_print('From header = 0x%04X' % header["checksum"], 1) 
-        checksum_calc, num_pages = compute_checksum(file_name, header["region_and_cart_size"] & 0xF)
-        
-        # try Codemasters paging checksum if that failed
-        if checksum_calc != header["checksum"] and num_pages > 1: # it'd pass anyway if NumPages was 0,1,2
-            codies_sega_checksum = calc_checksum(file_name, 0x4000, 0x7FEF, 
-                calc_checksum(file_name, 0, 0x3FFF, 0) * (num_pages - 1))
-        else:
-            codies_sega_checksum = -1
+        checksum_calc, num_pages, codies_sega_checksum = sega_checksums(rom, header)
 
         if codies_sega_checksum != header["checksum"]:
             if header["checksum"] == checksum_calc:
@@ -392,11 +490,11 @@ def display_sega_header(file_name, offset, force, force_patching, auto):
                 # if input is empty take old values
                 if not signature:
                     signature = pack("<hB", header["part_number"], header["version"])
-                patch_header(file_name, signature)
+                patch_header(rom, signature)
         return True
     return False
 
-def patch_header(file_name, signature="<D>", region=4):
+def patch_header(rom, signature="<D>", region=4):
     '''
         patch the header to pass the region check in consoles outside japan
     
@@ -418,49 +516,51 @@ def patch_header(file_name, signature="<D>", region=4):
     # prevent buggy 48kb rom size
     rom_size = {MBIT//4: 0xc, 48*1024: 0xd - 1, MBIT//2: 0xe, 
                 MBIT: 0xf, 2*MBIT: 0x0, 4*MBIT: 0x1, 8*MBIT: 0x2}
-    card_size = rom_size[file_size(file_name)]
-    checksum = compute_checksum(file_name, card_size)[0]
+    card_size = rom_size[rom.size]
+    checksum = compute_checksum(rom, card_size)[0]
     spaces, trademark = "  ", SEGA_TM
-    with open(file_name, "r+b") as rom_file:
+    # the read-only mapping sees the patched bytes, the file size doesn't change
+    with open(rom.file_name, "r+b") as rom_file:
         rom_file.seek(HEADER_POSITION)
-        if version > 2:
-            trademark = bytes(trademark, "utf-8")
-            signature = ("%s   " % signature).encode("latin1")[:3]
-            spaces = bytes(spaces, "utf-8")
+        trademark = bytes(trademark, "utf-8")
+        signature = ("%s   " % signature).encode("latin1")[:3]
+        spaces = bytes(spaces, "utf-8")
         header = pack("8s2s2s3sb", trademark, spaces, pack("<H", checksum), signature, region<<4|card_size)
         rom_file.write(header)
 
-def get_codemasters_header(file_name):
-    if file_size(file_name) < HEADER_POSITION:
+def get_codemasters_header(rom):
+    if rom.size < HEADER_POSITION:
         return
     
-    HEADER_SIZE = 1 + 1 + 1 + 1 + 1 + 1 + 2 + 2 + 6
     header = {}
-    data = ""
-    with open(file_name, "rb") as f:
-        f.seek(0x7fe0)
-        data = f.read(HEADER_SIZE)
     (header["num_pages"], header["day"], header["month"],header["year"], header["hour"], header["minute"], 
-        header["checksum"], header["inverse_checksum"], header["reserved"])  = unpack("<6B2H6s", data)
+        header["checksum"], header["inverse_checksum"], header["reserved"])  = rom.unpack("<6B2H6s", 0x7fe0)
     return header
         
-def display_codemasters_header(file_name):
-    header = get_codemasters_header(file_name)
+def codemasters_timestamp(header):
+    '''returns the build time of a likely Codemasters header, otherwise None'''
+
     WORD_SIZE = 16
     # check it seems to be a likely header
     # I could do more checks...
     # 0 = -0 so blank areas pass this check; they tend to fail the date encode, though.
-    if header["inverse_checksum"] == -header["checksum"] % (2**WORD_SIZE):
-        try:
-            timestamp = datetime(bcd_fix(header["year"]) + 1900, bcd_fix(header["month"]), bcd_fix(header["day"]), 
-                 bcd_fix(header["hour"]), bcd_fix(header["minute"]), 0, 0)
-        except ValueError:
-            return
+    if header is None or header["inverse_checksum"] != -header["checksum"] % (2**WORD_SIZE):
+        return
+    try:
+        return datetime(bcd_fix(header["year"]) + 1900, bcd_fix(header["month"]), bcd_fix(header["day"]), 
+             bcd_fix(header["hour"]), bcd_fix(header["minute"]), 0, 0)
+    except ValueError:
+        return
+
+def display_codemasters_header(rom):
+    header = get_codemasters_header(rom)
+    timestamp = codemasters_timestamp(header)
+    if timestamp is not None:
         tabbed_print('Codemasters header', -1)
         tabbed_print('Date and time = %s' % timestamp.strftime("%Y-%m-%d %H:%M:%S"), 1)
         tabbed_print('Checksum')
         tabbed_print('From header = 0x%04X' % header["checksum"], 1)
-        calculated = calc_codies_checksum(file_name, header["num_pages"])
+        calculated = calc_codies_checksum(rom, header["num_pages"])
         state = "OK" if header["checksum"] == calculated else "bad!"
         tabbed_print("Calculated = 0x%04X (%s)" % (calculated, state))
         tabbed_print('Rom size = %d pages (%d KB)' % (header["num_pages"], header["num_pages"] * 16))
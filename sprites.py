@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''sprite sheets: frames of 8x16 sprites sharing their tiles
+
+ usage: sprites.py [--platform sms|gg] --sprites W,H [converter flags] sheet [sheet ..]
+        gfx2sms.py sheet --sprites W,H [converter flags]
+
+ The sheet is converted like a screen (palette, dithering), then cut
+ into frames of W x H pixels, left to right and top to bottom. Every
+ frame is cut into 8x16 sprites (the VDP in 8x16 sprite mode shows the
+ tile pair n, n + 1 for an even n). Palette entry 0 is transparent, it
+ is the color of the top left pixel of the sheet. Sprites without any
+ other color are left out. Sprites are compared over
+ all frames, every distinct one is stored once, so the tile data grows
+ with the distinct content and not with the number of frames.
+
+ sheet.bin  the tile pairs, top tile first
+ sheet.pal  the palette
+ sheet.spr  a little endian word for every frame with the offset of its
+            sprite list, the lists follow: the number of sprites, then
+            y, x and tile number of every sprite (one byte each)'''
+
+import sys
+from os import path
+from collections import namedtuple
+from struct import pack
+
+import numpy as np
+from PIL import Image
+
+import cache
+import gfxengine
+from metrics import Metrics
+import profiles
+import tiles
+
+SPRITE_WIDTH = 8
+SPRITE_HEIGHT = 16
+
+# tile numbers, positions and sprite counts in the sprite table are a byte
+MAX_SPRITE_TILES = 256
+MAX_FRAME_SIZE = 256
+MAX_FRAME_SPRITES = 255
+
+# palette bytes, tile pairs, frame table, frames, sprites and distinct sprites
+SpriteSheet = namedtuple("SpriteSheet", "palette tiles table frames sprites unique")
+
+
+def slice_frames(indexed, frame_width, frame_height):
+    '''cuts the (height, width) index array into (frames, frame_height,
+    frame_width) in row-major order, incomplete frames are dropped'''
+
+    rows, columns = len(indexed) // frame_height, indexed.shape[1] // frame_width
+    frames = indexed[:rows * frame_height, :columns * frame_width]
+    frames = frames.reshape(rows, frame_height, columns, frame_width).swapaxes(1, 2)
+    return frames.reshape(-1, frame_height, frame_width)
+
+def split_sprites(frame):
+    '''cuts a frame into (sprites, 16, 8) in row-major order with their y and x'''
+
+    rows, columns = len(frame) // SPRITE_HEIGHT, frame.shape[1] // SPRITE_WIDTH
+    sprites = frame.reshape(rows, SPRITE_HEIGHT, columns, SPRITE_WIDTH).swapaxes(1, 2)
+    ys, xs = np.mgrid[0:rows * SPRITE_HEIGHT:SPRITE_HEIGHT, 0:columns * SPRITE_WIDTH:SPRITE_WIDTH]
+    return sprites.reshape(-1, SPRITE_HEIGHT, SPRITE_WIDTH), ys.ravel(), xs.ravel()
+
+def build_sprites(frames):
+    '''finds the distinct sprites of all frames, returns them as (sprites, 16, 8)
+    and the sprite list of every frame as (y, x, sprite number) tuples'''
+
+    parts = [split_sprites(frame) for frame in frames]
+    if not parts:
+        return np.zeros((0, SPRITE_HEIGHT, SPRITE_WIDTH), dtype=np.uint8), []
+    sprites = np.concatenate([part[0] for part in parts]).astype(np.uint8)
+    keys = np.ascontiguousarray(sprites.reshape(len(sprites), -1))
+    visible = keys.any(axis=1)
+    # one hash index over all frames: equal sprites end up in the same group
+    _, first, groups = np.unique(keys.view(np.dtype((np.void, keys.shape[1]))).ravel(),
+                                 return_index=True, return_inverse=True)
+    groups = groups.reshape(-1)
+    # the visible groups are numbered in the order they appear
+    seen = groups[visible]
+    _, positions = np.unique(seen, return_index=True)
+    ordered = seen[np.sort(positions)]
+    numbers = np.zeros(len(first), dtype=np.int64)
+    numbers[ordered] = np.arange(len(ordered))
+
+    lists, offset = [], 0
+    for frame_sprites, ys, xs in parts:
+        picked = np.flatnonzero(visible[offset:offset + len(frame_sprites)])
+        lists.append(list(zip(ys[picked].tolist(), xs[picked].tolist(),
+                              numbers[groups[offset + picked]].tolist())))
+        offset += len(frame_sprites)
+    return sprites[first[ordered]], lists
+
+def encode_table(lists):
+    '''the frame table of the .spr file, see the module description'''
+
+    body = b""
+    offsets = []
+    for entries in lists:
+        offsets.append(2 * len(lists) + len(body))
+        body += pack("B", len(entries))
+        body += b"".join(pack("BBB", y, x, 2 * number) for y, x, number in entries)
+    return pack("<%dH" % len(offsets), *offsets) + body
+
+def convert_sheet(img, profile="sms", frame_size=None, dithering=None, grayscale=False, optimize=False,
+                  verbose=False, metrics=None):
+    '''converts an opened sprite sheet, returns a SpriteSheet or None if it can't be converted.
+    frame_size is (width, height) of a frame, the whole sheet if None.'''
+
+    profile = gfxengine.get_profile(profile)
+    metrics = metrics or Metrics()
+    if profile.color_table:
+        print("sprites aren't supported for %s" % profile.name)
+        return
+    frame_width, frame_height = frame_size or img.size
+    if frame_width % SPRITE_WIDTH or frame_height % SPRITE_HEIGHT:
+        print("frame size isn't a multiple of %dx%d" % (SPRITE_WIDTH, SPRITE_HEIGHT))
+        return
+    if frame_width > MAX_FRAME_SIZE or frame_height > MAX_FRAME_SIZE:
+        print("frame size is larger than %dx%d" % (MAX_FRAME_SIZE, MAX_FRAME_SIZE))
+        return
+
+    # a sheet may be larger than the screen
+    sheet_profile = profile._replace(max_x=max(profile.max_x, img.width), max_y=max(profile.max_y, img.height))
+    with metrics.stage("prepare"):
+        img = gfxengine.prepare(img, sheet_profile, grayscale, None, optimize, verbose)
+    if img is None:
+        return
+    with metrics.stage("palette"):
+        colors, matched, used = gfxengine.build_palette(img, profile, optimize, metrics)
+        # the background goes to the transparent entry 0
+        background = matched[colors.index(img.getpixel((0, 0)))]
+        used = [background] + [color for color in used if color != background]
+    metrics.count("source_colors", len(colors))
+    metrics.count("palette_colors", len(used))
+    gfxengine.log(verbose, f"colors(#{len(used)}): {used}")
+    palette = gfxengine.encode_palette(used, profile)
+    dithering = profile.dither if dithering is None else dithering
+    rows = list(gfxengine.iter_tile_rows(img, profile, colors, matched, used, dithering, metrics=metrics))
+    if not rows:
+        return
+    indexed = np.concatenate(rows)
+
+    with metrics.stage("sprites"):
+        frames = slice_frames(indexed, frame_width, frame_height)
+        unique, lists = build_sprites(frames)
+    if 2 * len(unique) > MAX_SPRITE_TILES:
+        print("too many sprites for the sprite table (%d, at most %d)" % (len(unique), MAX_SPRITE_TILES // 2))
+        return
+    if max((len(entries) for entries in lists), default=0) > MAX_FRAME_SPRITES:
+        print("too many sprites in a frame (at most %d)" % MAX_FRAME_SPRITES)
+        return
+    # the frame offsets are words
+    if 2 * len(lists) + sum(1 + 3 * len(entries) for entries in lists[:-1]) > 0xffff:
+        print("sprite table is larger than 64K")
+        return
+    with metrics.stage("encode"):
+        data = tiles.encode_tiles(unique.reshape(-1, tiles.TILE_HEIGHT, tiles.TILE_WIDTH), profile.bpp)
+        table = encode_table(lists)
+    sprites = sum(len(entries) for entries in lists)
+    metrics.count("frames", len(frames))
+    metrics.count("sprites", sprites)
+    metrics.count("unique_sprites", len(unique))
+    return SpriteSheet(palette, data, table, len(frames), sprites, len(unique))
+
+def convert_file(file_name, profile="sms", output_base=None, frame_size=None, use_cache=True, verbose=False,
+                 dithering=None, grayscale=False, optimize=False, quiet=False, metrics=None, stats=None):
+    '''converts a sprite sheet and writes <output_base>.pal/.bin/.spr,
+    returns the written file names or None if it can't be converted'''
+
+    profile = gfxengine.get_profile(profile)
+    if output_base is None:
+        output_base = path.splitext(file_name)[0]
+    outputs = {".pal": output_base + ".pal", ".bin": output_base + ".bin", ".spr": output_base + ".spr"}
+    options = {"dithering": dithering, "grayscale": grayscale, "optimize": optimize, "sprites": frame_size}
+    metrics = metrics or Metrics(file_name, profile.name)
+    verbose = verbose and not quiet
+
+    try:
+        gfxengine.log(verbose, f"open {file_name}..")
+        with Image.open(file_name) as img:
+            key = None
+            if use_cache:
+                with metrics.stage("cache"):
+                    key = cache.cache_key(img, profile.name, gfxengine.__version__, options)
+                    hit = cache.fetch(key, outputs)
+                metrics.count("cache_hits" if hit else "cache_misses")
+                if hit:
+                    gfxengine.log(verbose, "unchanged, using cached result..")
+                    return outputs
+            sheet = convert_sheet(img, profile, frame_size, dithering, grayscale, optimize, verbose, metrics)
+        if sheet is None:
+            metrics.count("failed")
+            return
+        gfxengine.log(verbose, f"{sheet.unique} distinct sprites out of {sheet.sprites} in {sheet.frames} frames")
+        with metrics.stage("write"):
+            for extension, data in ((".pal", sheet.palette), (".bin", sheet.tiles), (".spr", sheet.table)):
+                with open(outputs[extension], "wb") as writer:
+                    writer.write(data)
+                metrics.count("bytes_written", len(data))
+        if key:
+            with metrics.stage("cache"):
+                cache.store(key, outputs)
+        return outputs
+    finally:
+        metrics.finish(stats)
+
+def main():
+    args = sys.argv[1:]
+    platform, flags, files = "sms", [], []
+    while args:
+        arg = args.pop(0)
+        if arg == "--platform" and args:
+            platform = args.pop(0).lower()
+        elif arg in ("--sprites", "--stats") and args:
+            flags.extend((arg, args.pop(0)))
+        elif arg == "--dither" and args and args[0].lower() in profiles.DITHER_MODES:
+            flags.extend((arg, args.pop(0)))
+        elif arg.startswith("-"):
+            flags.append(arg)
+        else:
+            files.append(arg)
+
+    if platform not in profiles.PROFILES:
+        print("unknown platform %s" % platform)
+        return
+    if not files:
+        print("not enough arguments")
+        return
+    options = profiles.parse_options(flags)
+    if options is None:
+        return
+    for file_name in files:
+        if not path.exists(file_name):
+            print("file %s doesn't exist" % file_name)
+            continue
+        outputs = convert_file(file_name, platform, frame_size=options["sprites"], use_cache=options["use_cache"],
+                               dithering=options["dithering"], grayscale=options["grayscale"],
+                               optimize=options["optimize"], quiet=options["quiet"], stats=options["stats"])
+        if outputs and not options["quiet"]:
+            print(" ".join(sorted(outputs.values())))
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,8 @@
 #!/usr/bin/env python3
-from sys import argv
-path = argv[1] if len(argv) > 1 else r"C:\programmieren\master system\helloworld\gfx\font.fnt"
-with open(path, "rb") as f:
-    for index, value in enumerate(f.read(), 1):
-        for n in range(8):
-            print("x" if ord(value) & (1 << n) else ".", end="")
-        print()
-        if index % 8 == 0:
-            print()
\ No newline at end of file
+
+'''tile_view.py with the SMS (4bpp) as default platform'''
+
+import tile_view
+
+if __name__ == '__main__':
+    tile_view.main("sms")
@@ -1,10 +1,136 @@
 #!/usr/bin/env python
-from sys import argv
-path = argv[1] if len(argv) > 1 else r"C:\programmieren\master system\helloworld\gfx\font.fnt"
-with open(path, "rb") as f:
-    for index, value in enumerate(f.read(), 1):
-        for n in range(8):
-            print("x" if ord(value) & (1 << n) else ".", end="")
-        print()
-        if index % 8 == 0:
-            print()
\ No newline at end of file
+# coding: utf-8
+
+'''renders planar tile data
+
+ usage: tile_view.py file.bin [--platform sms|gg|sg] [--bpp N] [--pal FILE] [--col FILE]
+                     [--columns N] [--png FILE] [--scale N] [--ascii]
+
+ The tiles are decoded with numpy and arranged in rows of --columns
+ tiles. The palette (and for the SG the color table) is taken from the
+ .pal/.col next to the .bin unless given, without one the indices are
+ shown as gray levels. --png writes the tile sheet, otherwise a preview
+ is printed to the terminal with two pixels per character in true color
+ (or as characters of different density with --ascii).'''
+
+import sys
+from os import path
+
+import numpy as np
+
+import tiles
+
+# darkest to brightest
+ASCII_RAMP = " .:-=+*#%@"
+
+
+def gray_palette(bpp):
+    levels = np.linspace(0, 255, 1 << bpp).astype(np.uint8)
+    return np.stack([levels] * 3, axis=1)
+
+def render(data, bpp, palette=None, columns=16, color_table=None):
+    '''decodes planar tile data into a (height, width, 3) rgb tile sheet.
+    palette is a list of rgb colors for the indices, color_table the
+    foreground/background byte of every tile row for 1bpp patterns
+    (in that case palette holds the hardware colors).'''
+
+    indices = tiles.decode_tiles(data, bpp)
+    if color_table is not None:
+        colors = np.frombuffer(bytes(color_table), dtype=np.uint8)[:indices.size // tiles.TILE_WIDTH]
+        colors = np.resize(colors, indices.size // tiles.TILE_WIDTH).reshape(indices.shape[:2] + (1,))
+        indices = np.where(indices, colors >> 4, colors & 0xf)
+    palette = gray_palette(bpp) if palette is None else np.asarray(palette, dtype=np.uint8).reshape(-1, 3)
+    # indices without palette entry are black
+    palette = np.concatenate([palette, np.zeros((max(0, int(indices.max(initial=0)) + 1 - len(palette)), 3),
+                                                dtype=np.uint8)])
+    return palette[tiles.join_tiles(indices, columns)]
+
+def preview(sheet, ascii=False):
+    '''terminal lines showing the rgb sheet, two pixel rows per line'''
+
+    sheet = np.asarray(sheet, dtype=np.int64)
+    if len(sheet) % 2:
+        sheet = np.concatenate([sheet, np.zeros((1,) + sheet.shape[1:], dtype=sheet.dtype)])
+    upper, lower = sheet[0::2], sheet[1::2]
+    lines = []
+    if ascii:
+        luma = (upper + lower) @ np.array([0.2126, 0.7152, 0.0722]) / 2
+        ramp = np.array(list(ASCII_RAMP))
+        for row in ramp[np.minimum((luma * len(ASCII_RAMP) / 256).astype(np.int64), len(ASCII_RAMP) - 1)]:
+            lines.append("".join(row))
+        return lines
+    for top, bottom in zip(upper.tolist(), lower.tolist()):
+        lines.append("".join("\x1b[38;2;%d;%d;%dm\x1b[48;2;%d;%d;%dm▀" % (tuple(fg) + tuple(bg))
+                             for fg, bg in zip(top, bottom)) + "\x1b[0m")
+    return lines
+
+def read_file(file_name):
+    with open(file_name, "rb") as reader:
+        return reader.read()
+
+def main(platform="sg"):
+    import profiles
+
+    args = sys.argv[1:]
+    bpp = pal_file = col_file = png_file = None
+    columns, scale, ascii, files = 16, 1, False, []
+    while args:
+        arg = args.pop(0)
+        if arg == "--platform" and args:
+            platform = args.pop(0).lower()
+        elif arg == "--bpp" and args:
+            bpp = int(args.pop(0))
+        elif arg == "--pal" and args:
+            pal_file = args.pop(0)
+        elif arg == "--col" and args:
+            col_file = args.pop(0)
+        elif arg == "--columns" and args:
+            columns = int(args.pop(0))
+        elif arg == "--png" and args:
+            png_file = args.pop(0)
+        elif arg == "--scale" and args:
+            scale = int(args.pop(0))
+        elif arg == "--ascii":
+            ascii = True
+        else:
+            files.append(arg)
+
+    if platform not in profiles.PROFILES:
+        print("unknown platform %s" % platform)
+        return
+    if not files:
+        print("not enough arguments")
+        return
+    if not path.exists(files[0]):
+        print("file %s doesn't exist" % (files[0]))
+        return
+
+    profile = profiles.PROFILES[platform]
+    bpp = bpp or profile.bpp
+    base = path.splitext(files[0])[0]
+    pal_file = pal_file or (base + ".pal" if path.exists(base + ".pal") else None)
+    col_file = col_file or (base + ".col" if bpp == 1 and path.exists(base + ".col") else None)
+
+    palette = color_table = None
+    if col_file:
+        # the color table selects hardware colors directly
+        palette, color_table = profile.palette, read_file(col_file)
+    elif pal_file:
+        import gfxengine
+
+        palette = gfxengine.decode_palette(read_file(pal_file), profile)
+    sheet = render(read_file(files[0]), bpp, palette, columns, color_table)
+
+    if png_file:
+        from PIL import Image
+
+        image = Image.fromarray(sheet)
+        if scale > 1:
+            image = image.resize((image.width * scale, image.height * scale), Image.NEAREST)
+        image.save(png_file)
+        print("%s: %d tiles, %dx%d" % (png_file, len(read_file(files[0])) // (8 * bpp), image.width, image.height))
+    else:
+        print("\n".join(preview(sheet, ascii)))
+
+if __name__ == '__main__':
+    main()
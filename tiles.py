@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''planar tile encoder shared by the converters
+
+ A tile is 8x8 pixels, every row is stored as one byte per bitplane with
+ the leftmost pixel in the most significant bit. The SMS and GG use 4
+ bitplanes (16 colors), the SG-1000 a single one.'''
+
+import numpy as np
+
+TILE_WIDTH = 8
+TILE_HEIGHT = 8
+
+# name table entry: tile index (9 bits), flip, palette and priority flags
+TILE_INDEX_MASK = 0x1ff
+FLIP_H = 1 << 9
+FLIP_V = 1 << 10
+PALETTE_SELECT = 1 << 11
+PRIORITY = 1 << 12
+
+# pattern slots left next to the name table and the sprite attribute table
+VRAM_TILES = 448
+
+
+def pack_rgb(pixels):
+    '''packs an (..., 3) rgb array into 24 bit integers'''
+
+    pixels = np.asarray(pixels, dtype=np.int32)
+    return (pixels[..., 0] << 16) | (pixels[..., 1] << 8) | pixels[..., 2]
+
+def index_image(pixels, color_index):
+    '''translates an (height, width, 3) rgb array into palette indices
+    using the mapping rgb tuple -> index'''
+
+    keys = np.array([(r << 16) | (g << 8) | b for r, g, b in color_index], dtype=np.int32)
+    values = np.array(list(color_index.values()), dtype=np.int32)
+    order = np.argsort(keys)
+    keys, values = keys[order], values[order]
+    packed = pack_rgb(pixels)
+    positions = np.searchsorted(keys, packed)
+    if (positions >= len(keys)).any() or (keys[np.minimum(positions, len(keys) - 1)] != packed).any():
+        raise KeyError("image contains colors without palette index")
+    return values[positions]
+
+def split_tiles(indexed):
+    '''cuts the (height, width) index array into (tiles, 8, 8) in row-major
+    tile order, incomplete tiles at the right and bottom edge are dropped'''
+
+    indexed = np.asarray(indexed)
+    rows, columns = indexed.shape[0] // TILE_HEIGHT, indexed.shape[1] // TILE_WIDTH
+    indexed = indexed[:rows * TILE_HEIGHT, :columns * TILE_WIDTH]
+    tiles = indexed.reshape(rows, TILE_HEIGHT, columns, TILE_WIDTH).swapaxes(1, 2)
+    return tiles.reshape(-1, TILE_HEIGHT, TILE_WIDTH)
+
+def encode_tiles(tiles, bpp):
+    '''encodes (tiles, 8, 8) palette indices to planar data,
+    for every tile row the bitplanes follow each other'''
+
+    tiles = np.asarray(tiles)
+    planes = [np.packbits((tiles >> plane) & 1, axis=-1, bitorder="big") for plane in range(bpp)]
+    return np.concatenate(planes, axis=-1).tobytes()
+
+def decode_tiles(data, bpp):
+    '''decodes planar tile data to (tiles, 8, 8) palette indices, the reverse
+    of encode_tiles. Trailing bytes of an incomplete tile are ignored.'''
+
+    data = np.frombuffer(bytes(data), dtype=np.uint8)
+    count = len(data) // (TILE_HEIGHT * bpp)
+    planes = data[:count * TILE_HEIGHT * bpp].reshape(count, TILE_HEIGHT, bpp, 1)
+    bits = np.unpackbits(planes, axis=-1, bitorder="big")
+    weights = (1 << np.arange(bpp, dtype=np.uint8)).reshape(1, 1, bpp, 1)
+    return (bits * weights).sum(axis=2, dtype=np.uint8)
+
+def join_tiles(tiles, columns):
+    '''arranges (tiles, 8, 8) in rows of columns tiles, the reverse of
+    split_tiles. A missing tile in the last row stays 0.'''
+
+    tiles = np.asarray(tiles)
+    rows = -(-len(tiles) // columns)
+    sheet = np.zeros((rows * columns,) + tiles.shape[1:], dtype=tiles.dtype)
+    sheet[:len(tiles)] = tiles
+    sheet = sheet.reshape((rows, columns) + tiles.shape[1:]).swapaxes(1, 2)
+    return sheet.reshape((rows * TILE_HEIGHT, columns * TILE_WIDTH) + tiles.shape[3:])
+
+def encode_image(indexed, bpp):
+    '''encodes the whole (height, width) index array to planar tile data'''
+
+    return encode_tiles(split_tiles(indexed), bpp)
+
+def dedupe_tiles(tiles, bpp, known=None):
+    '''removes repeated tiles, also those which are only a flipped copy of
+    another tile. Returns the unique tiles and the name table entries
+    (tile index plus flip bits) in the order of the input tiles.
+
+    known maps the tiles of earlier calls to their index, passing the same
+    dict again continues the tile numbering (used when streaming).'''
+
+    tiles = np.asarray(tiles).astype(np.uint8) & ((1 << bpp) - 1)
+    variants = ((0, tiles),
+                (FLIP_H, tiles[:, :, ::-1]),
+                (FLIP_V, tiles[:, ::-1, :]),
+                (FLIP_H | FLIP_V, tiles[:, ::-1, ::-1]))
+    keys = [[variant[idx].tobytes() for idx in range(len(tiles))] for _, variant in variants]
+    known = {} if known is None else known
+    unique = []
+    name_table = np.empty(len(tiles), dtype=np.uint16)
+    for idx in range(len(tiles)):
+        for (flags, _), variant_keys in zip(variants, keys):
+            if variant_keys[idx] in known:
+                name_table[idx] = known[variant_keys[idx]] | flags
+                break
+        else:
+            name_table[idx] = len(known)
+            known[keys[0][idx]] = len(known)
+            unique.append(idx)
+    return tiles[unique], name_table
+
+def encode_name_table(name_table):
+    '''name table entries are little endian words'''
+
+    return np.asarray(name_table, dtype="<u2").tobytes()
+
+def encode_row_colors(tiles, distances):
+    '''encodes (tiles, 8, 8) palette indices to 1bpp patterns with two colors
+    for every tile row (TMS9918 graphics II). The two most frequent colors
+    of a row are used, the higher palette index as foreground; other colors
+    take the nearer of both by the (colors, colors) distance matrix.
+    Returns the pattern bytes and the background and foreground index of
+    every row.'''
+
+    distances = np.asarray(distances)
+    count = len(distances)
+    rows = np.asarray(tiles, dtype=np.int64).reshape(-1, TILE_WIDTH)
+    histogram = np.zeros((len(rows), count), dtype=np.int64)
+    np.add.at(histogram, (np.arange(len(rows))[:, None], rows), 1)
+    # stable sort, on equal counts the lower index wins
+    order = np.argsort(-histogram, axis=1, kind="stable")
+    first = order[:, 0]
+    if count > 1:
+        second = np.where(histogram[np.arange(len(rows)), order[:, 1]] > 0, order[:, 1], (first == 0).astype(np.int64))
+    else:
+        second = first
+    bg, fg = np.minimum(first, second), np.maximum(first, second)
+    bits = distances[rows, fg[:, None]] < distances[rows, bg[:, None]]
+    return np.packbits(bits, axis=-1, bitorder="big").tobytes(), bg, fg
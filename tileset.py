@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''one tileset shared by many screens or a scrolling map
+
+ usage: tileset.py [--platform sms|gg] [--budget TILES] [--output BASE] [converter flags] image|dir [image|dir ..]
+
+ All images share one palette and are converted like screens, an image
+ may be larger than the screen (a map). The tiles of all images go into
+ one index, a tile which is a flipped copy of another one is stored once.
+ If there are more distinct tiles than fit into VRAM (budget), the most
+ similar tiles are merged until they fit: tiles are put into buckets of
+ tiles which agree on some randomly chosen pixels and only compared with
+ their neighbours in the bucket, the pair whose merge changes the colors
+ of the picture the least is merged first.
+ Platforms which dither by default get the ordered bayer mode, error
+ diffusion leaves hardly two tiles alike.
+
+ BASE.pal  the palette
+ BASE.bin  the tiles
+ image.nam the name table of every image, next to it'''
+
+import sys
+from os import path
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image
+
+import batch
+import gfxengine
+from metrics import Metrics
+import profiles
+import tiles
+
+# pixels a bucket agrees on at first, tables (draws of pixels) and the
+# neighbours of a tile inside its bucket which are compared
+BUCKET_PIXELS = 16
+BUCKET_TABLES = 4
+NEIGHBOURS = 4
+
+# rounds of picking pairs among the tiles left before the pairs are searched
+# again, more are faster but merge worse pairs
+MATCH_PASSES = 6
+
+# pairs whose distance is computed at a time
+DISTANCE_CHUNK = 65536
+
+# shared tiles, name table of every image, distinct tiles and the tiles merged away
+TileSet = namedtuple("TileSet", "tiles name_tables unique merged")
+
+
+def canonical_tiles(cells):
+    '''finds the distinct (cells, 8, 8) tiles, flipped copies included. Returns
+    the tiles, the number of the tile of every cell and the flip bits which
+    turn the tile into the cell.'''
+
+    cells = np.ascontiguousarray(cells, dtype=np.uint8)
+    if not len(cells):
+        return cells, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint16)
+    flags = np.array([0, tiles.FLIP_H, tiles.FLIP_V, tiles.FLIP_H | tiles.FLIP_V], dtype=np.uint16)
+    variants = np.stack([cells, cells[:, :, ::-1], cells[:, ::-1, :], cells[:, ::-1, ::-1]])
+    keys = np.ascontiguousarray(variants.reshape(4 * len(cells), -1))
+    # void keys sort like bytes, the smallest variant of a cell is the one stored
+    _, first, ranks = np.unique(keys.view(np.dtype((np.void, keys.shape[1]))).ravel(),
+                                return_index=True, return_inverse=True)
+    ranks = ranks.reshape(4, len(cells))
+    which = ranks.argmin(axis=0)
+    canonical = ranks[which, np.arange(len(cells))]
+    stored, numbers = np.unique(canonical, return_inverse=True)
+    return keys[first[stored]].reshape(-1, tiles.TILE_HEIGHT, tiles.TILE_WIDTH), numbers.reshape(-1), flags[which]
+
+def candidate_pairs(flat, pixels=BUCKET_PIXELS, tables=BUCKET_TABLES, neighbours=NEIGHBOURS, seed=0):
+    '''pairs of the (tiles, 64) palette indices which are likely close in
+    Hamming distance: for every table the tiles are sorted by the pixels in
+    a random order, tiles agreeing on the first pixels of the order share a
+    bucket (locality sensitive hashing) and every tile is paired with the
+    next tiles in its bucket. No all pairs comparison.'''
+
+    rng = np.random.default_rng(seed)
+    pairs = [np.zeros((0, 2), dtype=np.int64)]
+    for _ in range(tables):
+        order = rng.permutation(flat.shape[1])
+        shuffled = np.ascontiguousarray(flat[:, order])
+        ranks = np.argsort(shuffled.view(np.dtype((np.void, shuffled.shape[1]))).ravel(), kind="stable")
+        buckets = shuffled[ranks, :pixels]
+        for step in range(1, neighbours + 1):
+            same = (buckets[step:] == buckets[:-step]).all(axis=1)
+            pairs.append(np.stack([ranks[:-step][same], ranks[step:][same]], axis=1))
+    pairs = np.sort(np.concatenate(pairs), axis=1)
+    # unique over one number per pair is much faster than over rows
+    packed = np.unique(pairs[:, 0] * len(flat) + pairs[:, 1])
+    return np.stack([packed // len(flat), packed % len(flat)], axis=1)
+
+def tile_distances(flat, pairs, distances):
+    '''sums of the color distance of all pixels of the pairs of tiles,
+    distances holds the distance of every two palette entries'''
+
+    result = np.empty(len(pairs))
+    for start in range(0, len(pairs), DISTANCE_CHUNK):
+        chunk = pairs[start:start + DISTANCE_CHUNK]
+        result[start:start + DISTANCE_CHUNK] = distances[flat[chunk[:, 0]], flat[chunk[:, 1]]].sum(axis=1)
+    return result
+
+def match_pairs(pairs, count, limit):
+    '''picks up to limit pairs out of pairs sorted by cost, no two share a
+    tile: pairs which are the cheapest pair of both of their tiles are
+    taken, then again among the pairs of the tiles left (MATCH_PASSES times).'''
+
+    chosen = []
+    for _ in range(MATCH_PASSES):
+        if not len(pairs) or limit <= 0:
+            break
+        best = np.full(count, len(pairs))
+        np.minimum.at(best, pairs[:, 0], np.arange(len(pairs)))
+        np.minimum.at(best, pairs[:, 1], np.arange(len(pairs)))
+        mutual = (best[pairs[:, 0]] == np.arange(len(pairs))) & (best[pairs[:, 1]] == np.arange(len(pairs)))
+        taken = pairs[mutual][:limit]
+        chosen.append(taken)
+        limit -= len(taken)
+        free = np.ones(count, dtype=bool)
+        free[taken.ravel()] = False
+        pairs = pairs[free[pairs[:, 0]] & free[pairs[:, 1]]]
+    return np.concatenate(chosen) if chosen else np.zeros((0, 2), dtype=np.int64)
+
+def merge_tiles(unique, counts, colors, budget, weights=(profiles.PR, profiles.PG, profiles.PB)):
+    '''merges similar tiles until at most budget are left. Every round
+    searches the candidate pairs again and merges the cheapest ones which
+    don't overlap (see match_pairs), the cells of the less used tile of a
+    pair change. A round which finds too few pairs makes the buckets
+    coarser. Returns the number of the kept tile for every tile and the
+    kept tiles.'''
+
+    flat = unique.reshape(len(unique), -1)
+    colors = np.asarray(colors, dtype=np.float64).reshape(-1, 3)
+    distances = ((colors[:, None] - colors[None, :])**2 * weights).sum(axis=2)
+    targets = np.arange(len(unique))
+    kept = np.arange(len(unique))
+    counts = np.asarray(counts, dtype=np.int64).copy()
+    pixels = BUCKET_PIXELS
+    while len(kept) > budget:
+        excess = len(kept) - budget
+        pairs = candidate_pairs(flat[kept], pixels)
+        if len(pairs) < excess and pixels:
+            pixels //= 2
+        if not len(pairs):
+            continue
+        weight = np.minimum(counts[kept[pairs[:, 0]]], counts[kept[pairs[:, 1]]])
+        order = np.argsort(tile_distances(flat[kept], pairs, distances) * weight, kind="stable")
+        chosen = kept[match_pairs(pairs[order], len(kept), excess)]
+        swap = counts[chosen[:, 0]] > counts[chosen[:, 1]]
+        chosen[swap] = chosen[swap][:, ::-1]
+        targets[chosen[:, 0]] = chosen[:, 1]
+        np.add.at(counts, chosen[:, 1], counts[chosen[:, 0]])
+        kept = kept[targets[kept] == kept]
+    # tiles merged into a tile which was merged later on
+    while (targets[targets] != targets).any():
+        targets = targets[targets]
+    return np.searchsorted(kept, targets), unique[kept]
+
+def build_tileset(screens, colors, budget=tiles.VRAM_TILES):
+    '''builds one tileset for the (cells, 8, 8) tiles of all screens, returns a TileSet'''
+
+    # the name table addresses no more tiles
+    budget = max(1, min(budget, tiles.TILE_INDEX_MASK + 1))
+    sizes = [len(cells) for cells in screens]
+    cells = np.concatenate(screens) if screens else np.zeros((0, tiles.TILE_HEIGHT, tiles.TILE_WIDTH))
+    unique, numbers, flags = canonical_tiles(cells)
+    merged = 0
+    if len(unique) > budget:
+        counts = np.bincount(numbers, minlength=len(unique))
+        mapping, kept = merge_tiles(unique, counts, colors, budget)
+        numbers, merged, unique = mapping[numbers], len(unique) - len(kept), kept
+    entries = numbers.astype(np.uint16) | flags
+    name_tables = np.split(entries, np.cumsum(sizes)[:-1])
+    return TileSet(unique, name_tables, len(unique) + merged, merged)
+
+def convert_screens(images, profile="sms", dithering=None, grayscale=False, optimize=False,
+                    budget=tiles.VRAM_TILES, verbose=False, metrics=None):
+    '''converts opened images to one tileset, returns the palette bytes
+    and the TileSet or None if they can't be converted'''
+
+    profile = gfxengine.get_profile(profile)
+    metrics = metrics or Metrics()
+    if not profile.name_table:
+        print("tilesets aren't supported for %s" % profile.name)
+        return
+    if dithering is None:
+        dithering = "bayer" if profile.dither else False
+
+    with metrics.stage("prepare"):
+        # maps may be larger than the screen, the colors are checked for all images together
+        prepared = []
+        for img in images:
+            img = gfxengine.prepare(img, profile._replace(max_x=max(profile.max_x, img.width),
+                                    max_y=max(profile.max_y, img.height)), grayscale, None, True, verbose)
+            if img is None:
+                return
+            prepared.append(img)
+        strip = Image.fromarray(np.concatenate([np.asarray(img).reshape(-1, 3) for img in prepared])[None])
+    items = strip.getcolors(maxcolors=65536)
+    if items is None or not optimize and profile.max_colors is not None and len(items) > profile.max_colors:
+        print("too many colors")
+        # pil doesn't count more than 65536
+        if items is None or profile.strict:
+            return
+    with metrics.stage("palette"):
+        colors, matched, used = gfxengine.build_palette(strip, profile, optimize, metrics)
+    metrics.count("source_colors", len(colors))
+    metrics.count("palette_colors", len(used))
+    gfxengine.log(verbose, f"colors(#{len(used)}): {used}")
+
+    screens = []
+    for img in prepared:
+        rows = list(gfxengine.iter_tile_rows(img, profile, colors, matched, used, dithering, metrics=metrics))
+        indexed = np.concatenate(rows) if rows else np.zeros((0, img.width), dtype=np.uint8)
+        screens.append(tiles.split_tiles(indexed))
+    with metrics.stage("tileset"):
+        tileset = build_tileset(screens, used, budget)
+    metrics.count("screens", len(screens))
+    metrics.count("tiles", sum(len(cells) for cells in screens))
+    metrics.count("unique_tiles", tileset.unique)
+    metrics.count("merged_tiles", tileset.merged)
+    return gfxengine.encode_palette(used, profile), tileset
+
+def convert_files(file_names, profile="sms", output_base="tileset", verbose=False, dithering=None, grayscale=False,
+                  optimize=False, budget=tiles.VRAM_TILES, quiet=False, metrics=None, stats=None):
+    '''converts the images to one tileset and writes <output_base>.pal/.bin
+    and a .nam next to every image, returns the written file names or None'''
+
+    profile = gfxengine.get_profile(profile)
+    outputs = {".pal": output_base + ".pal", ".bin": output_base + ".bin"}
+    metrics = metrics or Metrics(output_base, profile.name)
+    verbose = verbose and not quiet
+
+    try:
+        images = []
+        with metrics.stage("decode"):
+            for file_name in file_names:
+                gfxengine.log(verbose, f"open {file_name}..")
+                with Image.open(file_name) as img:
+                    img.load()
+                    images.append(img)
+        converted = convert_screens(images, profile, dithering, grayscale, optimize, budget, verbose, metrics)
+        if converted is None:
+            metrics.count("failed")
+            return
+        palette, tileset = converted
+        if not quiet:
+            print("%d images, %d tiles, %d distinct, %d merged to fit %d" % (len(file_names),
+                  sum(len(table) for table in tileset.name_tables), tileset.unique, tileset.merged, budget))
+        parts = [(outputs[".pal"], palette), (outputs[".bin"], tiles.encode_tiles(tileset.tiles, profile.bpp))]
+        for file_name, table in zip(file_names, tileset.name_tables):
+            outputs[file_name] = path.splitext(file_name)[0] + ".nam"
+            parts.append((outputs[file_name], tiles.encode_name_table(table)))
+        with metrics.stage("write"):
+            for file_name, data in parts:
+                with open(file_name, "wb") as writer:
+                    writer.write(data)
+                metrics.count("bytes_written", len(data))
+        return outputs
+    finally:
+        metrics.finish(stats)
+
+def main():
+    args = sys.argv[1:]
+    platform, budget, output_base, flags, names = "sms", tiles.VRAM_TILES, "tileset", [], []
+    while args:
+        arg = args.pop(0)
+        if arg == "--platform" and args:
+            platform = args.pop(0).lower()
+        elif arg == "--budget" and args:
+            budget = int(args.pop(0))
+        elif arg == "--output" and args:
+            output_base = args.pop(0)
+        elif arg == "--stats" and args:
+            flags.extend((arg, args.pop(0)))
+        elif arg == "--dither" and args and args[0].lower() in profiles.DITHER_MODES:
+            flags.extend((arg, args.pop(0)))
+        elif arg.startswith("-"):
+            flags.append(arg)
+        else:
+            names.append(arg)
+
+    if platform not in profiles.PROFILES:
+        print("unknown platform %s" % platform)
+        return
+    if not names:
+        print("not enough arguments")
+        return
+    file_names = batch.collect_files(names)
+    if not file_names:
+        print("no images found")
+        return
+    options = profiles.parse_options(flags)
+    if options is None:
+        return
+    outputs = convert_files(file_names, platform, output_base, dithering=options["dithering"],
+                            grayscale=options["grayscale"], optimize=options["optimize"], budget=budget,
+                            quiet=options["quiet"], stats=options["stats"])
+    if outputs and not options["quiet"]:
+        print(" ".join(sorted(outputs.values())))
+
+if __name__ == '__main__':
+    main()
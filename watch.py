@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''converts images again whenever they change
+
+ usage: watch.py [--platform sms|gg|sg] [--poll] [--interval S] [--debounce S] [converter flags] dir [dir ..]
+
+ Watches the directories with inotify (Linux) or by polling the
+ modification times and waits until a burst of saves is over before
+ converting. Only the changed images are converted, the state of the
+ last conversion of every image is kept in memory: unchanged bands of
+ tile rows are reused (see gfxengine.convert_incremental). The outputs
+ are written next to the images (with --compress also the compressed
+ tiles), every conversion reports the latency from noticing the change
+ to the written files.'''
+
+import os
+from os import path
+import sys
+import time
+import struct
+import select
+
+import batch
+import profiles
+
+# inotify events which mean a file got new content
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class PollWatcher(object):
+    '''compares modification time and size of all images every interval'''
+
+    def __init__(self, directories, interval=0.5):
+        self.directories = directories
+        self.interval = interval
+        self.known = self.scan()
+
+    def scan(self):
+        known = {}
+        for file_name in batch.collect_files(self.directories):
+            try:
+                info = os.stat(file_name)
+            except OSError:
+                continue
+            known[file_name] = (info.st_mtime_ns, info.st_size)
+        return known
+
+    def wait(self, timeout=None):
+        '''returns the images which changed, after at most timeout seconds'''
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            current = self.scan()
+            changed = set(name for name, stamp in current.items() if self.known.get(name) != stamp)
+            self.known = current
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+            time.sleep(self.interval if deadline is None else max(0, min(self.interval, deadline - time.monotonic())))
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    '''reports images which were written or moved into the directories'''
+
+    def __init__(self, directories):
+        import ctypes
+        import ctypes.util
+
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories = {}
+        for directory in directories:
+            for root, _, _ in os.walk(directory):
+                self.add(root)
+
+    def add(self, directory):
+        descriptor = self.libc.inotify_add_watch(self.fd, os.fsencode(directory),
+                                                 IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+        if descriptor >= 0:
+            self.directories[descriptor] = directory
+
+    def wait(self, timeout=None):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        changed = set()
+        if not ready:
+            return changed
+        data = os.read(self.fd, 65536)
+        offset = 0
+        while offset < len(data):
+            descriptor, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0")
+            offset += EVENT_HEADER.size + length
+            file_name = path.join(self.directories.get(descriptor, ""), os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & IN_CREATE:
+                    self.add(file_name)
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and file_name.lower().endswith(batch.IMAGE_EXTENSIONS):
+                changed.add(file_name)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+def create_watcher(directories, poll=False, interval=0.5):
+    if not poll and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(directories)
+        except (OSError, AttributeError):
+            pass
+    return PollWatcher(directories, interval)
+
+def wait_for_changes(watcher, debounce=0.2):
+    '''blocks until images changed and no further change came in for debounce seconds,
+    returns them and the time the first change was noticed'''
+
+    changed = watcher.wait()
+    while not changed:
+        changed = watcher.wait()
+    noticed = time.perf_counter()
+    while True:
+        more = watcher.wait(debounce)
+        if not more:
+            return changed, noticed
+        changed |= more
+
+def reconvert(file_name, platform, options, states):
+    '''converts an image again, reusing the state of its last conversion,
+    returns the number of reused and all bands'''
+
+    from PIL import Image
+    import gfxengine
+    from metrics import Metrics
+
+    output_base = path.splitext(file_name)[0]
+    options = dict(options)
+    dedupe, stats = options.get("dedupe", False), options.pop("stats", None)
+    compression = options.pop("compression", None)
+    profile = gfxengine.get_profile(platform)
+    outputs = gfxengine.output_names(output_base, profile, dedupe, compression)
+    metrics = Metrics(file_name, platform)
+    try:
+        with Image.open(file_name) as img:
+            result, states[file_name], reused = gfxengine.convert_incremental(img, platform, states.get(file_name),
+                                                                              metrics=metrics, **options)
+        if result is None:
+            return None
+        gfxengine.write_result(result, outputs, metrics)
+        if compression:
+            import compress
+
+            extension = compress.CODECS[compression][0]
+            with metrics.stage("compress"):
+                compress.compress_file(outputs[".bin"], compression, profile.bpp, outputs[extension], check=False)
+            metrics.count("bytes_written", path.getsize(outputs[extension]))
+        return reused, len(states[file_name]["hashes"])
+    finally:
+        metrics.finish(stats)
+
+def watch(directories, platform="sms", options=None, poll=False, interval=0.5, debounce=0.2):
+    options = dict(options or {})
+    watcher = create_watcher(directories, poll, interval)
+    states = {}
+    print("watching %s (%s)" % (", ".join(directories), type(watcher).__name__))
+    try:
+        while True:
+            changed, noticed = wait_for_changes(watcher, debounce)
+            for file_name in sorted(changed):
+                if not path.exists(file_name):
+                    continue
+                start = time.perf_counter()
+                try:
+                    bands = reconvert(file_name, platform, options, states)
+                except Exception as error:
+                    print("%s failed (%s: %s)" % (file_name, type(error).__name__, error))
+                    continue
+                done = time.perf_counter()
+                if bands is None:
+                    print("%s can't be converted" % file_name)
+                else:
+                    print("%s %.1fms after the change (%.1fms converting), %d of %d bands reused" % (file_name,
+                          (done - noticed) * 1000, (done - start) * 1000, bands[0], bands[1]))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+def main():
+    args = sys.argv[1:]
+    platform, poll, interval, debounce = "sms", False, 0.5, 0.2
+    flags, directories = [], []
+    while args:
+        arg = args.pop(0)
+        if arg == "--platform" and args:
+            platform = args.pop(0).lower()
+        elif arg == "--poll":
+            poll = True
+        elif arg == "--interval" and args:
+            interval = float(args.pop(0))
+        elif arg == "--debounce" and args:
+            debounce = float(args.pop(0))
+        elif arg in ("--resize", "--stats", "--compress") and args:
+            flags.extend((arg, args.pop(0)))
+        elif arg == "--dither" and args and args[0].lower() in profiles.DITHER_MODES:
+            flags.extend((arg, args.pop(0)))
+        elif arg.startswith("-"):
+            flags.append(arg)
+        else:
+            directories.append(arg)
+
+    if platform not in profiles.PROFILES:
+        print("unknown platform %s" % platform)
+        return
+    if not directories:
+        print("not enough arguments")
+        return
+    options = profiles.parse_options(flags)
+    if options is None:
+        return
+    # sprite sheets and two palettes aren't converted incrementally
+    if options["sprites"] or options["palettes"] > 1:
+        print("watch doesn't support --sprites and --dual-palette")
+        return
+    for key in ("use_cache", "stream", "quiet", "sprites", "palettes"):
+        options.pop(key)
+    watch(directories, platform, options, poll, interval, debounce)
+
+if __name__ == '__main__':
+    main()